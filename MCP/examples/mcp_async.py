@@ -1,17 +1,22 @@
  # server_async.py
 from mcp.server.fastmcp import FastMCP
+from mcp.types import ToolAnnotations
 
 # Create an MCP server
 mcp = FastMCP(name="Demo", port=8165, host="0.0.0.0")
 
 
+# Deterministic tools: read-only and independent of external state, so clients may cache results
+DETERMINISTIC = ToolAnnotations(readOnlyHint=True, openWorldHint=False)
+
+
 # Add an addition tool
-@mcp.tool()
+@mcp.tool(annotations=DETERMINISTIC)
 async def add(a: int, b: int) -> int:
     """Add two numbers"""
     return a + b
 
-@mcp.tool()
+@mcp.tool(annotations=DETERMINISTIC)
 async def greet(name: str) -> str:
     """Returns a simple greeting."""
     return f"Hello, {name}!"
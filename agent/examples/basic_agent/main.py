@@ -15,6 +15,7 @@ import os
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
 from contextlib import asynccontextmanager
+from typing import Optional
 import uvicorn
 
 # 添加client目录到Python路径
@@ -25,14 +26,18 @@ client_path = os.path.join(project_root, 'client')
 sys.path.insert(0, client_path)
 
 from openai_client import OpenAIClient
+from base_client import Usage
+from session_store import SessionStore
 
-# 全局变量存储客户端
+# 全局变量存储客户端（共享连接与工具目录，不保存对话状态）
 openai_client = None
+# 每个请求/会话独立的对话状态
+session_store = None
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """应用生命周期管理"""
-    global openai_client
+    global openai_client, session_store
     
     # 启动时初始化OpenAI客户端
     print("🚀 初始化OpenAI客户端...")
@@ -53,6 +58,12 @@ async def lifespan(app: FastAPI):
     
     # 进入上下文
     await openai_client.__aenter__()
+    session_store = SessionStore(
+        openai_client,
+        max_sessions=int(os.getenv("SESSION_MAX_COUNT", "1000")),
+        ttl=float(os.getenv("SESSION_TTL", "1800")),
+        max_conversation_chars=int(os.getenv("SESSION_MAX_CHARS", "20000"))
+    )
     print("✅ OpenAI客户端初始化成功")
     
     yield
@@ -75,6 +86,7 @@ class ChatRequest(BaseModel):
     """聊天请求模型"""
     message: str
     system_prompt: str = None  # 可选的自定义系统提示词
+    session_id: Optional[str] = None  # 可选的会话ID，携带时保留多轮对话上下文
 
 # 响应模型  
 class ChatResponse(BaseModel):
@@ -82,6 +94,7 @@ class ChatResponse(BaseModel):
     response: str
     usage: dict
     model: str
+    session_id: Optional[str] = None
 
 # 默认系统提示词
 DEFAULT_SYSTEM_PROMPT = """你是一个有用、诚实和无害的AI助手。
@@ -126,31 +139,53 @@ async def chat(request: ChatRequest):
         if not openai_client:
             raise HTTPException(status_code=500, detail="OpenAI客户端未初始化")
         
-        # 构建完整的提示词
-        system_prompt = request.system_prompt or DEFAULT_SYSTEM_PROMPT
-        full_prompt = f"系统提示词：\n{system_prompt}\n\n用户消息：\n{request.message}"
-        
         print(f"📝 收到用户消息: {request.message[:50]}{'...' if len(request.message) > 50 else ''}")
         
-        # 调用OpenAI客户端
-        response = await openai_client.chat(full_prompt)
+        # 每个请求使用独立会话，并发请求之间不共享对话内容
+        async with session_store.session(request.session_id) as session:
+            # 新会话携带系统提示词，多轮会话的后续轮次只发送用户消息
+            if session.current_conversation:
+                prompt = request.message
+            else:
+                system_prompt = request.system_prompt or DEFAULT_SYSTEM_PROMPT
+                prompt = f"系统提示词：\n{system_prompt}\n\n用户消息：\n{request.message}"
+            
+            input_before = session.usage.input_tokens
+            output_before = session.usage.output_tokens
+            
+            # 调用OpenAI客户端
+            response = await session.chat(prompt)
+            
+            input_tokens = session.usage.input_tokens - input_before
+            output_tokens = session.usage.output_tokens - output_before
+        
+        # 累计到全局使用统计
+        openai_client.usage.input_tokens += input_tokens
+        openai_client.usage.output_tokens += output_tokens
         
         # 提取响应内容
         assistant_message = response["choices"][0]["message"]["content"]
         
-        # 构建响应
+        # 构建响应（本次请求的usage）
+        request_usage = Usage(
+            input_tokens=input_tokens,
+            output_tokens=output_tokens,
+            input_price=openai_client.usage.input_price,
+            output_price=openai_client.usage.output_price
+        )
         chat_response = ChatResponse(
             response=assistant_message,
             usage={
-                "input_tokens": openai_client.usage.input_tokens,
-                "output_tokens": openai_client.usage.output_tokens,
-                "total_tokens": openai_client.usage.total_tokens,
-                "total_cost": round(openai_client.usage.total_cost, 6)
+                "input_tokens": request_usage.input_tokens,
+                "output_tokens": request_usage.output_tokens,
+                "total_tokens": request_usage.total_tokens,
+                "total_cost": round(request_usage.total_cost, 6)
             },
-            model=response.get("model", "unknown")
+            model=response.get("model", "unknown"),
+            session_id=request.session_id
         )
         
-        print(f"✅ 响应生成成功，总计 {openai_client.usage.total_tokens} tokens")
+        print(f"✅ 响应生成成功，总计 {request_usage.total_tokens} tokens")
         
         return chat_response
         
@@ -173,7 +208,8 @@ async def get_stats():
             "output_cost": round(openai_client.usage.output_cost, 6),
             "total_cost": round(openai_client.usage.total_cost, 6)
         },
-        "available_tools": len(openai_client.get_available_tools()) if openai_client else 0
+        "available_tools": len(openai_client.get_available_tools()) if openai_client else 0,
+        "sessions": session_store.stats() if session_store else None
     }
 
 @app.post("/reset-stats")
@@ -5,7 +5,7 @@ Chat Agent配置管理
 
 import os
 import sys
-from typing import Optional, List
+from typing import Optional, List, Dict
 from pydantic_settings import BaseSettings
 from pydantic import Field
 from .redis_config import RedisConfig
@@ -73,6 +73,10 @@ class RedisSettings(BaseSettings):
     stream_ttl: int = Field(default_factory=lambda: RedisConfig.get_redis_config()["stream_ttl"], description="流式数据TTL(秒)")
     profile_ttl: int = Field(default_factory=lambda: RedisConfig.get_redis_config()["profile_ttl"], description="Profile数据TTL(秒)")
     
+    # 存储布局
+    profile_backend: str = Field(default="hash", description="Profile存储布局: hash(多键) / document(单文档)")
+    profile_update_retries: int = Field(default=5, description="Profile乐观并发写入（单文档CAS/多键WATCH）冲突重试次数")
+    
     class Config:
         env_prefix = "REDIS_"
 
@@ -84,6 +88,7 @@ class OpenAISettings(BaseSettings):
     max_tokens: int = Field(default=2000, description="最大token数")
     temperature: float = Field(default=0.7, description="创造性参数")
     timeout: int = Field(default=60, description="请求超时时间")
+    client_pool_size: int = Field(default=0, description="LLM客户端池大小（按需创建，0表示与最大并发客户数相同）")
     
     class Config:
         env_prefix = "OPENAI_"
@@ -101,6 +106,10 @@ class MemorySettings(BaseSettings):
     long_term_weight: float = Field(default=0.5, description="长期记忆权重")
     preference_weight: float = Field(default=0.3, description="偏好权重")
     
+    # 推测式上下文：只用最近几轮对话立即开始生成，完整Profile并行加载
+    speculative_context: bool = Field(default=False, description="启用推测式上下文")
+    speculative_history_turns: int = Field(default=5, description="推测式上下文使用的最近对话轮数")
+    
     class Config:
         env_prefix = "MEMORY_"
 
@@ -110,26 +119,85 @@ class ConcurrencySettings(BaseSettings):
     max_requests_per_user: int = Field(default=1, description="每客户最大请求数")
     request_timeout: int = Field(default=300, description="请求超时时间")
     cleanup_interval: int = Field(default=60, description="清理间隔(秒)")
+    lease_backend: str = Field(default="local", description="客户租约后端: local(进程内分片锁) / redis(跨进程)")
+    lease_ttl: float = Field(default=30.0, description="Redis租约有效期(秒)，心跳每1/3有效期续期一次")
+    lease_shards: int = Field(default=64, description="进程内租约锁分片数")
+    fence_record_ttl: int = Field(default=3600, description="Redis租约下已写入fencing token记录的保留时间(秒)")
+    queue_depth: int = Field(default=5, description="每客户最大排队请求数，超出时返回429")
+    queue_wait_timeout: float = Field(default=120.0, description="排队最长等待时间(秒)")
+    queue_poll_interval: float = Field(default=1.0, description="排队进度推送/跨实例重试间隔(秒)")
+    admission_enabled: bool = Field(default=True, description="启用全局准入控制")
+    admission_initial_limit: int = Field(default=20, description="自适应并发上限初始值")
+    admission_min_limit: int = Field(default=2, description="自适应并发上限下限")
+    admission_decrease_factor: float = Field(default=0.7, description="过载时并发上限的乘性下降系数")
+    admission_latency_tolerance: float = Field(default=2.0, description="上游首个输出事件延迟超过基线多少倍视为过载")
+    admission_priority_shares: Dict[str, float] = Field(
+        default_factory=lambda: {"premium": 1.0, "standard": 0.8, "basic": 0.6},
+        description="各服务等级可使用的并发上限比例"
+    )
     
     class Config:
         env_prefix = "CONCURRENCY_"
 
+class PersistenceSettings(BaseSettings):
+    """Profile写回配置"""
+    write_behind_enabled: bool = Field(default=True, description="启用异步写回（StoreProfile移出响应关键路径）")
+    workers: int = Field(default=4, description="写回worker数量")
+    queue_size: int = Field(default=1000, description="写回队列总容量")
+    enqueue_timeout: float = Field(default=0.5, description="队列满时入队等待时间(秒)，超时后同步写入")
+    max_retries: int = Field(default=3, description="写入失败重试次数")
+    retry_backoff: float = Field(default=0.5, description="重试退避基数(秒)")
+    drain_timeout: float = Field(default=30.0, description="关闭时排空队列的最长等待时间(秒)")
+    flush_wait_timeout: float = Field(default=5.0, description="新请求等待同一客户上一轮写回完成的最长时间(秒)")
+    turn_marker_ttl: int = Field(default=86400, description="对话写入幂等标记的保留时间(秒)，需覆盖写回重试窗口")
+    
+    class Config:
+        env_prefix = "PERSIST_"
+
 class StreamSettings(BaseSettings):
     """流式处理配置"""
     chunk_size: int = Field(default=50, description="chunk缓存大小")
+    max_chunks: int = Field(default=10000, description="单次生成最多写入的数据块数，达到上限时停止写入并发送错误终止事件")
     write_interval: float = Field(default=0.1, description="Redis写入间隔(秒)")
     read_interval: float = Field(default=0.05, description="Redis读取间隔(秒)")
     enable_compression: bool = Field(default=False, description="启用内容压缩")
+    cleanup_batch_size: int = Field(default=500, description="过期流式数据每批清理的键数量")
+    json_backend: str = Field(default="auto", description="流式数据JSON序列化实现: auto/orjson/json")
+    sse_heartbeat_interval: float = Field(default=15.0, description="SSE心跳间隔(秒)，0表示不发送")
+    sse_flush_window: float = Field(default=0.0, description="SSE合并写入窗口(秒)，0表示只合并已就绪的帧")
+    sse_max_batch_bytes: int = Field(default=65536, description="SSE单次写入最大字节数")
+    sse_buffer_bytes: int = Field(default=1048576, description="每个连接的SSE缓冲区上限(字节)，超出时挂起上游")
+    sse_retry_ms: int = Field(default=3000, description="建议客户端的重连间隔(毫秒)，0表示不发送")
+    shutdown_drain_timeout: float = Field(default=30.0, description="服务关闭时等待进行中流式生成的最长时间(秒)")
     
     class Config:
         env_prefix = "STREAM_"
 
+class CacheSettings(BaseSettings):
+    """进程内缓存配置"""
+    profile_cache_enabled: bool = Field(default=True, description="启用进程内Profile缓存")
+    profile_cache_size: int = Field(default=10000, description="Profile缓存最大客户数")
+    profile_cache_ttl: int = Field(default=300, description="Profile缓存TTL(秒)")
+    invalidation_channel: str = Field(default="profile:invalidate", description="跨进程缓存失效通知频道")
+    
+    class Config:
+        env_prefix = "CACHE_"
+
 class MonitoringSettings(BaseSettings):
     """监控配置"""
     enable_metrics: bool = Field(default=True, description="启用指标收集")
     metrics_port: int = Field(default=9090, description="指标端口")
     log_level: str = Field(default="INFO", description="日志级别")
     enable_health_check: bool = Field(default=True, description="启用健康检查")
+    redis_info_cache_ttl: float = Field(default=5.0, description="Redis INFO采样缓存时间(秒)")
+    stats_bucket_seconds: int = Field(default=60, description="使用统计时间桶长度(秒)")
+    stats_counter_shards: int = Field(default=8, description="每个时间桶的计数器分片数")
+    stats_rollup_interval: float = Field(default=30.0, description="时间桶汇总到每日统计的间隔(秒)")
+    stats_retention_days: int = Field(default=30, description="每日统计保留天数")
+    trace_enabled: bool = Field(default=True, description="启用链路追踪")
+    trace_buffer_size: int = Field(default=200, description="内存中保留的最近trace数")
+    trace_max_spans: int = Field(default=256, description="单条trace最多保留的span数，超出的叶子span只计数")
+    trace_file_path: str = Field(default="", description="trace JSON Lines导出文件，为空时只保留在内存")
     
     class Config:
         env_prefix = "MONITORING_"
@@ -148,6 +216,8 @@ class AppSettings(BaseSettings):
     memory: MemorySettings = Field(default_factory=MemorySettings)
     concurrency: ConcurrencySettings = Field(default_factory=ConcurrencySettings)
     stream: StreamSettings = Field(default_factory=StreamSettings)
+    cache: CacheSettings = Field(default_factory=CacheSettings)
+    persistence: PersistenceSettings = Field(default_factory=PersistenceSettings)
     monitoring: MonitoringSettings = Field(default_factory=MonitoringSettings)
     
     class Config:
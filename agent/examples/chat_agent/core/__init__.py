@@ -2,14 +2,57 @@
 from .load_profile import LoadProfile
 from .chat_processor import ChatProcessor  
 from .store_profile import StoreProfile
+from .pipeline import Pipeline, PipelineRun, Stage, StageResult, PipelineError
 from .core import CoreFlow, ParallelCoreFlow, create_core_flow, process_chat_request
+from .write_behind import WriteBehindQueue, get_write_behind_queue
+from .user_manager import (
+    UserLease, UserLeaseManager, LeaseLostError, get_user_lease_manager,
+    UserRequestQueue, QueuePosition, UserQueueFullError, UserQueueTimeoutError, get_user_request_queue
+)
+from .admission import AdmissionController, AdmissionTicket, get_admission_controller
+from .container import AppContainer, LLMClientPool, init_container, get_container, close_container
+from .stream_relay import (
+    GenerationRegistry, GenerationRunningError, get_generation_registry,
+    tail_stream, publish_final, reset_stream, stream_exists
+)
 
 __all__ = [
     "LoadProfile", 
     "ChatProcessor", 
     "StoreProfile", 
+    "Pipeline",
+    "PipelineRun",
+    "Stage",
+    "StageResult",
+    "PipelineError",
     "CoreFlow", 
     "ParallelCoreFlow",
     "create_core_flow",
-    "process_chat_request"
+    "process_chat_request",
+    "WriteBehindQueue",
+    "get_write_behind_queue",
+    "UserLease",
+    "UserLeaseManager",
+    "LeaseLostError",
+    "get_user_lease_manager",
+    "UserRequestQueue",
+    "QueuePosition",
+    "UserQueueFullError",
+    "UserQueueTimeoutError",
+    "get_user_request_queue",
+    "AdmissionController",
+    "AdmissionTicket",
+    "get_admission_controller",
+    "AppContainer",
+    "LLMClientPool",
+    "init_container",
+    "get_container",
+    "close_container",
+    "GenerationRegistry",
+    "GenerationRunningError",
+    "get_generation_registry",
+    "tail_stream",
+    "publish_final",
+    "reset_stream",
+    "stream_exists"
 ] 
\ No newline at end of file
@@ -0,0 +1,208 @@
+"""
+全局准入控制模块
+- 自适应并发上限（AIMD）：上游延迟正常且上限被用满时加性增长，延迟劣化、超时或失败时乘性下降，
+  上限不超过 ConcurrencySettings.max_concurrent_users；延迟信号为上游首个输出事件的延迟，
+  不含工具调用和生成时长（回复长短、工具快慢与上游是否过载无关）
+- 优先级：按 CustomerProfile.service_level 划分可用份额，过载时先拒绝低等级客户；
+  等级优先读取进程内Profile缓存，未命中时读取存储中的Profile
+- 快速拒绝：超过份额立即返回，由调用方响应503并携带Retry-After
+"""
+
+import math
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Any, Optional
+
+from utils.logger import get_logger
+from storage.redis_client import get_redis_client
+from storage.profile_cache import get_profile_cache
+from storage.profile_storage import get_profile_document_store
+from config.settings import get_settings, ConcurrencySettings
+
+logger = get_logger(__name__)
+
+# 未知服务等级按standard处理
+DEFAULT_SERVICE_LEVEL = "standard"
+
+
+@dataclass
+class AdmissionTicket:
+    """准入凭证，请求结束时必须归还"""
+    uid: str
+    service_level: str
+    admitted_at: float = field(default_factory=time.monotonic)
+
+
+class AdmissionController:
+    """自适应并发准入控制器"""
+
+    def __init__(self, settings: ConcurrencySettings):
+        self.max_limit = max(1, settings.max_concurrent_users)
+        self.min_limit = max(1, min(settings.admission_min_limit, self.max_limit))
+        self.limit = float(min(max(settings.admission_initial_limit, self.min_limit), self.max_limit))
+        self.decrease_factor = settings.admission_decrease_factor
+        self.latency_tolerance = settings.admission_latency_tolerance
+        self.priority_shares = settings.admission_priority_shares
+
+        self.inflight = 0
+        self._inflight_by_level: Dict[str, int] = {}
+
+        # 上游延迟基线（慢速EWMA）与最近延迟（快速EWMA）
+        self._baseline_latency: Optional[float] = None
+        self._recent_latency: Optional[float] = None
+        # 两次下降之间至少间隔一个典型耗时，避免同一波慢请求连续砍半
+        self._last_decrease = 0.0
+
+        # 统计
+        self.admitted = 0
+        self.shed = 0
+        self.shed_by_level: Dict[str, int] = {}
+
+    def service_level_of(self, uid: str) -> str:
+        """从进程内Profile缓存读取客户服务等级（不产生Redis请求），未命中时按standard处理"""
+        cache = get_profile_cache()
+        entry = cache.peek(uid) if cache else None
+        return self._known_level(entry.profile.service_level if entry else None)
+
+    async def resolve_service_level(self, uid: str) -> str:
+        """
+        解析客户服务等级：优先读取进程内Profile缓存，未命中时读取存储中的Profile
+        Hash布局只读取service_level字段；单文档布局读取整个文档并回填缓存，随后的LoadProfile直接命中
+        """
+        cache = get_profile_cache()
+        entry = cache.peek(uid) if cache else None
+        if entry:
+            return self._known_level(entry.profile.service_level)
+
+        try:
+            if get_settings().redis.profile_backend == "document":
+                snapshot = await get_profile_document_store().load(uid)
+                if snapshot is None:
+                    return DEFAULT_SERVICE_LEVEL
+                if cache:
+                    cache.put(uid, snapshot.profile.model_copy(), snapshot.memory.model_copy(), dict(snapshot.preferences))
+                return self._known_level(snapshot.profile.service_level)
+
+            redis_client = await get_redis_client()
+            return self._known_level(await redis_client.hget(f"profile:{uid}", "service_level"))
+        except Exception as e:
+            logger.warning(f"读取客户服务等级失败 {uid}: {str(e)}")
+            return DEFAULT_SERVICE_LEVEL
+
+    def _known_level(self, level: Optional[str]) -> str:
+        """未配置份额的等级按standard处理"""
+        return level if level in self.priority_shares else DEFAULT_SERVICE_LEVEL
+
+    def try_acquire(self, uid: str, service_level: Optional[str] = None) -> Optional[AdmissionTicket]:
+        """
+        尝试准入
+
+        Returns:
+            Optional[AdmissionTicket]: 超过该等级可用份额时返回None
+        """
+        level = service_level or self.service_level_of(uid)
+        allowed = self._allowed(level)
+        if self.inflight >= allowed:
+            self.shed += 1
+            self.shed_by_level[level] = self.shed_by_level.get(level, 0) + 1
+            logger.warning(f"🚦 准入拒绝: {uid} ({level}), 并发 {self.inflight}/{allowed}")
+            return None
+
+        self.inflight += 1
+        self._inflight_by_level[level] = self._inflight_by_level.get(level, 0) + 1
+        self.admitted += 1
+        return AdmissionTicket(uid=uid, service_level=level)
+
+    def has_capacity(self, uid: str, service_level: Optional[str] = None) -> bool:
+        """当前是否有该客户等级的可用份额（只检查，不占用）"""
+        level = service_level or self.service_level_of(uid)
+        return self.inflight < self._allowed(level)
+
+    def _allowed(self, level: str) -> int:
+        """该等级可使用的并发数：低等级只能使用上限的一部分，剩余容量留给高等级客户"""
+        share = self.priority_shares.get(level, self.priority_shares.get(DEFAULT_SERVICE_LEVEL, 1.0))
+        return max(1, math.floor(self.limit * share))
+
+    def release(self, ticket: AdmissionTicket, latency: Optional[float] = None, failed: bool = False):
+        """
+        归还准入凭证并根据本次结果调整并发上限
+
+        Args:
+            ticket: 准入凭证
+            latency: 上游首个输出事件的延迟(秒)，没有调用LLM时为None
+            failed: 是否失败或超时
+        """
+        saturated = self.inflight >= math.floor(self.limit)
+        self.inflight = max(0, self.inflight - 1)
+        remaining = self._inflight_by_level.get(ticket.service_level, 1) - 1
+        if remaining > 0:
+            self._inflight_by_level[ticket.service_level] = remaining
+        else:
+            self._inflight_by_level.pop(ticket.service_level, None)
+
+        if failed:
+            self._decrease("请求失败或超时")
+            return
+        if latency is None:
+            return
+
+        self._observe(latency)
+        if self._recent_latency > self._baseline_latency * self.latency_tolerance:
+            self._decrease(f"上游延迟 {self._recent_latency:.2f}s 超过基线 {self._baseline_latency:.2f}s")
+        elif saturated:
+            # 加性增长：每个上限周期约+1
+            self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+
+    def retry_after(self) -> int:
+        """建议客户端重试等待时间(秒)"""
+        latency = self._recent_latency or 1.0
+        return int(min(60, max(1, math.ceil(latency / 2))))
+
+    def stats(self) -> Dict[str, Any]:
+        """准入统计"""
+        return {
+            "limit": round(self.limit, 2),
+            "max_limit": self.max_limit,
+            "inflight": self.inflight,
+            "inflight_by_level": dict(self._inflight_by_level),
+            "baseline_latency": round(self._baseline_latency, 3) if self._baseline_latency else None,
+            "recent_latency": round(self._recent_latency, 3) if self._recent_latency else None,
+            "admitted": self.admitted,
+            "shed": self.shed,
+            "shed_by_level": dict(self.shed_by_level)
+        }
+
+    def _observe(self, latency: float):
+        if self._baseline_latency is None:
+            self._baseline_latency = self._recent_latency = latency
+            return
+        self._recent_latency = 0.7 * self._recent_latency + 0.3 * latency
+        # 基线只缓慢上升、较快下降，过载期间不会被慢请求迅速拉高
+        alpha = 0.01 if latency > self._baseline_latency else 0.1
+        self._baseline_latency += alpha * (latency - self._baseline_latency)
+
+    def _decrease(self, reason: str):
+        now = time.monotonic()
+        if now - self._last_decrease < (self._recent_latency or 1.0):
+            return
+        self._last_decrease = now
+        previous = self.limit
+        self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+        logger.warning(f"📉 并发上限下调 {previous:.1f} -> {self.limit:.1f}: {reason}")
+
+
+# 全局准入控制器实例
+_admission_controller: Optional[AdmissionController] = None
+
+def get_admission_controller() -> Optional[AdmissionController]:
+    """获取全局准入控制器，未启用时返回None"""
+    global _admission_controller
+
+    settings = get_settings().concurrency
+    if not settings.admission_enabled:
+        return None
+
+    if _admission_controller is None:
+        _admission_controller = AdmissionController(settings)
+
+    return _admission_controller
@@ -4,7 +4,7 @@
 """
 
 import asyncio
-import json
+import time
 import uuid
 from typing import Dict, Any, Optional, AsyncGenerator
 from datetime import datetime
@@ -13,15 +13,28 @@ from utils.logger import get_logger
 from utils.status_codes import ChatStatus, create_status_info
 from models.api_models import CustomerProfile, CustomerMemory
 from storage.redis_client import get_redis_client
+from storage.stream_storage import track_stream_keys
+from .stream_relay import queue_stream_reset, publish_final
+from utils.monitoring import get_metrics_registry
+from utils.tracing import get_tracer
+from utils.serialization import dumps, dump_chunk
 from config.settings import get_settings
 
 logger = get_logger(__name__)
 
+# 上游输出之前的确认事件，不计入上游延迟
+UPSTREAM_PRELUDE_CHUNK_TYPES = {"response.created", "response.in_progress"}
+
 class ChatProcessor:
     """聊天处理核心"""
     
-    def __init__(self):
+    def __init__(self, llm_pool=None):
+        """
+        Args:
+            llm_pool: 可选的LLM客户端池（由应用容器注入），未提供时每次请求创建新客户端
+        """
         self.settings = get_settings()
+        self.llm_pool = llm_pool
         
     async def process(self, enhanced_data: Dict[str, Any]) -> Dict[str, Any]:
         """
@@ -51,7 +64,9 @@ class ChatProcessor:
             redis_client = await get_redis_client()
             
             # 构建对话上下文
-            context = await self._build_context(enhanced_data)
+            tracer = get_tracer()
+            with tracer.span("ChatProcessor.build_context"):
+                context = await self._build_context(enhanced_data)
             
             # 初始化流式存储
             stream_key = f"stream:{uid}:{session_id}"
@@ -65,22 +80,57 @@ class ChatProcessor:
             # 流式生成对话
             response_content = ""
             tokens_used = 0
-            
-            async for chunk_data in self._generate_stream_response(context, enhanced_data):
+            llm_started = time.monotonic()
+            first_token_at = None
+            # 上游延迟：从借到客户端发起请求（start信号）到上游首个输出事件，不含排队借用客户端、工具调用和生成时长
+            upstream_started = None
+            upstream_latency = None
+            registry = get_metrics_registry()
+            llm_span = tracer.start_span("llm.stream", model=self.settings.openai.model)
+            # 工具调用span：输出项完成时开启，下一个chunk到达时结束（覆盖MCP调用及下一轮请求的建立）
+            tool_span = None
+            # 数据块数量上限：列表不裁剪（下标即事件ID），达到上限时截断本轮生成
+            chunks_written = 0
+            max_chunks = self.settings.stream.max_chunks
+            
+            stream = self._generate_stream_response(context, enhanced_data)
+            async for chunk_data in stream:
+                if tool_span:
+                    tool_span.end()
+                    tool_span = None
+                
+                if chunks_written >= max_chunks:
+                    await self._truncate_stream(uid, session_id, max_chunks)
+                    await stream.aclose()
+                    break
+                
                 # 写入Redis流式存储
                 await self._write_stream_chunk(redis_client, stream_key, chunk_data)
+                chunks_written += 1
                 
                 # 处理OpenAI客户端返回的不同类型的chunk
                 chunk_type = chunk_data.get("type", "")
                 logger.debug(f"📦 处理chunk类型: {chunk_type}")
                 
+                if (
+                    upstream_latency is None and upstream_started is not None
+                    and chunk_type not in UPSTREAM_PRELUDE_CHUNK_TYPES and chunk_type != "error"
+                ):
+                    upstream_latency = time.monotonic() - upstream_started
+                
                 if chunk_type == "start":
+                    upstream_started = time.monotonic()
                     # 开始信号
                     logger.info("🎯 收到开始信号")
                 elif chunk_type == "response.output_text.delta":
                     # OpenAI流式响应的文本内容增量
                     delta_content = chunk_data.get("delta", "")
                     if delta_content:
+                        if first_token_at is None:
+                            first_token_at = time.monotonic()
+                            registry.histogram("llm_ttft_seconds", "LLM首token延迟").observe(first_token_at - llm_started)
+                            if llm_span:
+                                llm_span.set_attribute("ttft_ms", round((first_token_at - llm_started) * 1000, 2))
                         response_content += delta_content
                         logger.debug(f"📝 累积内容长度: {len(response_content)}")
                 elif chunk_type == "response.output_text.done":
@@ -90,6 +140,14 @@ class ChatProcessor:
                         # 如果没有通过delta累积到内容，使用完整文本
                         response_content = full_text
                         logger.info(f"📄 使用完整文本，长度: {len(response_content)}")
+                elif chunk_type == "response.output_item.done":
+                    # 工具调用在输出项完成时计数
+                    item = chunk_data.get("item") or {}
+                    if item.get("type") == "function_call":
+                        tool_name = item.get("name", "unknown")
+                        registry.counter("llm_tool_calls_total", "LLM工具调用次数", tool=tool_name).inc()
+                        with tracer.activate(llm_span):
+                            tool_span = tracer.start_span(f"tool {tool_name}", tool=tool_name)
                 elif chunk_type == "response.completed":
                     # 完成信号，包含usage信息
                     logger.info("🎉 收到完成信号")
@@ -104,13 +162,33 @@ class ChatProcessor:
                     # 错误信号
                     error_msg = chunk_data.get("error", "未知错误")
                     logger.error(f"❌ 收到错误信号: {error_msg}")
+                    if llm_span:
+                        llm_span.error = error_msg
                     break
             
+            if tool_span:
+                tool_span.end()
+            
+            # LLM耗时与生成速度
+            llm_duration = time.monotonic() - llm_started
+            registry.histogram("llm_duration_seconds", "LLM生成总耗时").observe(llm_duration)
+            if tokens_used and first_token_at is not None:
+                generation_time = time.monotonic() - first_token_at
+                if generation_time > 0:
+                    registry.histogram("llm_tokens_per_second", "LLM生成速度(token/s)").observe(tokens_used / generation_time)
+                    if llm_span:
+                        llm_span.set_attribute("tokens_per_second", round(tokens_used / generation_time, 2))
+            if llm_span:
+                llm_span.set_attribute("tokens", tokens_used)
+                llm_span.end()
+            
             # 完成处理
             completion_data = {
                 **enhanced_data,
                 "response_content": response_content,
                 "tokens_used": tokens_used,
+                "llm_duration": llm_duration,
+                "llm_upstream_latency": upstream_latency,
                 "session_id": session_id,
                 "stream_key": stream_key,
                 "processing_timestamp": datetime.now(),
@@ -154,6 +232,15 @@ class ChatProcessor:
             memory: CustomerMemory = enhanced_data.get("customer_memory") 
             message = enhanced_data.get("message")
             
+            # 推测式上下文：完整Profile尚未加载完成时只使用最近几轮对话
+            if "hot_history" in enhanced_data:
+                get_metrics_registry().counter(
+                    "chat_speculative_context_total", "推测式上下文的来源",
+                    source="full" if memory is not None else "hot"
+                ).inc()
+                if memory is None and enhanced_data["hot_history"]:
+                    memory = CustomerMemory(short_term=enhanced_data["hot_history"], total_context_tokens=0)
+            
             # 使用固定的默认系统提示词
             system_prompt = self._get_default_system_prompt()
             
@@ -211,8 +298,13 @@ class ChatProcessor:
                 "chunks": []
             }
             
-            await redis_client.hset(stream_key, "metadata", json.dumps(init_data))
-            await redis_client.expire(stream_key, self.settings.redis.stream_ttl)
+            # 清除同一会话上一轮的数据块和终止事件；元数据与chunks键一起登记到过期索引，
+            # 进程中途退出也能被后台清理
+            pipe = redis_client.pipeline(transaction=True)
+            queue_stream_reset(pipe, stream_key)
+            pipe.hset(stream_key, "metadata", dumps(init_data))
+            track_stream_keys(pipe, self.settings.redis.stream_ttl, stream_key, f"{stream_key}:chunks")
+            await pipe.execute()
             
         except Exception as e:
             logger.warning(f"流式存储初始化失败: {str(e)}")
@@ -220,22 +312,30 @@ class ChatProcessor:
     async def _write_stream_chunk(self, redis_client, stream_key: str, chunk_data: Dict[str, Any]):
         """写入流式数据块"""
         try:
-            chunk_with_timestamp = {
+            # 序列化一次，SSE端点按原始字节转发；type放在首位便于读取端直接识别
+            payload = dump_chunk(chunk_data.get("type", ""), {
                 **chunk_data,
                 "timestamp": datetime.now().isoformat()
-            }
-            
-            await redis_client.lpush(
-                f"{stream_key}:chunks", 
-                json.dumps(chunk_with_timestamp, ensure_ascii=False)
-            )
+            })
             
-            # 限制chunks数量，避免内存过度使用
-            await redis_client.ltrim(f"{stream_key}:chunks", 0, 1000)
+            # 按生成顺序追加，列表下标即SSE事件ID（不做裁剪，否则下标会移动；由TTL统一清理）
+            await redis_client.rpush(f"{stream_key}:chunks", payload)
             
         except Exception as e:
             logger.warning(f"流式数据写入失败: {str(e)}")
     
+    async def _truncate_stream(self, uid: str, session_id: str, max_chunks: int):
+        """数据块达到上限：停止写入，发送错误终止事件（后续的完成事件不会覆盖它）"""
+        logger.warning(f"⚠️ 流式输出超过{max_chunks}个数据块，停止写入: {uid}/{session_id}")
+        get_metrics_registry().counter("chat_stream_truncated_total", "数据块超出上限被截断的生成数").inc()
+        await publish_final(uid, session_id, {
+            "type": "error",
+            "error": f"输出超过{max_chunks}个数据块的上限，已截断",
+            "uid": uid,
+            "session_id": session_id,
+            "timestamp": datetime.now().isoformat()
+        })
+    
     async def _complete_stream_storage(self, redis_client, stream_key: str, completion_data: Dict[str, Any]):
         """完成流式存储"""
         try:
@@ -246,47 +346,56 @@ class ChatProcessor:
                 "response_length": len(completion_data.get("response_content", ""))
             }
             
-            await redis_client.hset(stream_key, "completion", json.dumps(completion_info))
+            # 完成后续期，chunks键此时已存在，可以设置TTL
+            pipe = redis_client.pipeline(transaction=False)
+            pipe.hset(stream_key, "completion", dumps(completion_info))
+            track_stream_keys(pipe, self.settings.redis.stream_ttl, stream_key, f"{stream_key}:chunks")
+            await pipe.execute()
             
         except Exception as e:
             logger.warning(f"流式存储完成标记失败: {str(e)}")
     
+    def create_client(self):
+        """按服务配置创建OpenAI客户端（不允许请求覆盖）"""
+        from client.openai_client import OpenAIClient
+        
+        api_key = self.settings.openai.api_key
+        base_url = self.settings.openai.base_url
+        # mcp_url = "http://39.103.228.66:8165/mcp/"
+        mcp_urls = []  # MCP服务地址，可以考虑加入配置
+        
+        logger.info(f"  - 模型: {self.settings.openai.model}")
+        logger.info(f"  - Base URL: {base_url}")
+        logger.info(f"  - MCP URL: {mcp_urls}")
+        logger.info(f"  - API Key前8位: {api_key[:8] if api_key else 'None'}")
+        
+        client_kwargs = {}
+        if base_url:
+            client_kwargs["base_url"] = base_url
+        
+        logger.info("🚀 创建OpenAI客户端实例...")
+        return OpenAIClient(
+            api_key=api_key,
+            model=self.settings.openai.model,
+            mcp_urls=mcp_urls,
+            **client_kwargs
+        )
+    
     async def _generate_stream_response(self, context: str, enhanced_data: Dict[str, Any]) -> AsyncGenerator[Dict[str, Any], None]:
         """生成流式响应（调用OpenAI客户端）"""
         client = None
         try:
-            # 使用服务配置（不允许请求覆盖）
-            api_key = self.settings.openai.api_key
-            base_url = self.settings.openai.base_url
-            # mcp_url = "http://39.103.228.66:8165/mcp/"
-            mcp_urls = []  # MCP服务地址，可以考虑加入配置
-            
-            logger.info(f"🔧 准备创建OpenAI客户端...")
-            logger.info(f"  - 模型: {self.settings.openai.model}")
-            logger.info(f"  - Base URL: {base_url}")
-            logger.info(f"  - MCP URL: {mcp_urls}")
-            logger.info(f"  - API Key前8位: {api_key[:8] if api_key else 'None'}")
-            
-            # 创建OpenAI客户端
-            from client.openai_client import OpenAIClient
-            
-            client_kwargs = {}
-            if base_url:
-                client_kwargs["base_url"] = base_url
-            
-            # 创建并初始化客户端
-            logger.info("🚀 创建OpenAI客户端实例...")
-            client = OpenAIClient(
-                api_key=api_key,
-                model=self.settings.openai.model,
-                mcp_urls=mcp_urls,
-                **client_kwargs
-            )
-            
-            # 手动初始化客户端（调用__aenter__）
-            logger.info("🔌 初始化客户端连接...")
-            await client.__aenter__()
-            logger.info("✅ 客户端初始化完成")
+            if self.llm_pool:
+                # 从客户端池借用已初始化的客户端，复用HTTP连接和MCP工具列表
+                client = await self.llm_pool.acquire()
+            else:
+                logger.info(f"🔧 准备创建OpenAI客户端...")
+                client = self.create_client()
+                
+                # 手动初始化客户端（调用__aenter__）
+                logger.info("🔌 初始化客户端连接...")
+                await client.__aenter__()
+                logger.info("✅ 客户端初始化完成")
             
             # 发送开始信号
             logger.info("🎯 开始流式对话生成...")
@@ -325,8 +434,10 @@ class ChatProcessor:
             yield {"type": "error", "error": str(e)}
             
         finally:
-            # 确保客户端被正确关闭
-            if client:
+            # 池化客户端归还（归还时reset），否则确保客户端被正确关闭
+            if client and self.llm_pool:
+                await self.llm_pool.release(client)
+            elif client:
                 try:
                     logger.info("🔌 关闭客户端连接...")
                     await client.__aexit__(None, None, None)
@@ -0,0 +1,196 @@
+"""
+应用级组件容器
+在lifespan中初始化一次，持有Redis客户端、缓存、LLM客户端池和各阶段实例，
+请求处理只复用这些长生命周期对象；阶段实例本身不保存请求状态
+"""
+
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Dict, Any, Optional, List, Callable
+
+from utils.logger import get_logger
+from storage.redis_client import RedisClient, get_redis_client
+from storage.profile_cache import ProfileCache, get_profile_cache
+from config.settings import get_settings, AppSettings
+from .load_profile import LoadProfile
+from .chat_processor import ChatProcessor
+from .store_profile import StoreProfile
+from .write_behind import WriteBehindQueue, get_write_behind_queue
+from .core import CoreFlow, ParallelCoreFlow
+
+logger = get_logger(__name__)
+
+
+class LLMClientPool:
+    """
+    LLM客户端池
+    复用底层HTTP连接和MCP工具发现结果，归还时调用BaseLLMClient.reset()清理对话状态与usage
+    """
+
+    def __init__(self, factory: Callable[[], Any], size: int):
+        self.factory = factory
+        self.size = max(1, size)
+        self._idle: asyncio.LifoQueue = asyncio.LifoQueue()
+        self._created = 0
+        self._in_use = 0
+        self._clients: List[Any] = []
+        # 归还或丢弃客户端时通知等待者：有空闲实例可借，或有名额可新建
+        self._available = asyncio.Condition()
+
+    async def acquire(self):
+        """借出一个已初始化的客户端，池满时等待归还"""
+        async with self._available:
+            while self._idle.empty() and self._created >= self.size:
+                await self._available.wait()
+            if not self._idle.empty():
+                self._in_use += 1
+                return self._idle.get_nowait()
+            # 先占住名额，创建过程不持有锁
+            self._created += 1
+
+        try:
+            client = self.factory()
+            # 初始化MCP连接（只在创建时执行一次）
+            await client.__aenter__()
+        except BaseException:
+            async with self._available:
+                self._created -= 1
+                self._available.notify()
+            raise
+        self._clients.append(client)
+        self._in_use += 1
+        return client
+
+    async def release(self, client):
+        """归还客户端，重置失败的实例被丢弃并让出名额"""
+        self._in_use -= 1
+        try:
+            await client.reset()
+        except Exception as e:
+            # 状态无法清理的客户端不再复用，等待者可以新建一个替代实例
+            logger.warning(f"LLM客户端重置失败，丢弃该实例: {str(e)}")
+            async with self._available:
+                self._created -= 1
+                self._clients.remove(client)
+                self._available.notify()
+            await self._close_client(client)
+            return
+        async with self._available:
+            self._idle.put_nowait(client)
+            self._available.notify()
+
+    @asynccontextmanager
+    async def lease(self):
+        """借用客户端的上下文管理器"""
+        client = await self.acquire()
+        try:
+            yield client
+        finally:
+            await self.release(client)
+
+    async def close(self):
+        """关闭池中全部客户端"""
+        for client in self._clients:
+            await self._close_client(client)
+        self._clients.clear()
+        self._created = 0
+
+    async def _close_client(self, client):
+        try:
+            await client.__aexit__(None, None, None)
+            await client.close()
+            # 关闭SDK内部的HTTP连接池
+            sdk_client = getattr(client, "client", None)
+            if sdk_client is not None and hasattr(sdk_client, "close"):
+                await sdk_client.close()
+        except Exception as e:
+            logger.warning(f"LLM客户端关闭失败: {str(e)}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "size": self.size,
+            "created": self._created,
+            "in_use": self._in_use,
+            "idle": self._idle.qsize()
+        }
+
+
+class AppContainer:
+    """应用级组件容器"""
+
+    def __init__(self, settings: AppSettings):
+        self.settings = settings
+        self.redis_client: Optional[RedisClient] = None
+        self.profile_cache: Optional[ProfileCache] = None
+        self.write_behind: Optional[WriteBehindQueue] = None
+        self.llm_pool: Optional[LLMClientPool] = None
+
+        self.load_profile: Optional[LoadProfile] = None
+        self.chat_processor: Optional[ChatProcessor] = None
+        self.store_profile: Optional[StoreProfile] = None
+        self._core_flow: Optional[CoreFlow] = None
+        self._parallel_core_flow: Optional[ParallelCoreFlow] = None
+
+    async def start(self):
+        """创建全部长生命周期组件"""
+        self.redis_client = await get_redis_client()
+        self.profile_cache = get_profile_cache()
+
+        self.load_profile = LoadProfile()
+        self.chat_processor = ChatProcessor()
+        self.store_profile = StoreProfile()
+        # 写回队列与流程共用同一个StoreProfile实例
+        self.write_behind = get_write_behind_queue(self.store_profile.process)
+        pool_size = self.settings.openai.client_pool_size or self.settings.concurrency.max_concurrent_users
+        self.llm_pool = LLMClientPool(self.chat_processor.create_client, pool_size)
+        self.chat_processor.llm_pool = self.llm_pool
+        stages = {
+            "load_profile": self.load_profile,
+            "chat_processor": self.chat_processor,
+            "store_profile": self.store_profile
+        }
+        self._core_flow = CoreFlow(**stages)
+        self._parallel_core_flow = ParallelCoreFlow(**stages)
+
+        logger.info(f"🧩 应用容器初始化完成, LLM客户端池: {self.llm_pool.size}")
+
+    def core_flow(self, parallel: bool = False) -> CoreFlow:
+        """获取共享的流程编排器"""
+        return self._parallel_core_flow if parallel else self._core_flow
+
+    async def close(self):
+        """释放容器持有的资源（Redis连接由close_redis_client统一关闭）"""
+        if self.llm_pool:
+            await self.llm_pool.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "llm_pool": self.llm_pool.stats() if self.llm_pool else None
+        }
+
+
+# 全局容器实例（由lifespan初始化）
+_container: Optional[AppContainer] = None
+
+async def init_container() -> AppContainer:
+    """初始化全局容器"""
+    global _container
+
+    if _container is None:
+        container = AppContainer(get_settings())
+        await container.start()
+        _container = container
+
+    return _container
+
+def get_container() -> Optional[AppContainer]:
+    """获取全局容器，未初始化时返回None（例如在lifespan之外直接调用流程）"""
+    return _container
+
+async def close_container():
+    """关闭全局容器"""
+    global _container
+
+    if _container:
+        await _container.close()
+        _container = None
@@ -1,33 +1,107 @@
 """
 核心流程编排模块
-负责按顺序执行三个主要job：Load Profile -> Chat Processor -> Store Profile
+以DAG描述处理阶段：Load Profile -> Chat Processor -> Store Profile（延后写回）
+阶段之间的依赖由声明的输入输出字段推导，新增阶段只需在build_stages中加入
+推测模式下ChatProcessor只依赖最近几轮对话（HotContext），Profile加载与LLM生成并行，
+晚到的完整Profile只用于本轮存储和下一轮请求
 """
 
-import asyncio
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional
 from datetime import datetime
 
 from utils.logger import get_logger
 from utils.status_codes import ChatStatus, create_status_info, StatusManager
+from utils.monitoring import get_metrics_registry
+from utils.tracing import get_tracer
+from config.settings import get_settings
 from .load_profile import LoadProfile
 from .chat_processor import ChatProcessor
 from .store_profile import StoreProfile
+from .write_behind import get_write_behind_queue
+from .pipeline import Pipeline, PipelineRun, Stage
 
 logger = get_logger(__name__)
 
 class CoreFlow:
     """
     核心流程编排器
-    简化版本，使用异步方式顺序执行三个job
+    基于Pipeline执行各阶段，StoreProfile在响应前投递到异步写回队列
     """
     
-    def __init__(self):
-        """初始化核心处理组件"""
-        self.load_profile = LoadProfile()
-        self.chat_processor = ChatProcessor()
-        self.store_profile = StoreProfile()
+    def __init__(
+        self,
+        defer_storage: bool = True,
+        load_profile: Optional[LoadProfile] = None,
+        chat_processor: Optional[ChatProcessor] = None,
+        store_profile: Optional[StoreProfile] = None
+    ):
+        """
+        初始化核心处理组件
+        
+        Args:
+            defer_storage: 是否把StoreProfile投递到异步写回队列
+            load_profile/chat_processor/store_profile: 由应用容器注入的共享阶段实例，未提供时自行创建
+        """
+        self.load_profile = load_profile or LoadProfile()
+        self.chat_processor = chat_processor or ChatProcessor()
+        self.store_profile = store_profile or StoreProfile()
+        self.settings = get_settings()
+        self.write_behind = get_write_behind_queue() if defer_storage else None
+        self.pipeline = Pipeline(self.build_stages())
+        
+        logger.info(f"📦 {type(self).__name__}初始化完成")
+    
+    def build_stages(self) -> List[Stage]:
+        """
+        流程图定义
         
-        logger.info("📦 CoreFlow初始化完成")
+        Returns:
+            List[Stage]: 各阶段及其输入输出字段
+        """
+        speculative = self.settings.memory.speculative_context
+        stages = [
+            Stage(
+                name="LoadProfile",
+                func=self.load_profile.process,
+                inputs=("uid",),
+                outputs=(
+                    "customer_profile", "customer_memory", "customer_preferences",
+                    "load_timestamp", "profile_cache_hit", "load_error"
+                ),
+                error_key="load_error"
+            ),
+            Stage(
+                name="ChatProcessor",
+                func=self.chat_processor.process,
+                inputs=("uid", "message"),
+                # 推测模式下只等待热上下文，Profile加载与LLM生成并行
+                optional_inputs=("hot_history",) if speculative else ("customer_profile", "customer_memory"),
+                outputs=(
+                    "response_content", "tokens_used", "llm_duration", "llm_upstream_latency", "session_id",
+                    "stream_key", "processing_timestamp", "processing_error"
+                ),
+                error_key="processing_error"
+            ),
+            Stage(
+                name="StoreProfile",
+                func=self.store_profile.process,
+                inputs=("uid", "response_content"),
+                optional_inputs=("customer_profile", "customer_memory", "customer_preferences", "tokens_used"),
+                outputs=("storage_timestamp", "storage_error", "storage_errors"),
+                error_key="storage_error",
+                deferred=True
+            )
+        ]
+        
+        if speculative:
+            stages.append(Stage(
+                name="HotContext",
+                func=self.load_profile.load_hot_context,
+                inputs=("uid",),
+                outputs=("hot_history",)
+            ))
+        
+        return stages
     
     async def run(self, request_data: Dict[str, Any]) -> Dict[str, Any]:
         """
@@ -37,10 +111,23 @@ class CoreFlow:
             request_data: 包含uid、message等基础请求信息的字典
             
         Returns:
-            Dict[str, Any]: 包含完整处理结果的字典
+            Dict[str, Any]: 包含完整处理结果的字典（调试模式下附带trace_summary）
         """
+        with get_tracer().start_trace(
+            "CoreFlow", uid=request_data.get("uid"), session_id=request_data.get("session_id") or ""
+        ) as root:
+            result = await self._run_flow(request_data)
+        
+        if root is not None:
+            result["trace_id"] = root.trace.trace_id
+            if self.settings.debug:
+                result["trace_summary"] = root.trace.summary()
+        
+        return result
+    
+    async def _run_flow(self, request_data: Dict[str, Any]) -> Dict[str, Any]:
+        """执行流程图并构建最终结果"""
         uid = request_data.get("uid")
-        session_id = request_data.get("session_id")
         
         logger.info(f"🚀 开始核心流程处理: {uid}")
         
@@ -57,51 +144,30 @@ class CoreFlow:
         }
         
         try:
-            # 步骤1: 加载客户Profile
-            logger.info(f"📋 步骤1: 加载客户Profile - {uid}")
-            enhanced_data = await self._execute_with_error_handling(
-                self.load_profile.process,
-                flow_context,
-                "LoadProfile"
-            )
+            # 等待同一客户上一轮的异步写回落盘，避免读到旧Profile
+            if self.write_behind:
+                with get_tracer().span("WriteBehind.wait"):
+                    await self.write_behind.wait_until_flushed(
+                        uid, timeout=self.settings.persistence.flush_wait_timeout
+                    )
             
-            # 检查加载是否成功
-            if enhanced_data.get("load_error"):
-                logger.warning(f"Profile加载有错误，但继续处理: {enhanced_data['load_error']}")
-            
-            # 步骤2: 处理AI对话
-            logger.info(f"💬 步骤2: 处理AI对话 - {uid}")
-            completion_data = await self._execute_with_error_handling(
-                self.chat_processor.process,
-                enhanced_data,
-                "ChatProcessor"
-            )
-            
-            # 检查对话是否成功
-            if completion_data.get("processing_error"):
-                logger.warning(f"对话处理有错误: {completion_data['processing_error']}")
-                # 对话失败时，仍然尝试存储基础信息
-            
-            # 步骤3: 存储客户Profile
-            logger.info(f"💾 步骤3: 存储客户Profile - {uid}")
-            final_result = await self._execute_with_error_handling(
-                self.store_profile.process,
-                completion_data,
-                "StoreProfile"
-            )
+            run = await self.pipeline.run(flow_context, submit_deferred=self._submit_deferred)
+            context = run.context
             
-            # 检查存储是否成功
-            if final_result.get("storage_error"):
-                logger.warning(f"Profile存储有错误: {final_result['storage_error']}")
+            for name, result in run.results.items():
+                if result.status in ("error", "failed", "skipped"):
+                    logger.warning(f"{name} 有错误，但继续处理: {result.error}")
             
             # 计算流程总耗时
             flow_duration = (datetime.now() - flow_context["flow_start_time"]).total_seconds()
             
             # 构建最终响应
             final_response = {
-                **final_result,
+                **context,
+                **self._storage_summary(run),
                 "flow_duration": flow_duration,
-                "flow_errors": flow_context["flow_errors"],
+                "flow_errors": context["flow_errors"],
+                "flow_stages": run.report(),
                 "flow_completed": True,
                 "status": create_status_info(
                     ChatStatus.COMPLETED,
@@ -110,12 +176,18 @@ class CoreFlow:
                 )
             }
             
+            registry = get_metrics_registry()
+            registry.histogram("chat_flow_duration_seconds", "核心流程总耗时").observe(flow_duration)
+            registry.counter("chat_conversations_total", "已完成的对话数").inc()
+            registry.meter("conversations").mark()
+            
             logger.info(f"✅ 核心流程完成: {uid}, 耗时: {flow_duration:.2f}s")
             
             return final_response
             
         except Exception as e:
             logger.error(f"❌ 核心流程失败 {uid}: {str(e)}")
+            get_metrics_registry().counter("chat_errors_total", "各阶段错误数", stage="CoreFlow").inc()
             
             # 构建错误响应
             flow_duration = (datetime.now() - flow_context["flow_start_time"]).total_seconds()
@@ -134,199 +206,41 @@ class CoreFlow:
             
             return error_response
     
-    async def _execute_with_error_handling(
-        self, 
-        job_func, 
-        input_data: Dict[str, Any], 
-        job_name: str
-    ) -> Dict[str, Any]:
-        """
-        带错误处理的job执行包装器
-        
-        Args:
-            job_func: 要执行的job函数
-            input_data: 输入数据
-            job_name: job名称（用于日志）
-            
-        Returns:
-            Dict[str, Any]: job执行结果
-        """
-        start_time = datetime.now()
-        
-        try:
-            logger.debug(f"🔄 开始执行 {job_name}")
-            
-            result = await job_func(input_data)
-            
-            duration = (datetime.now() - start_time).total_seconds()
-            logger.debug(f"✅ {job_name} 执行完成，耗时: {duration:.2f}s")
-            
-            return result
-            
-        except Exception as e:
-            duration = (datetime.now() - start_time).total_seconds()
-            error_msg = f"{job_name} 执行失败: {str(e)}"
-            
-            logger.error(f"❌ {error_msg}, 耗时: {duration:.2f}s")
-            
-            # 记录错误到流程上下文
-            input_data["flow_errors"].append({
-                "job": job_name,
-                "error": str(e),
-                "timestamp": datetime.now().isoformat(),
-                "duration": duration
-            })
-            
-            # 返回包含错误信息的数据
-            return {
-                **input_data,
-                f"{job_name.lower()}_error": str(e),
-                f"{job_name.lower()}_duration": duration
-            }
+    async def _submit_deferred(self, stage: Stage, context: Dict[str, Any]) -> bool:
+        """延后阶段的提交：StoreProfile投递到写回队列，队列不可用时由Pipeline同步执行"""
+        if stage.name == "StoreProfile" and self.write_behind:
+            if await self.write_behind.submit(context):
+                logger.info(f"📮 客户Profile已投递异步写回 - {context.get('uid')}")
+                return True
+        return False
+    
+    def _storage_summary(self, run: PipelineRun) -> Dict[str, Any]:
+        """存储阶段的结果字段"""
+        store = run.results.get("StoreProfile")
+        if store and store.status == "deferred":
+            return {"storage_deferred": True}
+        return {}
 
 
-class ParallelCoreFlow:
+class ParallelCoreFlow(CoreFlow):
     """
     并行核心流程编排器
-    在保持数据依赖的前提下，尽可能并行执行独立任务
+    与CoreFlow使用同一流程图，存储阶段在响应前同步完成，并汇总存储错误
     """
     
-    def __init__(self):
+    def __init__(self, **stages):
         """初始化并行处理组件"""
-        self.load_profile = LoadProfile()
-        self.chat_processor = ChatProcessor()
-        self.store_profile = StoreProfile()
-        
-        logger.info("🔄 ParallelCoreFlow初始化完成")
-    
-    async def run(self, request_data: Dict[str, Any]) -> Dict[str, Any]:
-        """
-        执行并行优化的对话处理流程
-        
-        Args:
-            request_data: 包含uid、message等基础请求信息的字典
-            
-        Returns:
-            Dict[str, Any]: 包含完整处理结果的字典
-        """
-        uid = request_data.get("uid")
-        
-        logger.info(f"⚡ 开始并行核心流程处理: {uid}")
-        
-        flow_context = {
-            **request_data,
-            "flow_start_time": datetime.now(),
-            "flow_errors": []
-        }
-        
-        try:
-            # 阶段1: Profile加载（必须先执行）
-            enhanced_data = await self.load_profile.process(flow_context)
-            
-            # 阶段2: 对话处理（依赖Profile数据）
-            completion_data = await self.chat_processor.process(enhanced_data)
-            
-            # 阶段3: 并行执行存储任务
-            # 注意：这里可以将存储任务分解为多个独立的并行任务
-            storage_tasks = [
-                self._store_conversation_history(completion_data),
-                self._update_profile_data(completion_data),
-                self._cleanup_and_analytics(completion_data)
-            ]
-            
-            storage_results = await asyncio.gather(*storage_tasks, return_exceptions=True)
-            
-            # 处理存储结果
-            storage_errors = [r for r in storage_results if isinstance(r, Exception)]
-            if storage_errors:
-                logger.warning(f"部分并行存储任务失败: {[str(e) for e in storage_errors]}")
-            
-            # 构建最终结果
-            flow_duration = (datetime.now() - flow_context["flow_start_time"]).total_seconds()
-            
-            final_result = {
-                **completion_data,
-                "flow_duration": flow_duration,
-                "parallel_storage_errors": [str(e) for e in storage_errors] if storage_errors else None,
-                "flow_completed": True,
-                "status": create_status_info(
-                    ChatStatus.COMPLETED,
-                    message=f"客户 {uid} 的并行处理完成",
-                    progress=1.0
-                )
-            }
-            
-            logger.info(f"⚡ 并行核心流程完成: {uid}, 耗时: {flow_duration:.2f}s")
-            
-            return final_result
-            
-        except Exception as e:
-            logger.error(f"❌ 并行核心流程失败 {uid}: {str(e)}")
-            
-            flow_duration = (datetime.now() - flow_context["flow_start_time"]).total_seconds()
-            
-            return {
-                **flow_context,
-                "flow_duration": flow_duration,
-                "flow_error": str(e),
-                "flow_completed": False,
-                "status": create_status_info(
-                    ChatStatus.ERROR,
-                    message=f"客户 {uid} 的并行处理失败: {str(e)}",
-                    error_details=str(e)
-                )
-            }
-    
-    async def _store_conversation_history(self, completion_data: Dict[str, Any]):
-        """并行任务：存储对话历史"""
-        try:
-            # 这里可以复用StoreProfile中的方法或者独立实现
-            store_profile = StoreProfile()
-            await store_profile._store_conversation_history(
-                await store_profile._get_redis_client(), 
-                completion_data
-            )
-            
-        except Exception as e:
-            logger.error(f"对话历史存储失败: {str(e)}")
-            raise
-    
-    async def _update_profile_data(self, completion_data: Dict[str, Any]):
-        """并行任务：更新Profile数据"""
-        try:
-            store_profile = StoreProfile()
-            redis_client = await store_profile._get_redis_client()
-            
-            # 并行执行Profile相关更新
-            tasks = [
-                store_profile._update_customer_profile(redis_client, completion_data),
-                store_profile._update_customer_memory(redis_client, completion_data),
-                store_profile._update_customer_preferences(redis_client, completion_data)
-            ]
-            
-            await asyncio.gather(*tasks)
-            
-        except Exception as e:
-            logger.error(f"Profile数据更新失败: {str(e)}")
-            raise
+        super().__init__(defer_storage=False, **stages)
     
-    async def _cleanup_and_analytics(self, completion_data: Dict[str, Any]):
-        """并行任务：清理和分析"""
-        try:
-            store_profile = StoreProfile()
-            redis_client = await store_profile._get_redis_client()
-            
-            # 并行执行清理和统计任务
-            tasks = [
-                store_profile._record_usage_statistics(redis_client, completion_data),
-                store_profile._cleanup_old_data(redis_client, completion_data.get("uid"))
-            ]
-            
-            await asyncio.gather(*tasks)
-            
-        except Exception as e:
-            logger.error(f"清理和分析任务失败: {str(e)}")
-            raise
+    def _storage_summary(self, run: PipelineRun) -> Dict[str, Any]:
+        context = run.context
+        storage_errors = list(context.get("storage_errors") or [])
+        for key in ("storage_error", "storeprofile_error"):
+            if context.get(key):
+                storage_errors.append(context[key])
+        if storage_errors:
+            logger.warning(f"部分存储任务失败: {storage_errors}")
+        return {"parallel_storage_errors": storage_errors or None}
 
 
 # 工厂函数
@@ -358,5 +272,9 @@ async def process_chat_request(request_data: Dict[str, Any], parallel: bool = Fa
     Returns:
         Dict[str, Any]: 处理结果
     """
-    core_flow = create_core_flow(parallel=parallel)
+    # 优先使用应用容器中的共享实例，容器未初始化时（脚本直接调用）临时创建
+    from .container import get_container
+    
+    container = get_container()
+    core_flow = container.core_flow(parallel) if container else create_core_flow(parallel=parallel)
     return await core_flow.run(request_data) 
\ No newline at end of file
@@ -4,13 +4,16 @@
 """
 
 import asyncio
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Tuple
 from datetime import datetime, timedelta
 
 from utils.logger import get_logger
 from utils.status_codes import ChatStatus, create_status_info
 from models.api_models import CustomerProfile, CustomerMemory, ConversationInfo
 from storage.redis_client import get_redis_client
+from storage.profile_codec import ProfileCodec, loads
+from storage.profile_storage import get_profile_document_store
+from storage.profile_cache import get_profile_cache
 from config.settings import get_settings
 
 logger = get_logger(__name__)
@@ -44,32 +47,36 @@ class LoadProfile:
         )
         
         try:
+            # 优先命中进程内缓存，命中时跳过Redis读取
+            cache = get_profile_cache()
+            cached = cache.get(uid) if cache else None
+            if cached:
+                logger.info(f"⚡ 客户Profile缓存命中: {uid}")
+                await self._record_load_activity(uid)
+                status_info.progress = 1.0
+                status_info.message = "客户资料加载完成"
+                return {
+                    **request_data,
+                    "customer_profile": cached.profile,
+                    "customer_memory": cached.memory,
+                    "customer_preferences": cached.preferences,
+                    "load_timestamp": datetime.now(),
+                    "profile_cache_hit": True,
+                    "status": status_info
+                }
+            
             # 获取Redis客户端
             redis_client = await get_redis_client()
             
-            # 并行加载各种数据
-            profile_task = self._load_customer_profile(redis_client, uid)
-            memory_task = self._load_customer_memory(redis_client, uid)
-            preferences_task = self._load_customer_preferences(redis_client, uid)
-            
-            # 等待所有数据加载完成
-            profile, memory, preferences = await asyncio.gather(
-                profile_task, memory_task, preferences_task,
-                return_exceptions=True
-            )
+            # 按存储布局加载数据
+            if self.settings.redis.profile_backend == "document":
+                profile, memory, preferences = await self._load_from_document(uid)
+            else:
+                profile, memory, preferences = await self._load_from_keys(redis_client, uid)
             
-            # 处理加载异常
-            if isinstance(profile, Exception):
-                logger.warning(f"Profile加载异常: {profile}")
-                profile = self._create_default_profile(uid)
-                
-            if isinstance(memory, Exception):
-                logger.warning(f"Memory加载异常: {memory}")
-                memory = self._create_default_memory()
-                
-            if isinstance(preferences, Exception):
-                logger.warning(f"Preferences加载异常: {preferences}")
-                preferences = {}
+            # 回填缓存（存入副本，避免后续流程原地修改缓存内容）
+            if cache:
+                cache.put(uid, profile.model_copy(), memory.model_copy(), dict(preferences))
             
             # 更新进度
             status_info.progress = 0.8
@@ -85,7 +92,7 @@ class LoadProfile:
             }
             
             # 记录加载成功
-            await self._record_load_activity(redis_client, uid)
+            await self._record_load_activity(uid)
             
             logger.info(f"✅ 客户Profile加载完成: {uid}")
             status_info.progress = 1.0
@@ -113,6 +120,76 @@ class LoadProfile:
             
             return enhanced_data
     
+    async def load_hot_context(self, request_data: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        加载推测式上下文：最近几轮对话（新的在前）
+        优先读取进程内缓存，否则一次LRANGE读取StoreProfile维护的热列表
+        
+        Args:
+            request_data: 包含uid等请求信息的字典
+            
+        Returns:
+            Dict[str, Any]: 包含hot_history的字典
+        """
+        uid = request_data.get("uid")
+        turns = self.settings.memory.speculative_history_turns
+        
+        cache = get_profile_cache()
+        cached = cache.peek(uid) if cache else None
+        if cached:
+            return {"hot_history": list(cached.memory.short_term[:turns])}
+        
+        try:
+            redis_client = await get_redis_client()
+            raw_turns = await redis_client.lrange(f"memory:{uid}:recent", 0, turns - 1)
+            history = [ProfileCodec.conversation_from_dict(data) for data in map(loads, raw_turns) if data]
+        except Exception as e:
+            # 热上下文只是加速手段，失败时按无历史处理
+            logger.warning(f"热上下文加载失败 {uid}: {str(e)}")
+            history = []
+        
+        return {"hot_history": history}
+    
+    async def _load_from_keys(self, redis_client, uid: str) -> Tuple[CustomerProfile, CustomerMemory, Dict[str, Any]]:
+        """从多键布局并行加载Profile、记忆和偏好"""
+        profile_task = self._load_customer_profile(redis_client, uid)
+        memory_task = self._load_customer_memory(redis_client, uid)
+        preferences_task = self._load_customer_preferences(redis_client, uid)
+        
+        # 等待所有数据加载完成
+        profile, memory, preferences = await asyncio.gather(
+            profile_task, memory_task, preferences_task,
+            return_exceptions=True
+        )
+        
+        # 处理加载异常
+        if isinstance(profile, Exception):
+            logger.warning(f"Profile加载异常: {profile}")
+            profile = self._create_default_profile(uid)
+            
+        if isinstance(memory, Exception):
+            logger.warning(f"Memory加载异常: {memory}")
+            memory = self._create_default_memory()
+            
+        if isinstance(preferences, Exception):
+            logger.warning(f"Preferences加载异常: {preferences}")
+            preferences = {}
+        
+        return profile, memory, preferences
+    
+    async def _load_from_document(self, uid: str) -> Tuple[CustomerProfile, CustomerMemory, Dict[str, Any]]:
+        """从单文档布局一次性加载"""
+        try:
+            snapshot = await get_profile_document_store().load(uid)
+        except Exception as e:
+            logger.warning(f"Profile文档加载异常: {e}")
+            snapshot = None
+        
+        if snapshot is None:
+            return self._create_default_profile(uid), self._create_default_memory(), {}
+        
+        return snapshot.profile, snapshot.memory, snapshot.preferences
+    
     async def _load_customer_profile(self, redis_client, uid: str) -> CustomerProfile:
         """加载客户基础Profile"""
         try:
@@ -123,17 +200,7 @@ class LoadProfile:
                 return self._create_default_profile(uid)
             
             # 解析数据
-            return CustomerProfile(
-                uid=uid,
-                created_at=datetime.fromisoformat(profile_data.get("created_at", datetime.now().isoformat())),
-                last_active=datetime.fromisoformat(profile_data.get("last_active", datetime.now().isoformat())),
-                total_conversations=int(profile_data.get("total_conversations", 0)),
-                total_tokens=int(profile_data.get("total_tokens", 0)),
-                preferences=eval(profile_data.get("preferences", "{}")),
-                learning_data=eval(profile_data.get("learning_data", "{}")),
-                satisfaction_score=float(profile_data.get("satisfaction_score")) if profile_data.get("satisfaction_score") else None,
-                service_level=profile_data.get("service_level", "standard")
-            )
+            return ProfileCodec.profile_from_hash(uid, profile_data)
             
         except Exception as e:
             logger.warning(f"Profile解析失败，使用默认: {str(e)}")
@@ -151,23 +218,14 @@ class LoadProfile:
             for conv_key in conversation_keys:
                 conv_data = await redis_client.hgetall(conv_key)
                 if conv_data:
-                    conversation = ConversationInfo(
-                        id=conv_data.get("id"),
-                        timestamp=datetime.fromisoformat(conv_data.get("timestamp")),
-                        customer_message=conv_data.get("customer_message", ""),
-                        agent_message=conv_data.get("agent_message", ""),
-                        tokens_used=int(conv_data.get("tokens_used", 0)),
-                        context_summary=conv_data.get("context_summary"),
-                        satisfaction_rating=int(conv_data.get("satisfaction_rating")) if conv_data.get("satisfaction_rating") else None
-                    )
-                    conversations.append(conversation)
+                    conversations.append(ProfileCodec.conversation_from_hash(conv_data))
             
             # 获取长期记忆摘要
             long_term_summary = await redis_client.get(f"{memory_key}:summary")
             
             # 获取偏好记忆
             preferences_data = await redis_client.hgetall(f"{memory_key}:preferences")
-            preferences = {k: eval(v) if v else None for k, v in preferences_data.items()}
+            preferences = ProfileCodec.preferences_from_hash(preferences_data)
             
             # 计算总token数
             total_tokens = sum(conv.tokens_used for conv in conversations)
@@ -193,18 +251,26 @@ class LoadProfile:
             prefs_key = f"preferences:{uid}"
             prefs_data = await redis_client.hgetall(prefs_key)
             
-            return {k: eval(v) if v else None for k, v in prefs_data.items()}
+            return ProfileCodec.preferences_from_hash(prefs_data)
             
         except Exception as e:
             logger.warning(f"Preferences加载失败: {str(e)}")
             return {}
     
-    async def _record_load_activity(self, redis_client, uid: str):
-        """记录加载活动"""
+    async def _record_load_activity(self, uid: str):
+        """
+        记录加载活动（缓存命中与从Redis加载都记录，一次往返）
+        单文档布局在写入时更新活动信息，读取保持一次GET
+        """
+        if self.settings.redis.profile_backend == "document":
+            return
         try:
             activity_key = f"activity:{uid}"
-            await redis_client.hset(activity_key, "last_load", datetime.now().isoformat())
-            await redis_client.hincrby(activity_key, "load_count", 1)
+            redis_client = await get_redis_client()
+            pipe = redis_client.pipeline(transaction=False)
+            pipe.hset(activity_key, "last_load", datetime.now().isoformat())
+            pipe.hincrby(activity_key, "load_count", 1)
+            await pipe.execute()
         except Exception as e:
             logger.warning(f"记录加载活动失败: {str(e)}")
     
@@ -0,0 +1,253 @@
+"""
+流程编排引擎
+以声明式DAG描述处理阶段：每个阶段声明读取(inputs)和产出(outputs)的上下文字段，
+依赖关系由字段自动推导，互不依赖的阶段并发执行
+
+- 失败隔离：阶段抛出异常只记录到flow_errors，下游阶段在必需字段齐全时照常执行，缺字段时跳过
+- 延后执行：deferred阶段在主图完成、响应返回之前交给提交函数（如Profile写回队列），提交失败时同步执行
+- 每个阶段自动记录耗时直方图、错误计数和追踪span
+
+新增阶段（记忆检索、内容审核、工具预取等）只需声明一个Stage加入图中
+"""
+
+import asyncio
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, Any, Optional, List, Callable, Awaitable, Tuple, Set
+
+from utils.logger import get_logger
+from utils.monitoring import get_metrics_registry
+from utils.tracing import get_tracer
+
+logger = get_logger(__name__)
+
+StageFunc = Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]]
+DeferredSubmitter = Callable[["Stage", Dict[str, Any]], Awaitable[bool]]
+
+
+class PipelineError(Exception):
+    """流程图定义错误（字段重复产出、循环依赖等）"""
+    pass
+
+
+@dataclass
+class Stage:
+    """
+    流程阶段
+
+    Attributes:
+        name: 阶段名称（用于日志、指标和追踪）
+        func: 阶段函数，接收上下文副本，返回包含产出字段的字典
+        inputs: 必需的上下文字段，缺少时跳过该阶段
+        optional_inputs: 可选的上下文字段，只用于确定执行顺序
+        outputs: 产出的上下文字段，只有声明过的字段会合并回上下文
+        error_key: 阶段以返回值报告错误时使用的字段（如load_error）
+        deferred: 是否在主图完成后再执行
+    """
+    name: str
+    func: StageFunc
+    inputs: Tuple[str, ...] = ()
+    optional_inputs: Tuple[str, ...] = ()
+    outputs: Tuple[str, ...] = ()
+    error_key: Optional[str] = None
+    deferred: bool = False
+
+
+@dataclass
+class StageResult:
+    """单个阶段的执行结果"""
+    status: str  # completed / error / failed / skipped / deferred
+    duration: float = 0.0
+    error: Optional[str] = None
+
+
+@dataclass
+class PipelineRun:
+    """一次流程执行的结果"""
+    context: Dict[str, Any]
+    results: Dict[str, StageResult] = field(default_factory=dict)
+
+    def report(self) -> Dict[str, Dict[str, Any]]:
+        """各阶段状态与耗时"""
+        return {
+            name: {"status": result.status, "duration": round(result.duration, 4), "error": result.error}
+            for name, result in self.results.items()
+        }
+
+
+class Pipeline:
+    """DAG流程执行器"""
+
+    def __init__(self, stages: List[Stage]):
+        self.stages = list(stages)
+        self._by_name = {stage.name: stage for stage in self.stages}
+        if len(self._by_name) != len(self.stages):
+            raise PipelineError("阶段名称重复")
+
+        # 字段 -> 产出该字段的阶段
+        producers: Dict[str, str] = {}
+        for stage in self.stages:
+            for key in stage.outputs:
+                if key in producers:
+                    raise PipelineError(f"字段 {key} 同时由 {producers[key]} 和 {stage.name} 产出")
+                producers[key] = stage.name
+
+        # 阶段 -> 上游阶段
+        self.dependencies: Dict[str, Set[str]] = {
+            stage.name: {
+                producers[key] for key in stage.inputs + stage.optional_inputs if key in producers
+            } - {stage.name}
+            for stage in self.stages
+        }
+
+        for stage in self.stages:
+            if stage.deferred:
+                continue
+            deferred_upstream = [dep for dep in self.dependencies[stage.name] if self._by_name[dep].deferred]
+            if deferred_upstream:
+                raise PipelineError(f"{stage.name} 不能依赖延后执行的阶段 {deferred_upstream}")
+
+        self.order = self._topological_order()
+
+    def _topological_order(self) -> List[str]:
+        """拓扑排序，同时检查循环依赖"""
+        remaining = {name: set(deps) for name, deps in self.dependencies.items()}
+        order: List[str] = []
+        while remaining:
+            ready = [name for name, deps in remaining.items() if not deps]
+            if not ready:
+                raise PipelineError(f"流程图存在循环依赖: {sorted(remaining)}")
+            for name in ready:
+                order.append(name)
+                del remaining[name]
+            for deps in remaining.values():
+                deps.difference_update(ready)
+        return order
+
+    async def run(
+        self,
+        context: Dict[str, Any],
+        submit_deferred: Optional[DeferredSubmitter] = None
+    ) -> PipelineRun:
+        """
+        执行流程图
+
+        Args:
+            context: 初始上下文（需包含flow_errors列表）
+            submit_deferred: 延后阶段的提交函数，返回True表示已接管执行；为None或返回False时同步执行
+
+        Returns:
+            PipelineRun: 合并后的上下文与各阶段结果
+        """
+        run = PipelineRun(context=context)
+        context.setdefault("flow_errors", [])
+
+        # 主图：依赖满足的阶段立即启动，任一阶段完成后检查新就绪的阶段
+        pending = [name for name in self.order if not self._by_name[name].deferred]
+        running: Dict[asyncio.Task, str] = {}
+        try:
+            while pending or running:
+                for name in list(pending):
+                    if self.dependencies[name].issubset(run.results):
+                        pending.remove(name)
+                        stage = self._by_name[name]
+                        if self._missing_inputs(stage, context):
+                            run.results[name] = self._skip(stage, context)
+                        else:
+                            running[asyncio.create_task(self._execute(stage, context))] = name
+
+                if not running:
+                    continue
+
+                done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    name = running.pop(task)
+                    run.results[name] = self._merge(self._by_name[name], context, *task.result())
+        finally:
+            # 外层超时或取消时不遗留后台阶段
+            for task in running:
+                task.cancel()
+
+        # 延后阶段：按拓扑顺序提交
+        for name in self.order:
+            stage = self._by_name[name]
+            if not stage.deferred:
+                continue
+            if self._missing_inputs(stage, context):
+                run.results[name] = self._skip(stage, context)
+            elif submit_deferred and await submit_deferred(stage, dict(context)):
+                run.results[name] = StageResult(status="deferred")
+                logger.debug(f"📮 {name} 已延后执行")
+            else:
+                run.results[name] = self._merge(stage, context, *await self._execute(stage, context))
+
+        return run
+
+    def _missing_inputs(self, stage: Stage, context: Dict[str, Any]) -> List[str]:
+        return [key for key in stage.inputs if key not in context]
+
+    def _skip(self, stage: Stage, context: Dict[str, Any]) -> StageResult:
+        missing = self._missing_inputs(stage, context)
+        logger.warning(f"⏭️ 跳过 {stage.name}: 缺少字段 {missing}")
+        get_metrics_registry().counter("chat_stage_skipped_total", "因缺少输入而跳过的阶段数", stage=stage.name).inc()
+        return StageResult(status="skipped", error=f"缺少字段 {missing}")
+
+    async def _execute(
+        self, stage: Stage, context: Dict[str, Any]
+    ) -> Tuple[Optional[Dict[str, Any]], float, Optional[Exception]]:
+        """执行单个阶段，异常不向外抛出"""
+        tracer = get_tracer()
+        span = tracer.start_span(stage.name)
+        started = datetime.now()
+        output, error = None, None
+
+        logger.debug(f"🔄 开始执行 {stage.name}")
+        try:
+            # 传入副本，并发阶段之间互不影响
+            with tracer.activate(span):
+                output = await stage.func(dict(context))
+        except Exception as e:
+            error = e
+
+        duration = (datetime.now() - started).total_seconds()
+        if span:
+            reported = str(error) if error else (output or {}).get(stage.error_key or "")
+            span.end(error=str(reported) if reported else None)
+        return output, duration, error
+
+    def _merge(
+        self,
+        stage: Stage,
+        context: Dict[str, Any],
+        output: Optional[Dict[str, Any]],
+        duration: float,
+        error: Optional[Exception]
+    ) -> StageResult:
+        """把阶段产出合并回上下文并记录指标"""
+        registry = get_metrics_registry()
+        registry.histogram("chat_stage_duration_seconds", "核心流程各阶段耗时", stage=stage.name).observe(duration)
+
+        if error is not None:
+            registry.counter("chat_errors_total", "各阶段错误数", stage=stage.name).inc()
+            logger.error(f"❌ {stage.name} 执行失败: {str(error)}, 耗时: {duration:.2f}s")
+            context["flow_errors"].append({
+                "job": stage.name,
+                "error": str(error),
+                "timestamp": datetime.now().isoformat(),
+                "duration": duration
+            })
+            context[f"{stage.name.lower()}_error"] = str(error)
+            context[f"{stage.name.lower()}_duration"] = duration
+            return StageResult(status="failed", duration=duration, error=str(error))
+
+        output = output or {}
+        for key in stage.outputs:
+            if key in output:
+                context[key] = output[key]
+
+        logger.debug(f"✅ {stage.name} 执行完成，耗时: {duration:.2f}s")
+        reported = output.get(stage.error_key) if stage.error_key else None
+        if reported:
+            registry.counter("chat_errors_total", "各阶段错误数", stage=stage.name).inc()
+            return StageResult(status="error", duration=duration, error=str(reported))
+        return StageResult(status="completed", duration=duration)
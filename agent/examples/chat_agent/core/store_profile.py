@@ -4,15 +4,22 @@
 """
 
 import asyncio
-import json
 import uuid
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional, Tuple
 from datetime import datetime, timedelta
 
+from redis.exceptions import WatchError
+
 from utils.logger import get_logger
 from utils.status_codes import ChatStatus, create_status_info
 from models.api_models import CustomerProfile, CustomerMemory, ConversationInfo
 from storage.redis_client import get_redis_client
+from storage.profile_codec import ProfileCodec, dumps
+from storage.profile_storage import (
+    get_profile_document_store, fence_record_key, ProfileConflictError, StaleLeaseError, MAX_KEY_TOPICS
+)
+from storage.profile_cache import get_profile_cache, get_cache_invalidator
+from storage.usage_stats import get_usage_stats
 from config.settings import get_settings
 
 logger = get_logger(__name__)
@@ -34,6 +41,8 @@ class StoreProfile:
             Dict[str, Any]: 包含存储结果的字典
         """
         uid = completion_data.get("uid")
+        # 本轮对话的幂等键：写回重试复用同一个payload，重放时识别已提交的写入
+        completion_data.setdefault("turn_id", str(uuid.uuid4()))
         
         logger.info(f"💾 开始存储客户Profile: {uid}")
         
@@ -48,24 +57,29 @@ class StoreProfile:
             # 获取Redis客户端
             redis_client = await get_redis_client()
             
-            # 并行执行各种存储任务
-            tasks = [
-                self._store_conversation_history(redis_client, completion_data),
-                self._update_customer_profile(redis_client, completion_data),
-                self._update_customer_memory(redis_client, completion_data),
-                self._update_customer_preferences(redis_client, completion_data),
-                self._record_usage_statistics(redis_client, completion_data)
-            ]
+            storage_errors = []
+            
+            # 长期记忆摘要只计算一次，写入与缓存写穿共用
+            summary = await self._summarize_if_due(completion_data.get("customer_memory"))
             
-            results = await asyncio.gather(*tasks, return_exceptions=True)
+            if self.settings.redis.profile_backend == "document":
+                # 文档CAS写入是主写入，失败时整体报错，写回队列可安全重试
+                conversation = self._build_conversation(completion_data)
+                write_result = await self._store_document_turn(completion_data, conversation, summary)
+                try:
+                    await self._record_usage_statistics(redis_client, completion_data, conversation)
+                except Exception as e:
+                    storage_errors.append(e)
+            else:
+                # 多键布局：全部写入在一个MULTI事务中提交，已提交的重放返回None
+                write_result = await self._store_atomic(redis_client, completion_data, summary)
             
             # 检查存储结果
-            storage_errors = [r for r in results if isinstance(r, Exception)]
             if storage_errors:
                 logger.warning(f"部分存储操作失败: {[str(e) for e in storage_errors]}")
             
-            # 清理旧数据
-            await self._cleanup_old_data(redis_client, uid)
+            # 写穿进程内缓存并通知其他worker失效
+            await self._refresh_profile_cache(completion_data, write_result, summary)
             
             # 构建最终结果
             final_result = {
@@ -86,11 +100,18 @@ class StoreProfile:
         except Exception as e:
             logger.error(f"❌ 客户Profile存储失败 {uid}: {str(e)}")
             
+            # 写入未完成，缓存中的Profile不再可信
+            cache = get_profile_cache()
+            if cache:
+                cache.invalidate(uid)
+            
             # 创建错误结果
             error_result = {
                 **completion_data,
                 "storage_timestamp": datetime.now(),
                 "storage_error": str(e),
+                # 租约已被接管时重试也会被拒绝
+                "storage_retryable": not isinstance(e, StaleLeaseError),
                 "status": create_status_info(
                     ChatStatus.ERROR,
                     message=f"Profile存储失败: {str(e)}",
@@ -100,189 +121,321 @@ class StoreProfile:
             
             return error_result
     
-    async def _store_conversation_history(self, redis_client, completion_data: Dict[str, Any]):
-        """存储对话历史"""
+    async def _summarize_if_due(self, memory: Optional[CustomerMemory]) -> Optional[str]:
+        """每10次对话更新一次长期记忆摘要，未到更新条件时返回None"""
+        if memory and len(memory.short_term) >= 10:
+            return await self._generate_long_term_summary(memory.short_term)
+        return None
+    
+    async def _store_document_turn(
+        self,
+        completion_data: Dict[str, Any],
+        conversation: ConversationInfo,
+        summary: Optional[str] = None
+    ):
+        """单文档布局：一次CAS写入对话、Profile统计、记忆和偏好"""
         try:
             uid = completion_data.get("uid")
-            session_id = completion_data.get("session_id")
-            
-            # 创建对话记录
-            conversation = ConversationInfo(
-                id=str(uuid.uuid4()),
-                timestamp=datetime.now(),
-                customer_message=completion_data.get("message", ""),
-                agent_message=completion_data.get("response_content", ""),
+            
+            document = await get_profile_document_store().append_turn(
+                uid,
+                conversation=conversation,
                 tokens_used=completion_data.get("tokens_used", 0),
-                context_summary=self._generate_context_summary(completion_data),
-                satisfaction_rating=None  # 等待客户反馈
+                topics=self._extract_topics(completion_data),
+                learned_preferences=self._learn_preferences(completion_data),
+                summary=summary,
+                fence=self._lease_fence(completion_data)
             )
             
-            # 存储到Redis
-            conv_key = f"conversation:{uid}:{conversation.id}"
-            conv_data = {
-                "id": conversation.id,
-                "timestamp": conversation.timestamp.isoformat(),
-                "customer_message": conversation.customer_message,
-                "agent_message": conversation.agent_message,
-                "tokens_used": str(conversation.tokens_used),
-                "context_summary": conversation.context_summary or "",
-                "session_id": session_id or ""
-            }
-            
-            await redis_client.hset(conv_key, mapping=conv_data)
-            await redis_client.expire(conv_key, self.settings.redis.profile_ttl)
-            
-            # 添加到用户对话列表
-            memory_key = f"memory:{uid}"
-            await redis_client.lpush(f"{memory_key}:conversations", conv_key)
-            
-            # 限制对话历史长度
-            await redis_client.ltrim(
-                f"{memory_key}:conversations", 
-                0, 
-                self.settings.memory.max_history_length - 1
-            )
+            logger.debug(f"Profile文档更新成功: {uid}")
             
-            logger.debug(f"对话历史存储成功: {uid}")
+            return document
             
         except Exception as e:
-            logger.error(f"对话历史存储失败: {str(e)}")
+            logger.error(f"Profile文档更新失败: {str(e)}")
             raise
     
-    async def _update_customer_profile(self, redis_client, completion_data: Dict[str, Any]):
-        """更新客户基础Profile"""
+    async def _refresh_profile_cache(
+        self,
+        completion_data: Dict[str, Any],
+        write_result: Any,
+        summary: Optional[str] = None
+    ):
+        """
+        写入完成后更新进程内Profile缓存
+        
+        Args:
+            completion_data: 对话处理结果
+            write_result: 对话写入结果（多键布局为ConversationInfo，单文档布局为写入后的文档）
+            summary: 本次写入的长期记忆摘要（未更新时为None）
+        """
+        cache = get_profile_cache()
+        if cache is None:
+            return
+        
+        uid = completion_data.get("uid")
         try:
-            uid = completion_data.get("uid")
             profile: CustomerProfile = completion_data.get("customer_profile")
+            memory: CustomerMemory = completion_data.get("customer_memory")
             
-            if not profile:
-                return
-            
-            # 更新统计数据
-            profile.last_active = datetime.now()
-            profile.total_conversations += 1
-            profile.total_tokens += completion_data.get("tokens_used", 0)
-            
-            # 存储更新后的Profile
-            profile_key = f"profile:{uid}"
-            profile_data = {
-                "uid": profile.uid,
-                "created_at": profile.created_at.isoformat(),
-                "last_active": profile.last_active.isoformat(),
-                "total_conversations": str(profile.total_conversations),
-                "total_tokens": str(profile.total_tokens),
-                "preferences": json.dumps(profile.preferences),
-                "learning_data": json.dumps(profile.learning_data),
-                "satisfaction_score": str(profile.satisfaction_score) if profile.satisfaction_score else "",
-                "service_level": profile.service_level
-            }
-            
-            await redis_client.hset(profile_key, mapping=profile_data)
-            await redis_client.expire(profile_key, self.settings.redis.profile_ttl)
-            
-            logger.debug(f"客户Profile更新成功: {uid}")
-            
+            if write_result is None:
+                cache.invalidate(uid)
+            elif self.settings.redis.profile_backend == "document":
+                snapshot = get_profile_document_store().to_snapshot(write_result)
+                cache.put(uid, snapshot.profile, snapshot.memory, snapshot.preferences)
+            elif profile and memory:
+                preferences = {
+                    **(completion_data.get("customer_preferences") or {}),
+                    **self._learn_preferences(completion_data)
+                }
+                updated_memory = self._apply_turn_to_memory(memory, write_result, completion_data, summary)
+                cache.put(uid, profile.model_copy(), updated_memory, preferences)
+            else:
+                cache.invalidate(uid)
         except Exception as e:
-            logger.error(f"客户Profile更新失败: {str(e)}")
-            raise
+            logger.warning(f"Profile缓存更新失败: {str(e)}")
+            cache.invalidate(uid)
+        
+        invalidator = get_cache_invalidator()
+        if invalidator:
+            await invalidator.publish(uid)
     
-    async def _update_customer_memory(self, redis_client, completion_data: Dict[str, Any]):
-        """更新客户记忆系统"""
+    def _apply_turn_to_memory(
+        self, 
+        memory: CustomerMemory, 
+        conversation: ConversationInfo, 
+        completion_data: Dict[str, Any],
+        summary: Optional[str] = None
+    ) -> CustomerMemory:
+        """在内存中复现多键布局的记忆更新，得到写入后的记忆"""
+        short_term = ([conversation] + list(memory.short_term))[:self.settings.memory.max_history_length]
+        
+        key_topics = list(memory.key_topics)
+        new_topics = self._extract_topics(completion_data)
+        if new_topics:
+            key_topics = (list(reversed(new_topics)) + key_topics)[:MAX_KEY_TOPICS]
+        
+        long_term_summary = summary if summary is not None else memory.long_term_summary
+        
+        return memory.model_copy(update={
+            "short_term": short_term,
+            "key_topics": key_topics,
+            "long_term_summary": long_term_summary,
+            "total_context_tokens": sum(conv.tokens_used for conv in short_term)
+        })
+    
+    async def _store_atomic(
+        self,
+        redis_client,
+        completion_data: Dict[str, Any],
+        summary: Optional[str] = None
+    ) -> Optional[ConversationInfo]:
+        """
+        多键布局：对话、Profile、记忆、偏好和使用统计编译为一个MULTI/EXEC事务，
+        一次往返提交；计数器通过HINCRBY在服务端累加，并发对话不会互相覆盖
+        
+        事务中同时写入本轮的幂等标记 turn:{uid}:{session_id}:{turn_id}，
+        EXEC已提交但响应丢失时，重试看到标记即跳过，HINCRBY/LPUSH不会重复执行；
+        Redis租约下WATCH该槽位已写入的fencing token，租约被接管后的写入被拒绝
+        
+        Returns:
+            Optional[ConversationInfo]: 写入的对话；本轮已提交过（重放）时返回None
+        
+        Raises:
+            StaleLeaseError: fencing token已过期
+        """
         try:
             uid = completion_data.get("uid")
+            profile: CustomerProfile = completion_data.get("customer_profile")
             memory: CustomerMemory = completion_data.get("customer_memory")
+            turn_key = self._turn_key(completion_data)
+            
+            # 需要计算的内容先在本地准备好，事务内只做写入
+            conversation = self._build_conversation(completion_data)
+            
+            fence = self._lease_fence(completion_data)
+            watched = [turn_key] + ([fence_record_key(uid)] if fence else [])
+            
+            for attempt in range(self.settings.redis.profile_update_retries):
+                async with redis_client.pipeline(transaction=True) as pipe:
+                    await pipe.watch(*watched)
+                    if await pipe.exists(turn_key):
+                        logger.info(f"♻️ 本轮对话已写入，跳过重放: {turn_key}")
+                        return None
+                    if fence:
+                        self._check_fence(uid, fence, await pipe.hget(fence_record_key(uid), fence[0]))
+                    
+                    pipe.multi()
+                    pipe.set(turn_key, 1, ex=self.settings.persistence.turn_marker_ttl)
+                    if fence:
+                        pipe.hset(fence_record_key(uid), fence[0], fence[1])
+                        pipe.expire(fence_record_key(uid), self.settings.concurrency.fence_record_ttl)
+                    self._queue_conversation_history(pipe, completion_data, conversation)
+                    counters_at = self._queue_customer_profile(pipe, completion_data)
+                    if memory:
+                        self._queue_customer_memory(pipe, completion_data, summary)
+                    self._queue_customer_preferences(pipe, completion_data)
+                    self._queue_usage_statistics(pipe, completion_data)
+                    self._queue_hot_history(pipe, uid, conversation)
+                    
+                    try:
+                        results = await pipe.execute()
+                        break
+                    except WatchError:
+                        # 幂等标记或fencing记录在WATCH之后被修改，重新检查
+                        logger.debug(f"Profile事务冲突，重试: {uid} (第{attempt + 1}次)")
+            else:
+                raise ProfileConflictError(f"Profile事务写入冲突: {uid}")
             
-            if not memory:
-                return
-            
-            memory_key = f"memory:{uid}"
-            
-            # 更新关键话题
-            new_topics = self._extract_topics(completion_data)
-            if new_topics:
-                for topic in new_topics:
-                    await redis_client.lpush(f"{memory_key}:topics", topic)
-                
-                # 限制话题数量
-                await redis_client.ltrim(f"{memory_key}:topics", 0, 50)
+            # 使用服务端累加后的计数器回填Profile，供缓存写穿使用
+            if counters_at is not None:
+                profile.total_conversations = int(results[counters_at])
+                profile.total_tokens = int(results[counters_at + 1])
             
-            # 更新长期记忆摘要（如果对话数量达到阈值）
-            if len(memory.short_term) >= 10:  # 每10次对话更新一次摘要
-                summary = await self._generate_long_term_summary(memory.short_term)
-                await redis_client.set(f"{memory_key}:summary", summary)
-                await redis_client.expire(f"{memory_key}:summary", self.settings.redis.profile_ttl)
+            logger.debug(f"Profile事务写入成功: {uid}, 命令数: {len(results)}")
             
-            logger.debug(f"客户记忆更新成功: {uid}")
+            return conversation
             
         except Exception as e:
-            logger.error(f"客户记忆更新失败: {str(e)}")
+            logger.error(f"Profile事务写入失败: {str(e)}")
             raise
     
-    async def _update_customer_preferences(self, redis_client, completion_data: Dict[str, Any]):
-        """更新客户偏好设置"""
-        try:
-            uid = completion_data.get("uid")
-            
-            # 学习客户偏好（简单示例）
-            learned_preferences = self._learn_preferences(completion_data)
-            
-            if learned_preferences:
-                prefs_key = f"preferences:{uid}"
-                prefs_data = {k: json.dumps(v) for k, v in learned_preferences.items()}
-                
-                await redis_client.hset(prefs_key, mapping=prefs_data)
-                await redis_client.expire(prefs_key, self.settings.redis.profile_ttl)
-            
-            logger.debug(f"客户偏好更新成功: {uid}")
-            
-        except Exception as e:
-            logger.error(f"客户偏好更新失败: {str(e)}")
-            raise
+    def _lease_fence(self, completion_data: Dict[str, Any]) -> Optional[Tuple[int, int]]:
+        """
+        写入方的(租约槽位, fencing token)
+        
+        仅Redis租约需要检查：进程内租约不会被接管，且fencing计数随进程重启归零
+        """
+        if self.settings.concurrency.lease_backend != "redis":
+            return None
+        if completion_data.get("lease_fence") is None or completion_data.get("lease_slot") is None:
+            return None
+        return int(completion_data["lease_slot"]), int(completion_data["lease_fence"])
+    
+    @staticmethod
+    def _check_fence(uid: str, fence: Tuple[int, int], written: Optional[str]):
+        """fencing token小于该槽位已写入的值时拒绝写入"""
+        if written is not None and fence[1] < int(written):
+            raise StaleLeaseError(f"租约已被接管，拒绝写入: {uid} (slot={fence[0]}, fence={fence[1]})")
+    
+    @staticmethod
+    def _turn_key(completion_data: Dict[str, Any]) -> str:
+        """本轮对话写入的幂等标记键"""
+        return (
+            f"turn:{completion_data.get('uid')}:{completion_data.get('session_id')}"
+            f":{completion_data.get('turn_id')}"
+        )
     
-    async def _record_usage_statistics(self, redis_client, completion_data: Dict[str, Any]):
-        """记录使用统计"""
+    def _queue_conversation_history(self, pipe, completion_data: Dict[str, Any], conversation: ConversationInfo):
+        """对话历史写入命令"""
+        uid = completion_data.get("uid")
+        conv_key = f"conversation:{uid}:{conversation.id}"
+        conv_data = ProfileCodec.conversation_to_hash(conversation, completion_data.get("session_id"))
+        
+        pipe.hset(conv_key, mapping=conv_data)
+        pipe.expire(conv_key, self.settings.redis.profile_ttl)
+        
+        # 添加到用户对话列表并限制对话历史长度
+        conversations_key = f"memory:{uid}:conversations"
+        pipe.lpush(conversations_key, conv_key)
+        pipe.ltrim(conversations_key, 0, self.settings.memory.max_history_length - 1)
+    
+    def _queue_customer_profile(self, pipe, completion_data: Dict[str, Any]) -> Optional[int]:
+        """
+        客户Profile写入命令
+        
+        Returns:
+            Optional[int]: HINCRBY total_conversations在事务结果中的位置，
+                total_tokens紧随其后；没有Profile时返回None
+        """
+        profile: CustomerProfile = completion_data.get("customer_profile")
+        if not profile:
+            return None
+        
+        uid = completion_data.get("uid")
+        profile_key = f"profile:{uid}"
+        profile.last_active = datetime.now()
+        
+        # 计数器字段不随HSET覆盖，由HINCRBY在服务端累加
+        pipe.hset(profile_key, mapping=ProfileCodec.profile_to_hash(profile, include_counters=False))
+        counters_at = len(pipe)
+        pipe.hincrby(profile_key, "total_conversations", 1)
+        pipe.hincrby(profile_key, "total_tokens", completion_data.get("tokens_used", 0))
+        pipe.expire(profile_key, self.settings.redis.profile_ttl)
+        
+        return counters_at
+    
+    def _queue_customer_memory(self, pipe, completion_data: Dict[str, Any], summary: Optional[str]):
+        """客户记忆写入命令"""
+        memory_key = f"memory:{completion_data.get('uid')}"
+        
+        # 一次LPUSH写入全部话题，结果顺序与逐个LPUSH相同
+        new_topics = self._extract_topics(completion_data)
+        if new_topics:
+            pipe.lpush(f"{memory_key}:topics", *new_topics)
+            pipe.ltrim(f"{memory_key}:topics", 0, MAX_KEY_TOPICS - 1)
+        
+        # 更新长期记忆摘要
+        if summary is not None:
+            pipe.set(f"{memory_key}:summary", summary, ex=self.settings.redis.profile_ttl)
+    
+    def _queue_customer_preferences(self, pipe, completion_data: Dict[str, Any]):
+        """客户偏好写入命令"""
+        learned_preferences = self._learn_preferences(completion_data)
+        if not learned_preferences:
+            return
+        
+        prefs_key = f"preferences:{completion_data.get('uid')}"
+        pipe.hset(prefs_key, mapping=ProfileCodec.preferences_to_hash(learned_preferences))
+        pipe.expire(prefs_key, self.settings.redis.profile_ttl)
+    
+    def _queue_usage_statistics(self, pipe, completion_data: Dict[str, Any]):
+        """使用统计写入命令（HyperLogLog独立客户数 + 分片时间桶计数）"""
+        get_usage_stats().queue_record(
+            pipe,
+            completion_data.get("uid"),
+            completion_data.get("tokens_used", 0)
+        )
+    
+    def _queue_hot_history(self, pipe, uid: str, conversation: ConversationInfo):
+        """最近对话热列表写入命令（推测式上下文使用，一次LRANGE即可读取）"""
+        if not self.settings.memory.speculative_context:
+            return
+        
+        recent_key = f"memory:{uid}:recent"
+        pipe.lpush(recent_key, dumps(ProfileCodec.conversation_to_dict(conversation)))
+        pipe.ltrim(recent_key, 0, self.settings.memory.speculative_history_turns - 1)
+        pipe.expire(recent_key, self.settings.redis.profile_ttl)
+    
+    async def _record_usage_statistics(
+        self, redis_client, completion_data: Dict[str, Any], conversation: Optional[ConversationInfo] = None
+    ):
+        """记录使用统计与最近对话热列表（单文档布局下独立提交）"""
         try:
-            uid = completion_data.get("uid")
-            tokens_used = completion_data.get("tokens_used", 0)
-            
-            # 记录每日统计
-            today = datetime.now().strftime("%Y-%m-%d")
-            daily_key = f"stats:daily:{today}"
-            
-            await redis_client.hincrby(daily_key, "total_conversations", 1)
-            await redis_client.hincrby(daily_key, "total_tokens", tokens_used)
-            await redis_client.sadd(f"{daily_key}:users", uid)
-            await redis_client.expire(daily_key, 86400 * 30)  # 保留30天
+            pipe = redis_client.pipeline(transaction=True)
+            self._queue_usage_statistics(pipe, completion_data)
+            if conversation is not None:
+                self._queue_hot_history(pipe, completion_data.get("uid"), conversation)
+            await pipe.execute()
             
-            # 记录用户统计
-            user_stats_key = f"stats:user:{uid}"
-            await redis_client.hincrby(user_stats_key, "conversations_today", 1)
-            await redis_client.hincrby(user_stats_key, "tokens_today", tokens_used)
-            await redis_client.expire(user_stats_key, 86400)  # 每日重置
-            
-            logger.debug(f"使用统计记录成功: {uid}")
+            logger.debug(f"使用统计记录成功: {completion_data.get('uid')}")
             
         except Exception as e:
             logger.error(f"使用统计记录失败: {str(e)}")
             raise
     
-    async def _cleanup_old_data(self, redis_client, uid: str):
-        """清理过期数据"""
-        try:
-            # 清理过期的流式数据
-            pattern = f"stream:{uid}:*"
-            keys = await redis_client.keys(pattern)
-            
-            for key in keys:
-                # 检查是否过期
-                ttl = await redis_client.ttl(key)
-                if ttl < 60:  # 小于1分钟就清理
-                    await redis_client.delete(key)
-            
-            logger.debug(f"数据清理完成: {uid}")
-            
-        except Exception as e:
-            logger.warning(f"数据清理失败: {str(e)}")
+    def _build_conversation(self, completion_data: Dict[str, Any]) -> ConversationInfo:
+        """根据对话结果创建对话记录"""
+        return ConversationInfo(
+            # 与幂等键一致，重放时单文档布局据此识别已追加的对话
+            id=completion_data.get("turn_id") or str(uuid.uuid4()),
+            timestamp=datetime.now(),
+            customer_message=completion_data.get("message", ""),
+            agent_message=completion_data.get("response_content", ""),
+            tokens_used=completion_data.get("tokens_used", 0),
+            context_summary=self._generate_context_summary(completion_data),
+            satisfaction_rating=None  # 等待客户反馈
+        )
     
     def _generate_context_summary(self, completion_data: Dict[str, Any]) -> str:
         """生成对话上下文摘要"""
@@ -0,0 +1,225 @@
+"""
+流式中转模块
+生成与HTTP连接解耦：对话生成在后台任务中一直执行到结束，连接只负责从Redis读取数据块转发
+
+- 数据块按RPUSH顺序存储在 stream:{uid}:{session_id}:chunks，列表下标即SSE事件ID
+- 生成结束后把终止事件（complete/error）写入 stream:{uid}:{session_id} 的final字段
+- 同一会话开始新的生成前清除上一轮的数据块和终止事件；同一会话同时只允许一个生成任务
+- 客户端断线后携带Last-Event-ID重连，从存储中回放之后的数据块，再继续跟随实时输出
+"""
+
+import asyncio
+import time
+from typing import Dict, Any, Optional, AsyncIterator, Coroutine, Set
+
+from utils.logger import get_logger
+from utils.serialization import dumpb, peek_type
+from utils.sse import encode_frame, encode_event
+from storage.redis_client import get_redis_client
+from storage.stream_storage import track_stream_keys
+from config.settings import get_settings
+
+logger = get_logger(__name__)
+
+# 转发给客户端的数据块类型
+FORWARDED_CHUNK_TYPES = frozenset({
+    "response.output_text.delta", "response.output_text.done", "usage", "response.completed"
+})
+
+# 终止事件所在的哈希字段
+FINAL_FIELD = "final"
+
+
+def stream_key(uid: str, session_id: str) -> str:
+    """与ChatProcessor一致的流式存储键"""
+    return f"stream:{uid}:{session_id}"
+
+
+class GenerationRunningError(Exception):
+    """该会话已有进行中的生成任务"""
+    pass
+
+
+def queue_stream_reset(pipe, key: str):
+    """清除上一轮生成的数据块与终止事件的命令（新一轮生成开始前执行）"""
+    pipe.delete(f"{key}:chunks")
+    pipe.hdel(key, FINAL_FIELD, "completion")
+
+
+async def reset_stream(uid: str, session_id: str):
+    """清除该会话上一轮生成的流式数据，避免读取端读到旧的回复"""
+    key = stream_key(uid, session_id)
+    try:
+        redis_client = await get_redis_client()
+        pipe = redis_client.pipeline(transaction=True)
+        queue_stream_reset(pipe, key)
+        await pipe.execute()
+    except Exception as e:
+        logger.warning(f"流式存储重置失败 {key}: {str(e)}")
+
+
+async def publish_final(uid: str, session_id: str, event: Dict[str, Any]):
+    """
+    写入终止事件（所有数据块写完之后调用），读取端看到它即结束
+    已有终止事件时不覆盖（例如数据块超出上限时先写入的错误事件）
+    """
+    key = stream_key(uid, session_id)
+    try:
+        redis_client = await get_redis_client()
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.hsetnx(key, FINAL_FIELD, dumpb(event))
+        track_stream_keys(pipe, get_settings().redis.stream_ttl, key, f"{key}:chunks")
+        await pipe.execute()
+    except Exception as e:
+        logger.warning(f"终止事件写入失败 {key}: {str(e)}")
+
+
+async def stream_exists(uid: str, session_id: str) -> bool:
+    """流式存储是否存在（未过期）"""
+    redis_client = await get_redis_client()
+    return bool(await redis_client.exists(stream_key(uid, session_id)))
+
+
+async def tail_stream(
+    uid: str,
+    session_id: str,
+    last_event_id: Optional[int] = None,
+    timeout: Optional[float] = None
+) -> AsyncIterator[bytes]:
+    """
+    读取流式存储并生成SSE帧：先回放last_event_id之后的数据块，再跟随实时写入，读到终止事件后结束
+
+    Args:
+        uid: 客户ID
+        session_id: 会话ID
+        last_event_id: 客户端已收到的最后一个事件ID，None表示从头读取
+        timeout: 等待终止事件的最长时间(秒)
+
+    Yields:
+        bytes: SSE帧，数据块的事件ID为其在列表中的下标，终止事件的ID为数据块总数
+    """
+    settings = get_settings()
+    key = stream_key(uid, session_id)
+    chunks_key = f"{key}:chunks"
+    cursor = last_event_id + 1 if last_event_id is not None else 0
+    deadline = time.monotonic() + (timeout if timeout is not None else settings.concurrency.request_timeout)
+    redis_client = await get_redis_client()
+
+    while True:
+        # 先读终止标记再读数据块：终止标记写入时全部数据块已经存在
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.hget(key, FINAL_FIELD)
+        pipe.lrange(chunks_key, cursor, -1)
+        pipe.llen(chunks_key)
+        final, chunks, total = await pipe.execute()
+
+        for index, raw_chunk in enumerate(chunks, start=cursor):
+            # 只读取type字段做过滤，数据块按原始字节转发
+            if peek_type(raw_chunk) in FORWARDED_CHUNK_TYPES:
+                yield encode_frame(raw_chunk, event_id=index)
+        cursor += len(chunks)
+
+        if final is not None:
+            # 重连时已经收到过终止事件则不再重复发送
+            if last_event_id is None or last_event_id < total:
+                yield encode_frame(final, event_id=total)
+            return
+
+        if time.monotonic() > deadline:
+            logger.warning(f"⏰ 等待流式结果超时: {key}")
+            yield encode_event({
+                "type": "error",
+                "error": "等待生成结果超时",
+                "uid": uid,
+                "session_id": session_id
+            })
+            return
+
+        if not chunks:
+            await asyncio.sleep(settings.stream.read_interval)
+
+
+class GenerationRegistry:
+    """
+    进程内的后台生成任务登记表
+    连接断开不影响生成任务，服务关闭时等待进行中的生成完成（超时后取消）
+    """
+
+    def __init__(self):
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._starting: Set[str] = set()
+        self._started = 0
+        self._rejected = 0
+
+    async def start(self, uid: str, session_id: str, coro: Coroutine[Any, Any, Any]) -> asyncio.Task:
+        """
+        清除该会话上一轮的流式数据后启动后台生成任务
+
+        Raises:
+            GenerationRunningError: 该会话已有进行中的生成（应携带Last-Event-ID续传）
+        """
+        key = stream_key(uid, session_id)
+        if key in self._tasks or key in self._starting:
+            coro.close()
+            self._rejected += 1
+            raise GenerationRunningError(f"会话 {session_id} 正在生成中，请续传已有的输出")
+
+        # 重置期间占住该会话，保证清除发生在本轮写入之前且不会清掉其他生成的数据
+        self._starting.add(key)
+        try:
+            await reset_stream(uid, session_id)
+        except BaseException:
+            coro.close()
+            raise
+        finally:
+            self._starting.discard(key)
+
+        task = asyncio.create_task(coro)
+        self._tasks[key] = task
+        self._started += 1
+        task.add_done_callback(lambda t, k=key: self._discard(k, t))
+        return task
+
+    def _discard(self, key: str, task: asyncio.Task):
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"❌ 后台生成任务异常 {key}: {str(task.exception())}")
+
+    def is_running(self, uid: str, session_id: str) -> bool:
+        key = stream_key(uid, session_id)
+        return key in self._tasks or key in self._starting
+
+    async def shutdown(self, timeout: float):
+        """等待进行中的生成任务，超时后取消"""
+        tasks = list(self._tasks.values())
+        if not tasks:
+            return
+
+        logger.info(f"⏳ 等待 {len(tasks)} 个生成任务完成...")
+        _, pending = await asyncio.wait(tasks, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+            logger.warning(f"⚠️ {len(pending)} 个生成任务在关闭时被取消")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": len(self._tasks),
+            "started": self._started,
+            "rejected": self._rejected
+        }
+
+
+# 全局生成任务登记表
+_generation_registry: Optional[GenerationRegistry] = None
+
+def get_generation_registry() -> GenerationRegistry:
+    """获取全局生成任务登记表"""
+    global _generation_registry
+
+    if _generation_registry is None:
+        _generation_registry = GenerationRegistry()
+
+    return _generation_registry
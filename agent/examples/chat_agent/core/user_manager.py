@@ -0,0 +1,460 @@
+"""
+客户并发租约管理模块
+每个客户同时最多持有 max_requests_per_user 个处理租约：
+- local: 进程内分片锁，不同客户的准入互不阻塞
+- redis: SET NX PX 跨进程/跨主机租约，附带单调递增的fencing token，后台心跳续期
+租约已满时请求进入该客户的FIFO等待队列，队列满才拒绝
+"""
+
+import asyncio
+import time
+import uuid
+import zlib
+from dataclasses import dataclass, field
+from typing import Dict, Any, Optional, List, AsyncGenerator, Awaitable, Union
+
+from utils.logger import get_logger
+from storage.redis_client import get_redis_client
+from config.settings import get_settings, ConcurrencySettings
+
+logger = get_logger(__name__)
+
+# 获取租约脚本：依次尝试每个槽位，成功后递增fencing计数器
+# KEYS[1]: fencing计数器  KEYS[2..]: 槽位键
+# ARGV[1]: 持有者标识  ARGV[2]: 租约时长(毫秒)
+ACQUIRE_SCRIPT = """
+for i = 2, #KEYS do
+    if redis.call('SET', KEYS[i], ARGV[1], 'NX', 'PX', ARGV[2]) then
+        local fence = redis.call('INCR', KEYS[1])
+        redis.call('PEXPIRE', KEYS[1], 86400000)
+        return {i - 2, fence}
+    end
+end
+return false
+"""
+
+# 续期脚本：仅持有者本人可以续期
+RENEW_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+# 释放脚本：比较持有者后删除，避免误删已被他人接管的租约
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class LeaseLostError(Exception):
+    """处理期间客户租约丢失（续期失败，可能已被他人接管）"""
+    pass
+
+
+@dataclass
+class UserLease:
+    """客户处理租约"""
+    uid: str
+    slot: int
+    fence: int  # fencing token，同一客户的租约严格递增
+    owner: str = field(default_factory=lambda: uuid.uuid4().hex)
+    acquired_at: float = field(default_factory=time.monotonic)
+    lost: bool = False  # 续期失败，租约可能已被他人接管
+    lost_event: asyncio.Event = field(default_factory=asyncio.Event, repr=False, compare=False)
+
+    def mark_lost(self):
+        """标记租约丢失并中止guard中的处理"""
+        self.lost = True
+        self.lost_event.set()
+
+    async def guard(self, awaitable: Awaitable[Any]) -> Any:
+        """
+        在租约有效期内执行处理，租约丢失时取消处理
+
+        Raises:
+            LeaseLostError: 处理完成前租约丢失
+        """
+        if self.lost:
+            if asyncio.iscoroutine(awaitable):
+                awaitable.close()
+            raise LeaseLostError(f"用户 {self.uid} 的租约已丢失 (fence={self.fence})")
+
+        task = asyncio.ensure_future(awaitable)
+        lost_waiter = asyncio.ensure_future(self.lost_event.wait())
+        try:
+            done, _ = await asyncio.wait({task, lost_waiter}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            lost_waiter.cancel()
+            if not task.done():
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+
+        if task not in done:
+            logger.warning(f"⚠️ 客户 {self.uid} 的租约已丢失，中止处理 (fence={self.fence})")
+            raise LeaseLostError(f"用户 {self.uid} 的租约已丢失 (fence={self.fence})")
+        return task.result()
+
+
+class LocalLeaseBackend:
+    """进程内租约：按uid分片加锁，仅保护同一分片内的检查与登记"""
+
+    def __init__(self, max_per_user: int, shards: int):
+        self.max_per_user = max_per_user
+        self._locks = [asyncio.Lock() for _ in range(max(1, shards))]
+        self._leases: Dict[str, List[UserLease]] = {}
+        self._fences: Dict[str, int] = {}
+
+    def _lock_for(self, uid: str) -> asyncio.Lock:
+        return self._locks[zlib.crc32(uid.encode("utf-8")) % len(self._locks)]
+
+    async def acquire(self, uid: str) -> Optional[UserLease]:
+        async with self._lock_for(uid):
+            held = self._leases.setdefault(uid, [])
+            if len(held) >= self.max_per_user:
+                return None
+
+            used_slots = {lease.slot for lease in held}
+            slot = next(index for index in range(self.max_per_user) if index not in used_slots)
+            fence = self._fences.get(uid, 0) + 1
+            self._fences[uid] = fence
+
+            lease = UserLease(uid=uid, slot=slot, fence=fence)
+            held.append(lease)
+            return lease
+
+    async def release(self, lease: UserLease) -> bool:
+        async with self._lock_for(lease.uid):
+            held = self._leases.get(lease.uid)
+            if not held or lease not in held:
+                return False
+            held.remove(lease)
+            if not held:
+                del self._leases[lease.uid]
+            return True
+
+    async def renew(self, leases: List[UserLease]):
+        """进程内租约无需续期"""
+        return None
+
+
+class RedisLeaseBackend:
+    """Redis租约：键使用 {uid} 哈希标签，集群模式下同一客户的键落在同一槽"""
+
+    def __init__(self, max_per_user: int, ttl: float):
+        self.max_per_user = max_per_user
+        self.ttl_ms = int(ttl * 1000)
+        self._scripts: Dict[str, Any] = {}
+
+    @staticmethod
+    def slot_key(uid: str, slot: int) -> str:
+        return f"lease:{{{uid}}}:slot:{slot}"
+
+    @staticmethod
+    def fence_key(uid: str) -> str:
+        return f"lease:{{{uid}}}:fence"
+
+    async def _script(self, name: str, source: str):
+        if name not in self._scripts:
+            redis_client = await get_redis_client()
+            self._scripts[name] = redis_client.register_script(source)
+        return self._scripts[name]
+
+    async def acquire(self, uid: str) -> Optional[UserLease]:
+        script = await self._script("acquire", ACQUIRE_SCRIPT)
+        owner = uuid.uuid4().hex
+        keys = [self.fence_key(uid)] + [self.slot_key(uid, slot) for slot in range(self.max_per_user)]
+
+        result = await script(keys=keys, args=[owner, self.ttl_ms])
+        if not result:
+            return None
+
+        return UserLease(uid=uid, slot=int(result[0]), fence=int(result[1]), owner=owner)
+
+    async def release(self, lease: UserLease) -> bool:
+        script = await self._script("release", RELEASE_SCRIPT)
+        result = await script(keys=[self.slot_key(lease.uid, lease.slot)], args=[lease.owner])
+        return bool(int(result))
+
+    async def renew(self, leases: List[UserLease]):
+        """批量续期，失败的租约标记为lost"""
+        if not leases:
+            return
+        script = await self._script("renew", RENEW_SCRIPT)
+        results = await asyncio.gather(
+            *(script(keys=[self.slot_key(lease.uid, lease.slot)], args=[lease.owner, self.ttl_ms])
+              for lease in leases),
+            return_exceptions=True
+        )
+        for lease, result in zip(leases, results):
+            if isinstance(result, Exception):
+                logger.warning(f"租约续期异常 {lease.uid}: {str(result)}")
+            elif not int(result):
+                lease.mark_lost()
+                logger.warning(f"⚠️ 客户 {lease.uid} 的租约已丢失 (fence={lease.fence})")
+
+
+class UserLeaseManager:
+    """客户租约管理器，记录本实例持有的租约并负责心跳续期"""
+
+    def __init__(self, backend, settings: ConcurrencySettings):
+        self.backend = backend
+        self.renew_interval = max(0.1, settings.lease_ttl / 3)
+        self._held: Dict[str, List[UserLease]] = {}
+        self._task: Optional[asyncio.Task] = None
+
+        # 统计
+        self.granted = 0
+        self.rejected = 0
+        self.lost = 0
+
+    async def start(self):
+        """启动心跳续期任务（仅Redis后端需要）"""
+        if self._task is None and isinstance(self.backend, RedisLeaseBackend):
+            self._task = asyncio.create_task(self._heartbeat())
+            logger.info(f"💓 客户租约心跳已启动: 每{self.renew_interval:.1f}秒")
+
+    async def stop(self):
+        """停止心跳并释放本实例持有的全部租约"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        for lease in [lease for leases in self._held.values() for lease in leases]:
+            await self.release(lease)
+
+    async def acquire(self, uid: str) -> Optional[UserLease]:
+        """
+        获取客户处理租约
+
+        Returns:
+            Optional[UserLease]: 获取失败（该客户请求数已达上限）时返回None
+        """
+        lease = await self.backend.acquire(uid)
+        if lease is None:
+            self.rejected += 1
+            return None
+
+        self._held.setdefault(uid, []).append(lease)
+        self.granted += 1
+        logger.info(f"🔒 用户 {uid} 开始处理 (slot={lease.slot}, fence={lease.fence})")
+        return lease
+
+    async def release(self, lease: UserLease):
+        """释放租约，重复释放是安全的"""
+        held = self._held.get(lease.uid)
+        if held and lease in held:
+            held.remove(lease)
+            if not held:
+                del self._held[lease.uid]
+
+        try:
+            released = await self.backend.release(lease)
+            if not released and not lease.lost:
+                logger.debug(f"租约已不存在: {lease.uid}")
+        except Exception as e:
+            # 释放失败时租约会在TTL后自动过期
+            logger.warning(f"租约释放失败 {lease.uid}: {str(e)}")
+
+        logger.info(f"🔓 用户 {lease.uid} 处理完成")
+
+    def active_users(self) -> List[str]:
+        """本实例正在处理的客户"""
+        return list(self._held.keys())
+
+    def stats(self) -> Dict[str, Any]:
+        """租约统计"""
+        return {
+            "backend": "redis" if isinstance(self.backend, RedisLeaseBackend) else "local",
+            "active_users": len(self._held),
+            "active_leases": sum(len(leases) for leases in self._held.values()),
+            "granted": self.granted,
+            "rejected": self.rejected,
+            "lost": self.lost
+        }
+
+    async def _heartbeat(self):
+        """定期续期本实例持有的租约"""
+        while True:
+            await asyncio.sleep(self.renew_interval)
+            leases = [lease for leases in self._held.values() for lease in leases if not lease.lost]
+            try:
+                await self.backend.renew(leases)
+                self.lost += sum(1 for lease in leases if lease.lost)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"租约续期失败: {str(e)}")
+
+
+class UserQueueFullError(Exception):
+    """该客户的等待队列已满"""
+    pass
+
+
+class UserQueueTimeoutError(Exception):
+    """排队等待超时"""
+    pass
+
+
+@dataclass
+class QueuePosition:
+    """排队进度"""
+    uid: str
+    position: int  # 1表示下一个执行
+    waited: float  # 已等待时间(秒)
+
+
+class UserRequestQueue:
+    """
+    每客户FIFO等待队列
+    客户租约已满时请求进入队列而不是立即拒绝；本实例释放租约时按顺序唤醒，
+    Redis后端下其他实例释放的租约通过定期重试获取
+    """
+
+    def __init__(self, lease_manager: UserLeaseManager, settings: ConcurrencySettings):
+        self.lease_manager = lease_manager
+        self.max_depth = settings.queue_depth
+        self.wait_timeout = settings.queue_wait_timeout
+        self.poll_interval = settings.queue_poll_interval
+        self._waiters: Dict[str, List[asyncio.Event]] = {}
+
+        # 统计
+        self.queued = 0
+        self.rejected = 0
+        self.timeouts = 0
+
+    def is_full(self, uid: str) -> bool:
+        """该客户的等待队列是否已满"""
+        return len(self._waiters.get(uid, ())) >= self.max_depth
+
+    async def acquire(self, uid: str) -> UserLease:
+        """
+        获取客户租约，必要时排队等待
+
+        Raises:
+            UserQueueFullError: 等待队列已满
+            UserQueueTimeoutError: 超过queue_wait_timeout仍未轮到
+        """
+        async for item in self.wait(uid):
+            if isinstance(item, UserLease):
+                return item
+
+    async def wait(self, uid: str) -> AsyncGenerator[Union[QueuePosition, UserLease], None]:
+        """
+        排队获取客户租约，等待期间产出QueuePosition，最后产出UserLease
+
+        Raises:
+            UserQueueFullError: 等待队列已满
+            UserQueueTimeoutError: 超过queue_wait_timeout仍未轮到
+        """
+        # 没有人排队时直接尝试获取，保证本实例内的FIFO顺序
+        if not self._waiters.get(uid):
+            lease = await self.lease_manager.acquire(uid)
+            if lease:
+                yield lease
+                return
+
+        if self.is_full(uid):
+            self.rejected += 1
+            raise UserQueueFullError(f"用户 {uid} 的排队请求已达上限({self.max_depth})")
+
+        waiter = asyncio.Event()
+        waiters = self._waiters.setdefault(uid, [])
+        waiters.append(waiter)
+        self.queued += 1
+        started = time.monotonic()
+
+        try:
+            while True:
+                position = self._waiters[uid].index(waiter) + 1
+                if position == 1:
+                    lease = await self.lease_manager.acquire(uid)
+                    if lease:
+                        # 先离开队列再交出租约，调用方不必关闭生成器
+                        self._leave(uid, waiter)
+                        logger.info(f"⏭️ 用户 {uid} 排队结束，等待 {time.monotonic() - started:.2f}s")
+                        yield lease
+                        return
+
+                waited = time.monotonic() - started
+                remaining = self.wait_timeout - waited
+                if remaining <= 0:
+                    self.timeouts += 1
+                    raise UserQueueTimeoutError(f"用户 {uid} 排队等待超时({self.wait_timeout}s)")
+
+                yield QueuePosition(uid=uid, position=position, waited=round(waited, 2))
+
+                waiter.clear()
+                try:
+                    await asyncio.wait_for(waiter.wait(), timeout=min(remaining, self.poll_interval))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self._leave(uid, waiter)
+
+    async def release(self, lease: UserLease):
+        """释放租约并唤醒该客户的下一个排队请求"""
+        await self.lease_manager.release(lease)
+        self._notify(lease.uid)
+
+    def _leave(self, uid: str, waiter: asyncio.Event):
+        """移出等待队列（可重复调用）"""
+        waiters = self._waiters.get(uid)
+        if waiters is None or waiter not in waiters:
+            return
+        waiters.remove(waiter)
+        if not waiters:
+            del self._waiters[uid]
+        # 排在后面的请求位置前移
+        self._notify(uid)
+
+    def _notify(self, uid: str):
+        for waiter in self._waiters.get(uid, ()):
+            waiter.set()
+
+    def stats(self) -> Dict[str, Any]:
+        """排队统计"""
+        return {
+            "waiting_users": len(self._waiters),
+            "waiting_requests": sum(len(waiters) for waiters in self._waiters.values()),
+            "queued": self.queued,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts
+        }
+
+
+# 全局租约管理器实例
+_lease_manager: Optional[UserLeaseManager] = None
+_request_queue: Optional[UserRequestQueue] = None
+
+def get_user_lease_manager() -> UserLeaseManager:
+    """获取全局客户租约管理器"""
+    global _lease_manager
+
+    if _lease_manager is None:
+        settings = get_settings().concurrency
+        max_per_user = max(1, settings.max_requests_per_user)
+        if settings.lease_backend == "redis":
+            backend = RedisLeaseBackend(max_per_user, settings.lease_ttl)
+        else:
+            backend = LocalLeaseBackend(max_per_user, settings.lease_shards)
+        _lease_manager = UserLeaseManager(backend, settings)
+
+    return _lease_manager
+
+def get_user_request_queue() -> UserRequestQueue:
+    """获取全局客户排队队列"""
+    global _request_queue
+
+    if _request_queue is None:
+        _request_queue = UserRequestQueue(get_user_lease_manager(), get_settings().concurrency)
+
+    return _request_queue
@@ -0,0 +1,252 @@
+"""
+Profile异步写回模块
+回复生成后将对话结果投递到有界队列，由后台worker执行StoreProfile，
+响应延迟不再包含Profile持久化
+"""
+
+import asyncio
+import time
+import zlib
+from dataclasses import dataclass, field
+from typing import Dict, Any, Optional, List, Callable, Awaitable
+
+from utils.logger import get_logger
+from utils.monitoring import get_metrics_registry
+from config.settings import get_settings, PersistenceSettings
+from .store_profile import StoreProfile
+
+logger = get_logger(__name__)
+
+StoreHandler = Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]]
+
+
+@dataclass
+class WriteJob:
+    """写回任务"""
+    uid: str
+    payload: Dict[str, Any]
+    enqueued_at: float = field(default_factory=time.monotonic)
+
+
+class WriteBehindQueue:
+    """
+    有界写回队列
+    按uid分片到固定worker，保证同一客户的写入顺序
+    """
+
+    def __init__(self, handler: StoreHandler, settings: PersistenceSettings):
+        self.handler = handler
+        self.settings = settings
+        self.worker_count = max(1, settings.workers)
+
+        shard_size = max(1, settings.queue_size // self.worker_count)
+        self._queues: List[asyncio.Queue] = [asyncio.Queue(maxsize=shard_size) for _ in range(self.worker_count)]
+        self._workers: List[asyncio.Task] = []
+        self._closing = False
+
+        # 每个客户未完成的写回数量，以及写回完成通知
+        self._pending: Dict[str, int] = {}
+        self._flushed: Dict[str, asyncio.Event] = {}
+
+        # 统计
+        self.submitted = 0
+        self.processed = 0
+        self.failed = 0
+        self.retried = 0
+        self.rejected = 0
+
+    @property
+    def running(self) -> bool:
+        """是否可以接收新任务"""
+        return bool(self._workers) and not self._closing
+
+    async def start(self):
+        """启动worker"""
+        if self._workers:
+            return
+        self._closing = False
+        self._workers = [
+            asyncio.create_task(self._worker(index))
+            for index in range(self.worker_count)
+        ]
+        logger.info(f"📮 Profile写回队列已启动: {self.worker_count}个worker")
+
+    async def submit(self, completion_data: Dict[str, Any]) -> bool:
+        """
+        投递写回任务
+
+        Returns:
+            bool: True表示已入队；False表示队列不可用或已满，调用方应同步写入
+        """
+        if not self.running:
+            return False
+
+        uid = completion_data.get("uid")
+        queue = self._queues[self._shard(uid)]
+        job = WriteJob(uid=uid, payload=completion_data)
+
+        # 先登记再入队，保证入队后立即调用wait_until_flushed也能等到
+        self._mark_pending(uid)
+        try:
+            await asyncio.wait_for(queue.put(job), timeout=self.settings.enqueue_timeout)
+        except asyncio.TimeoutError:
+            # 背压：队列持续满载时退化为同步写入
+            self._mark_done(uid)
+            self.rejected += 1
+            logger.warning(f"⚠️ 写回队列已满，改为同步写入: {uid}")
+            return False
+
+        self.submitted += 1
+        return True
+
+    async def wait_until_flushed(self, uid: str, timeout: Optional[float] = None) -> bool:
+        """
+        等待该客户所有已投递的写回完成
+
+        Returns:
+            bool: 是否在超时前完成
+        """
+        event = self._flushed.get(uid)
+        if event is None:
+            return True
+        try:
+            await asyncio.wait_for(event.wait(), timeout=timeout)
+            return True
+        except asyncio.TimeoutError:
+            logger.warning(f"⚠️ 等待客户 {uid} 的上一轮写回超时")
+            return False
+
+    async def stop(self, drain_timeout: Optional[float] = None):
+        """停止接收新任务，排空队列后关闭worker"""
+        if not self._workers:
+            return
+
+        self._closing = True
+        timeout = self.settings.drain_timeout if drain_timeout is None else drain_timeout
+        pending = sum(queue.qsize() for queue in self._queues)
+        logger.info(f"🔄 正在排空Profile写回队列: {pending}个待写入")
+
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*(queue.join() for queue in self._queues)),
+                timeout=timeout
+            )
+        except asyncio.TimeoutError:
+            remaining = sum(queue.qsize() for queue in self._queues)
+            logger.error(f"❌ 写回队列排空超时，丢弃{remaining}个任务")
+
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        logger.info("✅ Profile写回队列已关闭")
+
+    def stats(self) -> Dict[str, Any]:
+        """队列统计"""
+        return {
+            "running": self.running,
+            "workers": self.worker_count,
+            "depth": sum(queue.qsize() for queue in self._queues),
+            "pending_users": len(self._pending),
+            "submitted": self.submitted,
+            "processed": self.processed,
+            "failed": self.failed,
+            "retried": self.retried,
+            "rejected": self.rejected
+        }
+
+    async def _worker(self, index: int):
+        """worker主循环"""
+        queue = self._queues[index]
+        while True:
+            job: WriteJob = await queue.get()
+            try:
+                await self._run_job(job)
+            finally:
+                queue.task_done()
+                self._mark_done(job.uid)
+
+    async def _run_job(self, job: WriteJob):
+        """
+        执行写回，失败时按退避重试
+
+        重试复用同一个payload（含turn_id），StoreProfile据此识别已提交的写入，
+        重放不会重复累加计数或追加对话
+        """
+        max_attempts = self.settings.max_retries + 1
+
+        for attempt in range(max_attempts):
+            try:
+                result = await self.handler(job.payload)
+                # StoreProfile整体失败时返回storage_error而不是抛异常
+                if result and result.get("storage_error"):
+                    if not result.get("storage_retryable", True):
+                        self.failed += 1
+                        get_metrics_registry().counter("chat_errors_total", "各阶段错误数", stage="StoreProfile").inc()
+                        logger.error(f"❌ Profile写回被拒绝，不再重试 {job.uid}: {result['storage_error']}")
+                        return
+                    raise RuntimeError(result["storage_error"])
+
+                self.processed += 1
+                lag = time.monotonic() - job.enqueued_at
+                get_metrics_registry().histogram(
+                    "chat_stage_duration_seconds", "核心流程各阶段耗时", stage="StoreProfile(write_behind)"
+                ).observe(lag)
+                logger.debug(f"💾 写回完成: {job.uid}, 延迟: {lag:.2f}s")
+                return
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if attempt == max_attempts - 1:
+                    self.failed += 1
+                    get_metrics_registry().counter("chat_errors_total", "各阶段错误数", stage="StoreProfile").inc()
+                    logger.error(f"❌ Profile写回最终失败 {job.uid}: {str(e)}")
+                    return
+
+                self.retried += 1
+                delay = self.settings.retry_backoff * (attempt + 1)
+                logger.warning(f"⚠️ Profile写回失败，{delay:.1f}s后重试 {job.uid}: {str(e)}")
+                await asyncio.sleep(delay)
+
+    def _shard(self, uid: Optional[str]) -> int:
+        """uid -> worker分片"""
+        return zlib.crc32((uid or "").encode("utf-8")) % self.worker_count
+
+    def _mark_pending(self, uid: str):
+        self._pending[uid] = self._pending.get(uid, 0) + 1
+        if uid not in self._flushed:
+            self._flushed[uid] = asyncio.Event()
+
+    def _mark_done(self, uid: str):
+        remaining = self._pending.get(uid, 0) - 1
+        if remaining > 0:
+            self._pending[uid] = remaining
+            return
+        self._pending.pop(uid, None)
+        event = self._flushed.pop(uid, None)
+        if event:
+            event.set()
+
+
+# 全局写回队列实例
+_write_behind_queue: Optional[WriteBehindQueue] = None
+
+def get_write_behind_queue(handler: Optional[StoreHandler] = None) -> Optional[WriteBehindQueue]:
+    """
+    获取全局写回队列，未启用时返回None
+
+    Args:
+        handler: 首次创建时使用的写回处理函数，应用容器传入共享StoreProfile实例的process；
+            未提供时（例如在lifespan之外直接调用流程）自行创建StoreProfile
+    """
+    global _write_behind_queue
+
+    settings = get_settings()
+    if not settings.persistence.write_behind_enabled:
+        return None
+
+    if _write_behind_queue is None:
+        _write_behind_queue = WriteBehindQueue(handler or StoreProfile().process, settings.persistence)
+
+    return _write_behind_queue
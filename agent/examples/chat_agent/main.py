@@ -6,20 +6,26 @@ Chat Agent主应用
 
 import asyncio
 import uuid
-import json
 from typing import Optional, Dict, Any
 from contextlib import asynccontextmanager
 from datetime import datetime
 import time
 import logging
 
-from fastapi import FastAPI, HTTPException, BackgroundTasks
-from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi import FastAPI, HTTPException, Header
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 import uvicorn
 
 # 导入核心模块
-from core import CoreFlow, process_chat_request
+from core import (
+    CoreFlow, process_chat_request, get_write_behind_queue,
+    UserLease, LeaseLostError, get_user_lease_manager, get_user_request_queue,
+    QueuePosition, UserQueueFullError, UserQueueTimeoutError,
+    AdmissionTicket, get_admission_controller,
+    init_container, get_container, close_container,
+    GenerationRunningError, get_generation_registry, tail_stream, publish_final, stream_exists
+)
 from config import get_settings
 from utils.logger import get_logger
 from utils.status_codes import ChatStatus, ErrorCode
@@ -28,11 +34,20 @@ from models.api_models import (
     SystemStatus, MetricsResponse, ErrorResponse
 )
 from storage.redis_client import get_redis_client, close_redis_client
+from storage.profile_cache import get_profile_cache, get_cache_invalidator
+from storage.stream_storage import get_stream_sweeper
+from storage.usage_stats import get_usage_stats
+from utils.monitoring import get_metrics_registry, get_redis_info_sampler, get_cpu_sampler, MetricsServer
+from utils.tracing import get_tracer
+from utils.sse import sse_response, encode_event
+
+# 用户并发控制（客户租约 + 每客户排队）
+lease_manager = get_user_lease_manager()
+request_queue = get_user_request_queue()
+admission = get_admission_controller()
 
-# 用户并发控制
-from typing import Set
-user_processing: Set[str] = set()
-user_lock = asyncio.Lock()
+# 后台流式生成任务（与HTTP连接解耦）
+generation_registry = get_generation_registry()
 
 logger = get_logger(__name__)
 settings = get_settings()
@@ -50,6 +65,36 @@ async def lifespan(app: FastAPI):
         logger.error(f"❌ Redis连接失败: {str(e)}")
         raise
     
+    # 初始化应用容器（共享阶段实例与LLM客户端池）
+    await init_container()
+    
+    # 启动客户租约心跳（Redis后端）
+    await lease_manager.start()
+    
+    # 启动Profile异步写回队列
+    write_behind = get_write_behind_queue()
+    if write_behind:
+        await write_behind.start()
+    
+    # 启动Profile缓存跨进程失效订阅
+    cache_invalidator = get_cache_invalidator()
+    if cache_invalidator:
+        await cache_invalidator.start()
+    
+    # 启动流式数据过期清理
+    stream_sweeper = get_stream_sweeper()
+    await stream_sweeper.start()
+    
+    # 启动使用统计汇总
+    usage_stats = get_usage_stats()
+    await usage_stats.start()
+    
+    # 启动Prometheus指标端点
+    metrics_server = None
+    if settings.monitoring.enable_metrics:
+        metrics_server = MetricsServer(get_metrics_registry(), settings.host, settings.monitoring.metrics_port)
+        await metrics_server.start()
+    
     # 启动完成
     logger.info(f"🌟 Chat Agent服务启动完成 - {settings.app_name} v{settings.version}")
     logger.info(f"🔗 服务地址: http://{settings.host}:{settings.port}")
@@ -58,6 +103,20 @@ async def lifespan(app: FastAPI):
     
     # 关闭时清理
     logger.info("🔄 正在关闭Chat Agent服务...")
+    # 等待进行中的流式生成写完结果
+    await generation_registry.shutdown(settings.stream.shutdown_drain_timeout)
+    if metrics_server:
+        await metrics_server.stop()
+    if write_behind:
+        # 先排空写回队列，再关闭Redis连接
+        await write_behind.stop()
+    if cache_invalidator:
+        await cache_invalidator.stop()
+    await stream_sweeper.stop()
+    await usage_stats.stop()
+    await lease_manager.stop()
+    get_tracer().close()
+    await close_container()
     await close_redis_client()
     logger.info("✅ 服务已安全关闭")
 
@@ -69,21 +128,51 @@ app = FastAPI(
     lifespan=lifespan
 )
 
+# 全局准入控制函数
+# 准入凭证在拿到客户租约之后才获取：排队中的请求不占用全局并发
+async def resolve_service_level(uid: str) -> Optional[str]:
+    """解析客户服务等级（Profile缓存未命中时读取存储），每个请求解析一次"""
+    if admission is None:
+        return None
+    return await admission.resolve_service_level(uid)
+
+def shed_if_overloaded(uid: str, service_level: Optional[str] = None):
+    """已无该客户等级的可用份额时直接返回503（只检查，不占用准入凭证）"""
+    if admission is not None and not admission.has_capacity(uid, service_level):
+        raise HTTPException(
+            status_code=503,
+            detail="服务繁忙，请稍后再试",
+            headers={"Retry-After": str(admission.retry_after())}
+        )
+
+def admit_or_shed(uid: str, service_level: Optional[str] = None) -> Optional[AdmissionTicket]:
+    """全局准入，过载时直接返回503并携带Retry-After"""
+    if admission is None:
+        return None
+    ticket = admission.try_acquire(uid, service_level)
+    if ticket is None:
+        raise HTTPException(
+            status_code=503,
+            detail="服务繁忙，请稍后再试",
+            headers={"Retry-After": str(admission.retry_after())}
+        )
+    return ticket
+
+def release_admission(ticket: Optional[AdmissionTicket], result: Optional[Dict[str, Any]] = None, failed: bool = False):
+    """归还准入凭证，上游延迟与失败情况用于调整并发上限"""
+    if ticket is None:
+        return
+    result = result or {}
+    admission.release(
+        ticket,
+        latency=result.get("llm_upstream_latency"),
+        failed=failed or bool(result.get("processing_error") or result.get("flow_error"))
+    )
+
 # 用户并发控制函数
-async def check_and_mark_user_processing(uid: str) -> bool:
-    """检查并标记用户处理状态"""
-    async with user_lock:
-        if uid in user_processing:
-            return False
-        user_processing.add(uid)
-        logger.info(f"🔒 用户 {uid} 开始处理")
-        return True
-
-async def unmark_user_processing(uid: str):
-    """取消用户处理标记"""
-    async with user_lock:
-        user_processing.discard(uid)
-        logger.info(f"🔓 用户 {uid} 处理完成")
+async def unmark_user_processing(lease: UserLease):
+    """释放客户处理租约并唤醒该客户的下一个排队请求"""
+    await request_queue.release(lease)
 
 # API端点定义
 
@@ -115,9 +204,8 @@ async def health_check():
     """快速健康检查 - 不执行慢速操作"""
     try:
         # 获取处理状态（快速操作）
-        async with user_lock:
-            active_customers = len(user_processing)
-            processing_customers = list(user_processing)
+        processing_customers = lease_manager.active_users()
+        active_customers = len(processing_customers)
         
         # 快速Redis检查 - 只检查连接是否存在
         redis_connected = True
@@ -146,9 +234,8 @@ async def deep_health_check():
     """深度健康检查 - 包含Redis ping等慢速操作"""
     try:
         # 获取处理状态
-        async with user_lock:
-            active_customers = len(user_processing)
-            processing_customers = list(user_processing)
+        processing_customers = lease_manager.active_users()
+        active_customers = len(processing_customers)
         
         # 深度Redis检查 - 执行ping操作
         redis_connected = False
@@ -178,21 +265,40 @@ async def deep_health_check():
         raise HTTPException(status_code=500, detail=f"深度健康检查失败: {str(e)}")
 
 @app.post("/chat", response_model=ChatResponse)
-async def chat_non_stream(request: ChatRequest, background_tasks: BackgroundTasks):
+async def chat_non_stream(request: ChatRequest):
     """
     非流式聊天端点
     完整的三步流程：Load Profile -> Chat Processor -> Store Profile
     """
     uid = request.uid
+    service_level = await resolve_service_level(uid)
+    
+    # 过载时在排队之前快速拒绝
+    shed_if_overloaded(uid, service_level)
     
-    # 检查用户是否已在处理中
-    can_process = await check_and_mark_user_processing(uid)
-    if not can_process:
+    # 获取客户租约，已有请求在处理时排队等待
+    try:
+        lease = await request_queue.acquire(uid)
+    except UserQueueFullError:
         raise HTTPException(
             status_code=429,
-            detail=f"用户 {uid} 有请求正在处理中，请等待完成后再试"
+            detail=f"用户 {uid} 排队请求过多，请等待完成后再试"
+        )
+    except UserQueueTimeoutError:
+        raise HTTPException(
+            status_code=503,
+            detail=f"用户 {uid} 排队等待超时，请稍后再试"
         )
     
+    # 拿到租约后再全局准入
+    try:
+        ticket = admit_or_shed(uid, service_level)
+    except HTTPException:
+        await unmark_user_processing(lease)
+        raise
+    
+    result = None
+    timed_out = False
     try:
         logger.info(f"💬 开始处理非流式聊天: {uid}")
         
@@ -202,11 +308,23 @@ async def chat_non_stream(request: ChatRequest, background_tasks: BackgroundTask
             "message": request.message,
             "session_id": request.session_id or str(uuid.uuid4()),
             "context": request.context or {},
-            "preferences": request.preferences or {}
+            "preferences": request.preferences or {},
+            "lease_fence": lease.fence,
+            "lease_slot": lease.slot
         }
         
-        # 执行核心流程
-        result = await process_chat_request(request_data, parallel=False)
+        # 执行核心流程（受request_timeout约束，租约丢失时中止）
+        try:
+            result = await asyncio.wait_for(
+                lease.guard(process_chat_request(request_data, parallel=False)),
+                timeout=settings.concurrency.request_timeout
+            )
+        except asyncio.TimeoutError:
+            timed_out = True
+            logger.error(f"⏱️ 非流式聊天超时: {uid}")
+            raise HTTPException(status_code=504, detail="处理超时，请稍后再试")
+        except LeaseLostError:
+            raise HTTPException(status_code=503, detail="处理租约已丢失，请稍后重试")
         
         # 构建响应
         if result.get("flow_completed"):
@@ -218,7 +336,9 @@ async def chat_non_stream(request: ChatRequest, background_tasks: BackgroundTask
                 metadata={
                     "tokens_used": result.get("tokens_used", 0),
                     "flow_duration": result.get("flow_duration", 0),
-                    "processing_timestamp": result.get("processing_timestamp")
+                    "processing_timestamp": result.get("processing_timestamp"),
+                    "trace_id": result.get("trace_id"),
+                    **({"trace": result["trace_summary"]} if result.get("trace_summary") else {})
                 }
             )
             
@@ -237,21 +357,104 @@ async def chat_non_stream(request: ChatRequest, background_tasks: BackgroundTask
         raise HTTPException(status_code=500, detail=f"处理聊天请求时发生错误: {str(e)}")
     
     finally:
-        # 确保释放用户处理标记
-        background_tasks.add_task(unmark_user_processing, uid)
+        release_admission(ticket, result, failed=timed_out)
+        # 确保释放客户租约：抛出HTTPException时FastAPI不会执行BackgroundTasks，不能放在后台任务中
+        await unmark_user_processing(lease)
+
+async def run_stream_generation(request_data: Dict[str, Any], lease: UserLease, ticket: Optional[AdmissionTicket]):
+    """
+    后台执行流式对话生成，与HTTP连接解耦
+    客户端断开不会取消生成；结束后写入终止事件，再释放准入凭证和客户租约
+    """
+    uid = request_data["uid"]
+    session_id = request_data["session_id"]
+    result = None
+    failed = False
+    final_event = None
+    try:
+        result = await asyncio.wait_for(
+            lease.guard(process_chat_request(request_data, parallel=False)),
+            timeout=settings.concurrency.request_timeout
+        )
+        # 与非流式端点一致：流程未完成或生成失败时写入错误终止事件
+        if not result.get("flow_completed") or result.get("processing_error"):
+            raise RuntimeError(result.get("flow_error") or result.get("processing_error") or "未知错误")
+        final_event = {
+            "type": "complete",
+            "message": "处理完成",
+            "uid": uid,
+            "session_id": session_id,
+            "full_content": result.get("response_content", ""),
+            "metadata": {
+                "tokens_used": result.get("tokens_used", 0),
+                "flow_duration": result.get("flow_duration", 0),
+                "trace_id": result.get("trace_id"),
+                **({"trace": result["trace_summary"]} if result.get("trace_summary") else {})
+            },
+            "timestamp": datetime.now().isoformat()
+        }
+        logger.info(f"✅ 流式聊天完成: {uid}")
+        
+    except (Exception, asyncio.CancelledError) as e:
+        failed = True
+        if isinstance(e, asyncio.TimeoutError):
+            error = f"处理超时({settings.concurrency.request_timeout}s)"
+        elif isinstance(e, asyncio.CancelledError):
+            error = "服务正在关闭"
+        elif isinstance(e, LeaseLostError):
+            error = "处理租约已丢失"
+        else:
+            error = str(e)
+        logger.error(f"❌ 流式聊天异常: {uid} - {error}")
+        final_event = {
+            "type": "error",
+            "error": f"处理请求时发生错误: {error}",
+            "uid": uid,
+            "session_id": session_id,
+            "timestamp": datetime.now().isoformat()
+        }
+        if isinstance(e, asyncio.CancelledError):
+            raise
+        
+    finally:
+        await publish_final(uid, session_id, final_event)
+        release_admission(ticket, result, failed=failed)
+        await unmark_user_processing(lease)
+
+def parse_last_event_id(value: Optional[str]) -> Optional[int]:
+    """解析Last-Event-ID（数据块序号）"""
+    if value is None or value == "":
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"无效的Last-Event-ID: {value}")
+
+async def resume_stream(uid: str, session_id: str, last_event_id: Optional[int]):
+    """从流式存储回放并跟随实时输出"""
+    if not await stream_exists(uid, session_id):
+        raise HTTPException(status_code=404, detail=f"流式会话不存在或已过期: {session_id}")
+    
+    logger.info(f"🔁 流式续传: {uid}/{session_id}, Last-Event-ID: {last_event_id}")
+    get_metrics_registry().counter("chat_stream_resumes_total", "流式续传次数").inc()
+    return sse_response(tail_stream(uid, session_id, last_event_id))
 
 @app.post("/chat/stream")
-async def stream_chat(request: ChatRequest):
+async def stream_chat(request: ChatRequest, last_event_id: Optional[str] = Header(default=None)):
     """
     流式聊天端点
-    返回Server-Sent Events格式的流式响应
+    返回Server-Sent Events格式的流式响应；携带session_id和Last-Event-ID时续传已有的生成
     """
     uid = request.uid
     
-    # 检查用户是否已在处理中
-    can_process = await check_and_mark_user_processing(uid)
-    if not can_process:
-        error_msg = f"用户 {uid} 有请求正在处理中，请等待完成后再试"
+    # 断线重连：不重新生成，从存储中续传
+    resume_from = parse_last_event_id(last_event_id)
+    if resume_from is not None and request.session_id:
+        return await resume_stream(uid, request.session_id, resume_from)
+    
+    # 排队已满时直接返回错误，否则在流中排队
+    if request_queue.is_full(uid):
+        error_msg = f"用户 {uid} 排队请求过多，请等待完成后再试"
         logger.warning(f"⚠️ {error_msg}")
         
         # 返回错误的流式响应
@@ -262,23 +465,63 @@ async def stream_chat(request: ChatRequest):
                 'uid': uid,
                 'timestamp': datetime.now().isoformat()
             }
-            yield f"data: {json.dumps(error_data, ensure_ascii=False)}\n\n"
+            yield encode_event(error_data)
         
-        return StreamingResponse(
-            error_response(),
-            media_type="text/plain",
-            headers={
-                "Cache-Control": "no-cache",
-                "Connection": "keep-alive",
-                "Access-Control-Allow-Origin": "*"
-            }
-        )
+        return sse_response(error_response())
+    
+    # 过载时在建立流之前快速拒绝
+    service_level = await resolve_service_level(uid)
+    shed_if_overloaded(uid, service_level)
     
     # 流式处理
     async def stream_with_cleanup():
-        """带清理的流式响应生成器"""
-        processing_task = None
+        """
+        排队并启动后台生成，然后跟随流式存储输出
+        租约与准入凭证都在流内获取：响应体未被迭代（连接提前断开）时不会占用任何资源
+        """
+        lease = None
+        ticket = None
+        started = False
         try:
+            # 排队等待客户租约，期间推送排队位置
+            try:
+                async for item in request_queue.wait(uid):
+                    if isinstance(item, QueuePosition):
+                        queued_event = {
+                            "type": "queued",
+                            "message": f"前方还有 {item.position} 个请求",
+                            "uid": uid,
+                            "position": item.position,
+                            "waited": item.waited,
+                            "timestamp": datetime.now().isoformat()
+                        }
+                        yield encode_event(queued_event)
+                    else:
+                        lease = item
+            except (UserQueueFullError, UserQueueTimeoutError) as e:
+                error_event = {
+                    "type": "error",
+                    "error": str(e),
+                    "uid": uid,
+                    "timestamp": datetime.now().isoformat()
+                }
+                yield encode_event(error_event)
+                return
+            
+            # 拿到租约后再全局准入
+            if admission is not None:
+                ticket = admission.try_acquire(uid, service_level)
+                if ticket is None:
+                    shed_event = {
+                        "type": "error",
+                        "error": "服务繁忙，请稍后再试",
+                        "retry_after": admission.retry_after(),
+                        "uid": uid,
+                        "timestamp": datetime.now().isoformat()
+                    }
+                    yield encode_event(shed_event)
+                    return
+            
             logger.info(f"🌊 开始流式聊天处理: {uid}")
             
             # 构建请求数据
@@ -287,9 +530,29 @@ async def stream_chat(request: ChatRequest):
                 "message": request.message,
                 "session_id": request.session_id or str(uuid.uuid4()),
                 "context": request.context or {},
-                "preferences": request.preferences or {}
+                "preferences": request.preferences or {},
+                "lease_fence": lease.fence,
+                "lease_slot": lease.slot
             }
             
+            # 启动后台生成，此后租约与准入凭证由生成任务负责释放
+            try:
+                await generation_registry.start(
+                    uid, request_data["session_id"],
+                    run_stream_generation(request_data, lease, ticket)
+                )
+            except GenerationRunningError as e:
+                busy_event = {
+                    "type": "error",
+                    "error": str(e),
+                    "uid": uid,
+                    "session_id": request_data["session_id"],
+                    "timestamp": datetime.now().isoformat()
+                }
+                yield encode_event(busy_event)
+                return
+            started = True
+            
             # 发送开始事件
             start_event = {
                 "type": "start",
@@ -298,135 +561,50 @@ async def stream_chat(request: ChatRequest):
                 "session_id": request_data["session_id"],
                 "timestamp": datetime.now().isoformat()
             }
-            yield f"data: {json.dumps(start_event, ensure_ascii=False)}\n\n"
-            
-            # 启动处理任务（异步执行）
-            processing_task = asyncio.create_task(
-                process_chat_request(request_data, parallel=False)
-            )
-            
-            # 获取Redis客户端
-            redis_client = await get_redis_client()
-            
-            # 实时读取chunks
-            chunks_sent = 0
-            processing_completed = False
-            
-            # 使用与ChatProcessor相同的stream_key格式
-            expected_stream_key = f"stream:{uid}:{request_data['session_id']}"
-            
-            while not processing_completed:
-                try:
-                    # 检查处理任务是否完成
-                    if processing_task.done():
-                        processing_completed = True
-                        result = await processing_task
-                        
-                        # 确认最终的stream_key
-                        if result.get("stream_key"):
-                            expected_stream_key = result["stream_key"]
-                    
-                    # 读取新的chunks
-                    chunks = await redis_client.lrange(f"{expected_stream_key}:chunks", 0, -1)
-                    
-                    if chunks:
-                        # 发送新的chunks（从上次发送的位置开始）
-                        total_chunks = len(chunks)
-                        if total_chunks > chunks_sent:
-                            # 由于使用lpush，新的chunks在前面，需要反转并选择新的
-                            new_chunks = list(reversed(chunks))[chunks_sent:]
-                            
-                            for chunk_json in new_chunks:
-                                try:
-                                    chunk_data = json.loads(chunk_json)
-                                    chunk_type = chunk_data.get("type", "")
-                                    
-                                    # 发送所有有意义的chunks，不只是delta
-                                    if chunk_type in ["response.output_text.delta", "response.output_text.done", "usage", "response.completed"]:
-                                        # 添加调试日志
-                                        logger.info(f"🌊 发送chunk类型: {chunk_type}")
-                                        yield f"data: {json.dumps(chunk_data, ensure_ascii=False)}\n\n"
-                                except json.JSONDecodeError:
-                                    continue
-                            
-                            chunks_sent = total_chunks
-                    
-                    # 如果处理未完成，等待一小段时间再检查
-                    if not processing_completed:
-                        await asyncio.sleep(0.1)  # 100ms检查间隔
-                        
-                except Exception as e:
-                    logger.error(f"读取chunks时出错: {str(e)}")
-                    await asyncio.sleep(0.1)
-            
-            # 处理完成后，确保所有chunks都已发送
-            if processing_task.done():
-                result = await processing_task
-                
-                # 发送完成事件
-                completion_event = {
-                    "type": "complete",
-                    "message": "处理完成",
-                    "uid": uid,
-                    "session_id": request_data["session_id"],
-                    "full_content": result.get("response_content", ""),
-                    "metadata": {
-                        "tokens_used": result.get("tokens_used", 0),
-                        "flow_duration": result.get("flow_duration", 0)
-                    },
-                    "timestamp": datetime.now().isoformat()
-                }
-                yield f"data: {json.dumps(completion_event, ensure_ascii=False)}\n\n"
-                
-                logger.info(f"✅ 流式聊天完成: {uid}")
-            
-        except Exception as e:
-            logger.error(f"❌ 流式聊天异常: {uid} - {str(e)}")
+            yield encode_event(start_event)
             
-            # 取消处理任务
-            if processing_task and not processing_task.done():
-                processing_task.cancel()
-                
-            error_event = {
-                "type": "error",
-                "error": f"处理请求时发生错误: {str(e)}",
-                "uid": uid,
-                "timestamp": datetime.now().isoformat()
-            }
-            yield f"data: {json.dumps(error_event, ensure_ascii=False)}\n\n"
+            # 跟随流式存储输出，直到终止事件
+            async for frame in tail_stream(uid, request_data["session_id"]):
+                yield frame
         
         finally:
-            # 确保取消用户处理标记
-            await unmark_user_processing(uid)
+            # 生成任务未启动（排队失败或连接在排队期间断开）时由连接释放
+            if not started:
+                release_admission(ticket)
+                if lease:
+                    await unmark_user_processing(lease)
     
-    return StreamingResponse(
-        stream_with_cleanup(),
-        media_type="text/plain",
-        headers={
-            "Cache-Control": "no-cache",
-            "Connection": "keep-alive",
-            "Access-Control-Allow-Origin": "*",
-            "Access-Control-Allow-Headers": "*"
-        }
-    )
+    return sse_response(stream_with_cleanup())
+
+@app.get("/chat/stream/{uid}/{session_id}")
+async def resume_stream_chat(
+    uid: str,
+    session_id: str,
+    last_event_id: Optional[str] = Header(default=None),
+    cursor: Optional[str] = None
+):
+    """
+    流式续传端点（EventSource重连时自动携带Last-Event-ID）
+    cursor查询参数用于无法设置请求头的客户端
+    """
+    return await resume_stream(uid, session_id, parse_last_event_id(last_event_id or cursor))
 
 @app.get("/status", response_model=SystemStatus)
 async def get_system_status():
     """获取系统状态"""
     try:
-        # 获取Redis信息
-        redis_client = await get_redis_client()
-        redis_info = await redis_client.info()
+        # 获取Redis信息（带缓存，避免每次请求都执行INFO）
+        redis_info = await get_redis_info_sampler().get()
+        registry = get_metrics_registry()
         
         # 获取用户状态
-        async with user_lock:
-            active_connections = len(user_processing)
+        active_connections = len(lease_manager.active_users())
         
-        # 系统运行时间（简化版）
-        uptime = 0.0  # 这里可以记录服务启动时间来计算真实uptime
+        # 今日已处理对话数
+        usage = await get_usage_stats().query(days=1)
         
         return SystemStatus(
-            uptime=uptime,
+            uptime=registry.uptime(),
             memory_usage={
                 "redis_used_memory": redis_info.get("used_memory", 0),
                 "redis_used_memory_human": redis_info.get("used_memory_human", "0B")
@@ -437,8 +615,8 @@ async def get_system_status():
                 "used_memory": redis_info.get("used_memory", 0)
             },
             active_connections=active_connections,
-            processed_conversations=0,  # 这里可以从Redis统计数据获取
-            error_count=0,  # 这里可以维护错误计数器
+            processed_conversations=usage["total_conversations"],
+            error_count=int(registry.total("chat_errors_total")),
             average_satisfaction=None
         )
         
@@ -451,21 +629,23 @@ async def get_metrics():
     """获取性能指标"""
     try:
         # 获取当前用户状态
-        async with user_lock:
-            concurrent_customers = len(user_processing)
+        concurrent_customers = len(lease_manager.active_users())
         
-        # 获取Redis信息
-        redis_client = await get_redis_client()
-        redis_info = await redis_client.info()
+        # 获取Redis信息（带缓存）
+        redis_info = await get_redis_info_sampler().get()
+        registry = get_metrics_registry()
+        
+        # 最近一分钟的对话速率（来自分片时间桶）
+        usage_rate = await get_usage_stats().rate(window_seconds=60)
         
         return MetricsResponse(
             timestamp=datetime.now(),
-            conversations_per_second=0.0,  # 需要实现统计逻辑
-            average_response_time=0.0,     # 需要实现统计逻辑
+            conversations_per_second=usage_rate["conversations_per_second"],
+            average_response_time=registry.merged_histogram("chat_flow_duration_seconds").mean,
             concurrent_customers=concurrent_customers,
-            redis_operations_per_second=0.0,  # 需要实现统计逻辑
+            redis_operations_per_second=registry.meter("redis_commands").rate(),
             memory_usage_mb=redis_info.get("used_memory", 0) / 1024 / 1024,
-            cpu_usage_percent=0.0,  # 需要系统资源监控
+            cpu_usage_percent=get_cpu_sampler().sample(),
             customer_satisfaction_rate=None
         )
         
@@ -473,19 +653,53 @@ async def get_metrics():
         logger.error(f"获取性能指标失败: {str(e)}")
         raise HTTPException(status_code=500, detail=f"获取性能指标失败: {str(e)}")
 
+@app.get("/metrics/usage")
+async def get_usage_metrics(days: int = 1):
+    """获取最近若干天的使用统计（对话数、token数、独立客户数）"""
+    if days < 1 or days > settings.monitoring.stats_retention_days:
+        raise HTTPException(
+            status_code=400,
+            detail=f"days必须在1到{settings.monitoring.stats_retention_days}之间"
+        )
+    
+    try:
+        return await get_usage_stats().query(days=days)
+    except Exception as e:
+        logger.error(f"获取使用统计失败: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"获取使用统计失败: {str(e)}")
+
+@app.get("/traces/{trace_id}")
+async def get_trace(trace_id: str):
+    """获取最近请求的trace摘要（仅保留在本进程内存中）"""
+    tracer = get_tracer()
+    trace = tracer.memory.get(trace_id) if tracer.memory else None
+    if trace is None:
+        raise HTTPException(status_code=404, detail=f"trace不存在或已过期: {trace_id}")
+    return trace.summary()
+
 @app.get("/stats")
 async def get_stats():
     """获取处理统计信息"""
-    async with user_lock:
-        active_users = len(user_processing)
-        processing_users = list(user_processing)
+    processing_users = lease_manager.active_users()
+    active_users = len(processing_users)
+    
+    profile_cache = get_profile_cache()
+    write_behind = get_write_behind_queue()
     
     return {
         "service_stats": {
             "active_users": active_users,
             "processing_users": processing_users,
             "timestamp": datetime.now().isoformat()
-        }
+        },
+        "profile_cache": profile_cache.stats() if profile_cache else None,
+        "write_behind": write_behind.stats() if write_behind else None,
+        "user_leases": lease_manager.stats(),
+        "user_queue": request_queue.stats(),
+        "admission": admission.stats() if admission else None,
+        "stream_cleanup": get_stream_sweeper().stats(),
+        "container": get_container().stats() if get_container() else None,
+        "stream_generations": generation_registry.stats()
     }
 
 # 异常处理
@@ -500,7 +714,8 @@ async def http_exception_handler(request, exc: HTTPException):
                 "message": exc.detail,
                 "timestamp": datetime.now().isoformat()
             }
-        }
+        },
+        headers=exc.headers
     )
 
 @app.exception_handler(Exception)
@@ -531,6 +746,7 @@ def main():
     print("🔗 API端点:")
     print(f"   💬 聊天接口: POST http://{settings.host}:{settings.port}/chat")
     print(f"   🌊 流式接口: POST http://{settings.host}:{settings.port}/chat/stream")
+    print(f"   🔁 流式续传: GET http://{settings.host}:{settings.port}/chat/stream/{{uid}}/{{session_id}}")
     print(f"   ❤️ 健康检查: GET http://{settings.host}:{settings.port}/health")
     print(f"   📊 系统状态: GET http://{settings.host}:{settings.port}/status")
     print(f"   📈 性能指标: GET http://{settings.host}:{settings.port}/metrics")
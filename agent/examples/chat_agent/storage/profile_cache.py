@@ -0,0 +1,218 @@
+"""
+进程内Profile缓存
+缓存已解析的CustomerProfile/CustomerMemory，StoreProfile写穿更新，
+其他worker写入时通过Redis发布订阅失效本地副本
+"""
+
+import asyncio
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Any, Optional
+
+from utils.logger import get_logger
+from models.api_models import CustomerProfile, CustomerMemory
+from storage.redis_client import get_redis_client
+from config.settings import get_settings
+
+logger = get_logger(__name__)
+
+
+@dataclass
+class CachedProfile:
+    """缓存条目"""
+    profile: CustomerProfile
+    memory: CustomerMemory
+    preferences: Dict[str, Any]
+    expires_at: float
+
+
+class ProfileCache:
+    """有界LRU Profile缓存"""
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, CachedProfile]" = OrderedDict()
+
+        # 命中统计
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, uid: str) -> Optional[CachedProfile]:
+        """
+        获取缓存条目的副本
+
+        返回副本是因为StoreProfile会原地修改Profile统计字段
+        """
+        entry = self.peek(uid)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(uid)
+        self.hits += 1
+        return CachedProfile(
+            profile=entry.profile.model_copy(),
+            memory=entry.memory.model_copy(update={
+                "short_term": list(entry.memory.short_term),
+                "key_topics": list(entry.memory.key_topics)
+            }),
+            preferences=dict(entry.preferences),
+            expires_at=entry.expires_at
+        )
+
+    def peek(self, uid: str) -> Optional[CachedProfile]:
+        """只读查看缓存条目（不计入统计、不调整LRU顺序）"""
+        entry = self._entries.get(uid)
+        if entry is None:
+            return None
+        if entry.expires_at < time.monotonic():
+            del self._entries[uid]
+            return None
+        return entry
+
+    def put(self, uid: str, profile: CustomerProfile, memory: CustomerMemory, preferences: Dict[str, Any]):
+        """写入缓存"""
+        self._entries[uid] = CachedProfile(
+            profile=profile,
+            memory=memory,
+            preferences=preferences,
+            expires_at=time.monotonic() + self.ttl
+        )
+        self._entries.move_to_end(uid)
+
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, uid: str):
+        """删除缓存条目"""
+        if self._entries.pop(uid, None) is not None:
+            self.invalidations += 1
+
+    def clear(self):
+        """清空缓存"""
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """缓存统计"""
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations
+        }
+
+
+class ProfileCacheInvalidator:
+    """基于Redis发布订阅的跨进程缓存失效"""
+
+    def __init__(self, cache: ProfileCache, channel: str):
+        self.cache = cache
+        self.channel = channel
+        # 用于过滤自身发出的通知
+        self.worker_id = uuid.uuid4().hex
+        self._task: Optional[asyncio.Task] = None
+
+    async def publish(self, uid: str):
+        """通知其他worker该客户的Profile已变更"""
+        try:
+            redis_client = await get_redis_client()
+            await redis_client.publish(self.channel, f"{self.worker_id}:{uid}")
+        except Exception as e:
+            logger.warning(f"缓存失效通知发送失败: {str(e)}")
+
+    async def start(self):
+        """启动订阅任务"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._listen())
+            logger.info(f"📡 Profile缓存失效订阅已启动: {self.channel}")
+
+    async def stop(self):
+        """停止订阅任务"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _listen(self):
+        """订阅循环，连接异常时清空缓存并重连"""
+        while True:
+            pubsub = None
+            try:
+                redis_client = await get_redis_client()
+                pubsub = redis_client.pubsub()
+                await pubsub.subscribe(self.channel)
+
+                async for message in pubsub.listen():
+                    if message.get("type") != "message":
+                        continue
+                    self._handle_message(message.get("data"))
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # 断线期间可能错过失效通知，保守起见清空缓存
+                logger.warning(f"缓存失效订阅中断，1秒后重连: {str(e)}")
+                self.cache.clear()
+                await asyncio.sleep(1.0)
+            finally:
+                if pubsub is not None:
+                    try:
+                        await pubsub.unsubscribe(self.channel)
+                        await pubsub.close()
+                    except Exception:
+                        pass
+
+    def _handle_message(self, data):
+        """处理失效通知"""
+        if isinstance(data, bytes):
+            data = data.decode("utf-8")
+        worker_id, _, uid = (data or "").partition(":")
+        if uid and worker_id != self.worker_id:
+            self.cache.invalidate(uid)
+
+
+# 全局缓存实例
+_profile_cache: Optional[ProfileCache] = None
+_invalidator: Optional[ProfileCacheInvalidator] = None
+
+def get_profile_cache() -> Optional[ProfileCache]:
+    """获取全局Profile缓存，未启用时返回None"""
+    global _profile_cache
+
+    settings = get_settings()
+    if not settings.cache.profile_cache_enabled:
+        return None
+
+    if _profile_cache is None:
+        _profile_cache = ProfileCache(
+            max_size=settings.cache.profile_cache_size,
+            ttl=settings.cache.profile_cache_ttl
+        )
+
+    return _profile_cache
+
+def get_cache_invalidator() -> Optional[ProfileCacheInvalidator]:
+    """获取全局缓存失效器，未启用缓存时返回None"""
+    global _invalidator
+
+    cache = get_profile_cache()
+    if cache is None:
+        return None
+
+    if _invalidator is None:
+        _invalidator = ProfileCacheInvalidator(cache, get_settings().cache.invalidation_channel)
+
+    return _invalidator
@@ -0,0 +1,296 @@
+"""
+客户Profile编解码模块
+LoadProfile与StoreProfile共用的版本化序列化层，替代eval()解析
+"""
+
+import ast
+import json
+from typing import Dict, Any, Optional, Union
+from datetime import datetime
+
+from models.api_models import CustomerProfile, CustomerMemory, ConversationInfo
+
+try:
+    import orjson
+except ImportError:  # orjson为可选依赖，缺失时回退到标准库json
+    orjson = None
+
+# 编码格式版本号，写入每个文档/Hash的 "_v" 字段
+CODEC_VERSION = 1
+
+RawValue = Union[str, bytes, None]
+
+
+class CodecVersionError(ValueError):
+    """数据的编码版本无法识别（例如由更新的版本写入）"""
+
+
+def check_version(data: Dict[Any, Any]) -> int:
+    """
+    校验文档/Hash的 "_v" 字段
+
+    Returns:
+        int: 数据的编码版本，缺失时为0（编解码层引入之前写入的旧数据，按兼容格式解析）
+
+    Raises:
+        CodecVersionError: 版本号非法或高于当前CODEC_VERSION
+    """
+    raw = data.get("_v", data.get(b"_v"))
+    if raw is None or raw == "" or raw == b"":
+        return 0
+    try:
+        version = int(_text(raw) if isinstance(raw, (str, bytes)) else raw)
+    except (TypeError, ValueError):
+        raise CodecVersionError(f"无法识别的编码版本: {raw!r}")
+    if version > CODEC_VERSION:
+        raise CodecVersionError(f"编码版本 {version} 高于当前支持的版本 {CODEC_VERSION}")
+    return version
+
+
+def _default(value: Any) -> Any:
+    """orjson与标准库共用的扩展类型编码，datetime统一为isoformat()"""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+def dumps(value: Any) -> str:
+    """序列化为JSON字符串（优先使用orjson）"""
+    if orjson is not None:
+        # datetime交给_default处理，两种后端输出一致
+        return orjson.dumps(value, default=_default, option=orjson.OPT_PASSTHROUGH_DATETIME).decode("utf-8")
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"), default=_default)
+
+
+def loads(raw: RawValue, default: Any = None) -> Any:
+    """
+    解析JSON字段，兼容旧版本写入的Python字面量
+
+    Args:
+        raw: Redis中读取的原始值
+        default: 值为空或无法解析时的返回值
+    """
+    if raw is None or raw == "" or raw == b"":
+        return default
+    try:
+        if orjson is not None:
+            return orjson.loads(raw)
+        return json.loads(raw)
+    except ValueError:
+        pass
+    # 旧数据可能是Python字面量（例如 {'a': True}），使用安全的literal_eval兜底
+    try:
+        return ast.literal_eval(_text(raw))
+    except (ValueError, SyntaxError):
+        return default
+
+
+def _text(raw: RawValue) -> str:
+    """bytes统一转换为str"""
+    if isinstance(raw, bytes):
+        return raw.decode("utf-8")
+    return raw or ""
+
+
+def _normalize(data: Dict[Any, Any]) -> Dict[str, str]:
+    """统一Hash的key/value类型为str"""
+    return {_text(k): _text(v) for k, v in data.items()}
+
+
+def _parse_datetime(raw: RawValue) -> datetime:
+    value = _text(raw)
+    return datetime.fromisoformat(value) if value else datetime.now()
+
+
+def _parse_int(raw: RawValue) -> Optional[int]:
+    value = _text(raw)
+    return int(value) if value else None
+
+
+def _parse_float(raw: RawValue) -> Optional[float]:
+    value = _text(raw)
+    return float(value) if value else None
+
+
+class ProfileCodec:
+    """
+    客户Profile编解码器
+    解码时使用model_construct跳过pydantic校验，数据来源为自身写入的可信格式
+    """
+
+    # ------------------------------------------------------------------
+    # CustomerProfile
+    # ------------------------------------------------------------------
+    @staticmethod
+    def profile_to_hash(profile: CustomerProfile, include_counters: bool = True) -> Dict[str, str]:
+        """
+        CustomerProfile -> Redis Hash字段
+        
+        Args:
+            profile: 客户Profile
+            include_counters: 是否包含total_conversations/total_tokens，
+                由HINCRBY在服务端累加时应传False，避免覆盖并发写入
+        """
+        data = {
+            "_v": str(CODEC_VERSION),
+            "uid": profile.uid,
+            "created_at": profile.created_at.isoformat(),
+            "last_active": profile.last_active.isoformat(),
+            "total_conversations": str(profile.total_conversations),
+            "total_tokens": str(profile.total_tokens),
+            "preferences": dumps(profile.preferences),
+            "learning_data": dumps(profile.learning_data),
+            "satisfaction_score": str(profile.satisfaction_score) if profile.satisfaction_score is not None else "",
+            "service_level": profile.service_level
+        }
+        if not include_counters:
+            del data["total_conversations"]
+            del data["total_tokens"]
+        return data
+
+    @staticmethod
+    def profile_from_hash(uid: str, data: Dict[Any, Any]) -> CustomerProfile:
+        """Redis Hash字段 -> CustomerProfile"""
+        data = _normalize(data)
+        check_version(data)
+        return CustomerProfile.model_construct(
+            uid=uid,
+            created_at=_parse_datetime(data.get("created_at")),
+            last_active=_parse_datetime(data.get("last_active")),
+            total_conversations=_parse_int(data.get("total_conversations")) or 0,
+            total_tokens=_parse_int(data.get("total_tokens")) or 0,
+            preferences=loads(data.get("preferences"), {}),
+            learning_data=loads(data.get("learning_data"), {}),
+            satisfaction_score=_parse_float(data.get("satisfaction_score")),
+            service_level=data.get("service_level") or "standard"
+        )
+
+    @staticmethod
+    def profile_to_dict(profile: CustomerProfile) -> Dict[str, Any]:
+        """CustomerProfile -> 可JSON序列化的字典"""
+        return {
+            "uid": profile.uid,
+            "created_at": profile.created_at.isoformat(),
+            "last_active": profile.last_active.isoformat(),
+            "total_conversations": profile.total_conversations,
+            "total_tokens": profile.total_tokens,
+            "preferences": profile.preferences,
+            "learning_data": profile.learning_data,
+            "satisfaction_score": profile.satisfaction_score,
+            "service_level": profile.service_level
+        }
+
+    @staticmethod
+    def profile_from_dict(data: Dict[str, Any]) -> CustomerProfile:
+        """字典 -> CustomerProfile"""
+        return CustomerProfile.model_construct(
+            uid=data["uid"],
+            created_at=_parse_datetime(data.get("created_at")),
+            last_active=_parse_datetime(data.get("last_active")),
+            total_conversations=data.get("total_conversations", 0),
+            total_tokens=data.get("total_tokens", 0),
+            preferences=data.get("preferences") or {},
+            learning_data=data.get("learning_data") or {},
+            satisfaction_score=data.get("satisfaction_score"),
+            service_level=data.get("service_level") or "standard"
+        )
+
+    # ------------------------------------------------------------------
+    # ConversationInfo
+    # ------------------------------------------------------------------
+    @staticmethod
+    def conversation_to_hash(conversation: ConversationInfo, session_id: Optional[str] = None) -> Dict[str, str]:
+        """ConversationInfo -> Redis Hash字段"""
+        data = {
+            "_v": str(CODEC_VERSION),
+            "id": conversation.id,
+            "timestamp": conversation.timestamp.isoformat(),
+            "customer_message": conversation.customer_message,
+            "agent_message": conversation.agent_message,
+            "tokens_used": str(conversation.tokens_used),
+            "context_summary": conversation.context_summary or "",
+            "session_id": session_id or ""
+        }
+        if conversation.satisfaction_rating is not None:
+            data["satisfaction_rating"] = str(conversation.satisfaction_rating)
+        return data
+
+    @staticmethod
+    def conversation_from_hash(data: Dict[Any, Any]) -> ConversationInfo:
+        """Redis Hash字段 -> ConversationInfo"""
+        data = _normalize(data)
+        check_version(data)
+        return ConversationInfo.model_construct(
+            id=data.get("id", ""),
+            timestamp=_parse_datetime(data.get("timestamp")),
+            customer_message=data.get("customer_message", ""),
+            agent_message=data.get("agent_message", ""),
+            tokens_used=_parse_int(data.get("tokens_used")) or 0,
+            context_summary=data.get("context_summary") or None,
+            satisfaction_rating=_parse_int(data.get("satisfaction_rating"))
+        )
+
+    @staticmethod
+    def conversation_to_dict(conversation: ConversationInfo) -> Dict[str, Any]:
+        """ConversationInfo -> 可JSON序列化的字典"""
+        return {
+            "id": conversation.id,
+            "timestamp": conversation.timestamp.isoformat(),
+            "customer_message": conversation.customer_message,
+            "agent_message": conversation.agent_message,
+            "tokens_used": conversation.tokens_used,
+            "context_summary": conversation.context_summary,
+            "satisfaction_rating": conversation.satisfaction_rating
+        }
+
+    @staticmethod
+    def conversation_from_dict(data: Dict[str, Any]) -> ConversationInfo:
+        """字典 -> ConversationInfo"""
+        return ConversationInfo.model_construct(
+            id=data.get("id", ""),
+            timestamp=_parse_datetime(data.get("timestamp")),
+            customer_message=data.get("customer_message", ""),
+            agent_message=data.get("agent_message", ""),
+            tokens_used=data.get("tokens_used", 0),
+            context_summary=data.get("context_summary"),
+            satisfaction_rating=data.get("satisfaction_rating")
+        )
+
+    # ------------------------------------------------------------------
+    # CustomerMemory
+    # ------------------------------------------------------------------
+    @classmethod
+    def memory_to_dict(cls, memory: CustomerMemory) -> Dict[str, Any]:
+        """CustomerMemory -> 可JSON序列化的字典"""
+        return {
+            "short_term": [cls.conversation_to_dict(conv) for conv in memory.short_term],
+            "long_term_summary": memory.long_term_summary,
+            "preferences": memory.preferences,
+            "total_context_tokens": memory.total_context_tokens,
+            "key_topics": memory.key_topics
+        }
+
+    @classmethod
+    def memory_from_dict(cls, data: Dict[str, Any]) -> CustomerMemory:
+        """字典 -> CustomerMemory"""
+        conversations = [cls.conversation_from_dict(conv) for conv in data.get("short_term") or []]
+        return CustomerMemory.model_construct(
+            short_term=conversations,
+            long_term_summary=data.get("long_term_summary"),
+            preferences=data.get("preferences") or {},
+            total_context_tokens=data.get("total_context_tokens", sum(conv.tokens_used for conv in conversations)),
+            key_topics=data.get("key_topics") or []
+        )
+
+    # ------------------------------------------------------------------
+    # 偏好Hash（每个字段独立JSON编码）
+    # ------------------------------------------------------------------
+    @staticmethod
+    def preferences_to_hash(preferences: Dict[str, Any]) -> Dict[str, str]:
+        """偏好字典 -> Redis Hash字段"""
+        return {k: dumps(v) for k, v in preferences.items()}
+
+    @staticmethod
+    def preferences_from_hash(data: Dict[Any, Any]) -> Dict[str, Any]:
+        """Redis Hash字段 -> 偏好字典"""
+        return {_text(k): loads(v) for k, v in data.items() if _text(k) != "_v"}
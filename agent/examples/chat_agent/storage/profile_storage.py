@@ -0,0 +1,262 @@
+"""
+单文档Profile存储层
+将一个客户的Profile、记忆、偏好和活动信息保存为一个紧凑的JSON文档，
+读取只需一次GET，更新通过Lua脚本做版本号CAS保证原子性
+"""
+
+from dataclasses import dataclass
+from typing import Dict, Any, Optional, List, Callable, Tuple
+from datetime import datetime
+
+from utils.logger import get_logger
+from models.api_models import CustomerProfile, CustomerMemory, ConversationInfo
+from storage.redis_client import get_redis_client
+from storage.profile_codec import ProfileCodec, CODEC_VERSION, check_version, dumps, loads
+from config.settings import get_settings
+
+logger = get_logger(__name__)
+
+# 话题列表保留数量（与hash布局的 LTRIM 0 50 保持一致）
+MAX_KEY_TOPICS = 51
+
+# CAS写入脚本：文档中的rev与期望值一致时才写入；
+# 传入fencing记录键时，fencing token小于该槽位已写入的值（租约已被接管）则拒绝写入
+# KEYS[1]: 文档键  KEYS[2]: 已写入fencing记录（可选）
+# ARGV[1]: 期望的rev  ARGV[2]: 新文档  ARGV[3]: TTL(秒)
+# ARGV[4]: 租约槽位  ARGV[5]: fencing token  ARGV[6]: fencing记录TTL(秒)
+CAS_WRITE_SCRIPT = """
+if KEYS[2] then
+    local written = tonumber(redis.call('HGET', KEYS[2], ARGV[4]) or '0')
+    if tonumber(ARGV[5]) < written then
+        return -2
+    end
+end
+local current = redis.call('GET', KEYS[1])
+local rev = 0
+if current then
+    rev = tonumber(cjson.decode(current)['rev']) or 0
+end
+if rev ~= tonumber(ARGV[1]) then
+    return -1
+end
+redis.call('SET', KEYS[1], ARGV[2], 'EX', tonumber(ARGV[3]))
+if KEYS[2] then
+    redis.call('HSET', KEYS[2], ARGV[4], ARGV[5])
+    redis.call('EXPIRE', KEYS[2], tonumber(ARGV[6]))
+end
+return rev + 1
+"""
+
+
+class ProfileConflictError(Exception):
+    """CAS重试次数耗尽"""
+    pass
+
+
+class StaleLeaseError(Exception):
+    """写入方的客户租约已被更新的持有者接管（fencing token过期），写入被拒绝"""
+    pass
+
+
+def fence_record_key(uid: str) -> str:
+    """各租约槽位已写入的最大fencing token（与租约键使用相同的 {uid} 哈希标签）"""
+    return f"lease:{{{uid}}}:written"
+
+
+@dataclass
+class ProfileSnapshot:
+    """单文档读取结果"""
+    profile: CustomerProfile
+    memory: CustomerMemory
+    preferences: Dict[str, Any]
+    revision: int
+
+
+class ProfileDocumentStore:
+    """客户Profile单文档存储"""
+
+    def __init__(self):
+        self.settings = get_settings()
+        self._cas_script = None
+
+    @staticmethod
+    def document_key(uid: str) -> str:
+        """文档键名"""
+        return f"profile_doc:{uid}"
+
+    async def load(self, uid: str) -> Optional[ProfileSnapshot]:
+        """
+        一次GET读取客户完整状态
+
+        Returns:
+            Optional[ProfileSnapshot]: 文档不存在时返回None
+        """
+        redis_client = await get_redis_client()
+        raw = await redis_client.get(self.document_key(uid))
+        document = loads(raw)
+        if not document:
+            return None
+        return self.to_snapshot(document)
+
+    async def update(
+        self,
+        uid: str,
+        mutator: Callable[[Dict[str, Any]], Optional[bool]],
+        fence: Optional[Tuple[int, int]] = None
+    ) -> Dict[str, Any]:
+        """
+        乐观并发更新文档
+
+        Args:
+            uid: 客户ID
+            mutator: 原地修改文档字典的函数，冲突重试时会被再次调用；
+                返回False表示无需写入，直接返回当前文档
+            fence: 写入方的(租约槽位, fencing token)，在CAS脚本中与已写入的值比较
+
+        Returns:
+            Dict[str, Any]: 写入成功的文档
+
+        Raises:
+            ProfileConflictError: 超过重试次数仍然冲突
+            StaleLeaseError: fencing token已过期
+        """
+        redis_client = await get_redis_client()
+        key = self.document_key(uid)
+
+        if self._cas_script is None:
+            self._cas_script = redis_client.register_script(CAS_WRITE_SCRIPT)
+
+        for attempt in range(self.settings.redis.profile_update_retries):
+            document = loads(await redis_client.get(key)) or self._new_document(uid)
+            # 更新版本写入的文档不能按旧格式改写
+            check_version(document)
+            expected_rev = document.get("rev", 0)
+
+            if mutator(document) is False:
+                return document
+            document["_v"] = CODEC_VERSION
+            document["rev"] = expected_rev + 1
+
+            keys = [key]
+            args = [expected_rev, dumps(document), self.settings.redis.profile_ttl]
+            if fence is not None:
+                keys.append(fence_record_key(uid))
+                args.extend([fence[0], fence[1], self.settings.concurrency.fence_record_ttl])
+
+            result = int(await self._cas_script(keys=keys, args=args))
+            if result >= 0:
+                return document
+            if result == -2:
+                raise StaleLeaseError(f"租约已被接管，拒绝写入: {uid} (slot={fence[0]}, fence={fence[1]})")
+
+            logger.debug(f"Profile文档版本冲突，重试: {uid} (第{attempt + 1}次)")
+
+        raise ProfileConflictError(f"Profile文档更新冲突: {uid}")
+
+    async def append_turn(
+        self,
+        uid: str,
+        conversation: ConversationInfo,
+        tokens_used: int,
+        topics: List[str],
+        learned_preferences: Dict[str, Any],
+        summary: Optional[str] = None,
+        fence: Optional[Tuple[int, int]] = None
+    ) -> Dict[str, Any]:
+        """
+        追加一轮对话并更新统计、话题、偏好
+
+        Args:
+            uid: 客户ID
+            conversation: 本轮对话
+            tokens_used: 本轮token使用量
+            topics: 本轮提取的话题
+            learned_preferences: 本轮学习到的偏好
+            summary: 新的长期记忆摘要（可选）
+            fence: 写入方的(租约槽位, fencing token)（可选）
+
+        对话ID已在最近对话中时视为重放（写回重试时上一次CAS已成功），不重复累加
+        """
+        max_history = self.settings.memory.max_history_length
+        now = datetime.now().isoformat()
+        turn = ProfileCodec.conversation_to_dict(conversation)
+
+        def mutate(document: Dict[str, Any]) -> Optional[bool]:
+            if any(conv.get("id") == conversation.id for conv in document["memory"].get("short_term", [])):
+                logger.info(f"♻️ 本轮对话已写入，跳过重放: {uid}/{conversation.id}")
+                return False
+
+            profile = document["profile"]
+            profile["last_active"] = now
+            profile["total_conversations"] = profile.get("total_conversations", 0) + 1
+            profile["total_tokens"] = profile.get("total_tokens", 0) + tokens_used
+
+            memory = document["memory"]
+            # 最近对话环形缓冲：新对话在前，超出长度的旧对话被丢弃
+            memory["short_term"] = ([turn] + memory.get("short_term", []))[:max_history]
+            memory["total_context_tokens"] = sum(conv.get("tokens_used", 0) for conv in memory["short_term"])
+            if topics:
+                memory["key_topics"] = (list(reversed(topics)) + memory.get("key_topics", []))[:MAX_KEY_TOPICS]
+            if summary is not None:
+                memory["long_term_summary"] = summary
+
+            if learned_preferences:
+                document["preferences"].update(learned_preferences)
+
+            # 每轮对话对应一次加载，加载侧不再单独写活动信息
+            activity = document["activity"]
+            activity["last_load"] = now
+            activity["load_count"] = activity.get("load_count", 0) + 1
+
+        return await self.update(uid, mutate, fence)
+
+    def _new_document(self, uid: str) -> Dict[str, Any]:
+        """创建空文档"""
+        now = datetime.now().isoformat()
+        return {
+            "_v": CODEC_VERSION,
+            "rev": 0,
+            "profile": {
+                "uid": uid,
+                "created_at": now,
+                "last_active": now,
+                "total_conversations": 0,
+                "total_tokens": 0,
+                "preferences": {},
+                "learning_data": {},
+                "satisfaction_score": None,
+                "service_level": "standard"
+            },
+            "memory": {
+                "short_term": [],
+                "long_term_summary": None,
+                "preferences": {},
+                "total_context_tokens": 0,
+                "key_topics": []
+            },
+            "preferences": {},
+            "activity": {}
+        }
+
+    def to_snapshot(self, document: Dict[str, Any]) -> ProfileSnapshot:
+        """文档 -> ProfileSnapshot"""
+        check_version(document)
+        return ProfileSnapshot(
+            profile=ProfileCodec.profile_from_dict(document["profile"]),
+            memory=ProfileCodec.memory_from_dict(document.get("memory") or {}),
+            preferences=document.get("preferences") or {},
+            revision=document.get("rev", 0)
+        )
+
+
+# 全局文档存储实例
+_document_store: Optional[ProfileDocumentStore] = None
+
+def get_profile_document_store() -> ProfileDocumentStore:
+    """获取全局单文档存储实例"""
+    global _document_store
+
+    if _document_store is None:
+        _document_store = ProfileDocumentStore()
+
+    return _document_store
@@ -9,10 +9,39 @@ from typing import Optional, Dict, Any, List, Union
 from contextlib import asynccontextmanager
 
 from utils.logger import get_logger
+from utils.monitoring import get_metrics_registry
+from utils.tracing import get_tracer
 from config.settings import get_settings
 
 logger = get_logger(__name__)
 
+
+class InstrumentedPipeline(redis.client.Pipeline):
+    """记录管道/事务提交耗时与追踪span的Pipeline"""
+    
+    async def execute(self, raise_on_error: bool = True):
+        registry = get_metrics_registry()
+        command = "MULTI" if self.is_transaction else "PIPELINE"
+        registry.meter("redis_commands").mark(len(self.command_stack) or 1)
+        with get_tracer().span(f"redis {command}", commands=len(self.command_stack)):
+            with registry.timer("redis_command_duration_seconds", "Redis命令耗时", command=command):
+                return await super().execute(raise_on_error=raise_on_error)
+
+
+class InstrumentedRedis(redis.Redis):
+    """记录每条命令耗时与追踪span的Redis客户端（脚本调用经由EVALSHA同样会被记录）"""
+    
+    async def execute_command(self, *args, **options):
+        registry = get_metrics_registry()
+        registry.meter("redis_commands").mark()
+        command = str(args[0]).upper()
+        with get_tracer().span(f"redis {command}"):
+            with registry.timer("redis_command_duration_seconds", "Redis命令耗时", command=command):
+                return await super().execute_command(*args, **options)
+    
+    def pipeline(self, transaction: bool = True, shard_hint: Optional[str] = None) -> InstrumentedPipeline:
+        return InstrumentedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
 class RedisClient:
     """异步Redis客户端封装"""
     
@@ -42,7 +71,7 @@ class RedisClient:
                 )
             
             # 创建客户端
-            self._client = redis.Redis(connection_pool=self._pool, decode_responses=True)
+            self._client = InstrumentedRedis(connection_pool=self._pool, decode_responses=True)
             
             # 测试连接
             await self._client.ping()
@@ -165,6 +194,32 @@ class RedisClient:
         """获取集合大小"""
         return await self.client.scard(name)
     
+    # 有序集合操作
+    async def zadd(self, name: str, mapping: Dict[str, float]) -> int:
+        """添加到有序集合"""
+        return await self.client.zadd(name, mapping)
+    
+    async def zrangebyscore(self, name: str, min_score, max_score, start: Optional[int] = None, num: Optional[int] = None) -> List[str]:
+        """按分数范围获取有序集合成员"""
+        return await self.client.zrangebyscore(name, min_score, max_score, start=start, num=num)
+    
+    async def zrem(self, name: str, *values: str) -> int:
+        """从有序集合删除"""
+        return await self.client.zrem(name, *values)
+    
+    async def zcard(self, name: str) -> int:
+        """获取有序集合大小"""
+        return await self.client.zcard(name)
+    
+    # HyperLogLog操作
+    async def pfadd(self, name: str, *values: str) -> int:
+        """添加到HyperLogLog"""
+        return await self.client.pfadd(name, *values)
+    
+    async def pfcount(self, *names: str) -> int:
+        """HyperLogLog基数估计（多个键时返回并集基数）"""
+        return await self.client.pfcount(*names)
+    
     # 高级操作
     async def keys(self, pattern: str = "*") -> List[str]:
         """查找匹配模式的键"""
@@ -186,6 +241,30 @@ class RedisClient:
     async def dbsize(self) -> int:
         """获取数据库键数量"""
         return await self.client.dbsize()
+    
+    # 发布订阅
+    async def publish(self, channel: str, message: str) -> int:
+        """发布消息"""
+        return await self.client.publish(channel, message)
+    
+    def pubsub(self):
+        """创建订阅对象"""
+        return self.client.pubsub()
+    
+    # 管道/事务
+    def pipeline(self, transaction: bool = True):
+        """
+        创建管道，命令在本地缓冲，execute()时一次往返提交
+        
+        Args:
+            transaction: 为True时以MULTI/EXEC包裹，保证原子执行
+        """
+        return self.client.pipeline(transaction=transaction)
+    
+    # 脚本操作
+    def register_script(self, script: str):
+        """注册Lua脚本（调用时自动使用EVALSHA并在NOSCRIPT时回退）"""
+        return self.client.register_script(script)
 
 
 # 全局Redis客户端实例
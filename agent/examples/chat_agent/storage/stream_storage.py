@@ -0,0 +1,135 @@
+"""
+流式数据过期索引
+流式中转键写入时登记到有序集合（score为过期时间戳），
+后台清理任务按score范围批量删除过期键，清理成本只与过期键数量相关
+"""
+
+import asyncio
+import time
+from typing import Dict, Any, Optional
+
+from utils.logger import get_logger
+from storage.redis_client import get_redis_client
+from config.settings import get_settings
+
+logger = get_logger(__name__)
+
+# 过期索引键名
+STREAM_EXPIRY_INDEX = "expiry:stream"
+
+
+def track_stream_keys(pipe, ttl: int, *keys: str):
+    """
+    在管道中为流式键设置TTL并登记到过期索引
+
+    Args:
+        pipe: Redis管道
+        ttl: 过期时间(秒)
+        keys: 需要登记的键
+    """
+    expires_at = time.time() + ttl
+    for key in keys:
+        pipe.expire(key, ttl)
+    pipe.zadd(STREAM_EXPIRY_INDEX, {key: expires_at for key in keys})
+
+
+class StreamSweeper:
+    """流式数据后台清理任务"""
+
+    def __init__(self, interval: float, batch_size: int):
+        self.interval = interval
+        self.batch_size = batch_size
+        self._task: Optional[asyncio.Task] = None
+
+        # 统计
+        self.sweeps = 0
+        self.removed = 0
+        self.last_sweep: Optional[float] = None
+
+    async def start(self):
+        """启动清理任务"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"🧹 流式数据清理任务已启动: 每{self.interval}秒")
+
+    async def stop(self):
+        """停止清理任务"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def sweep_once(self) -> int:
+        """
+        删除索引中已过期的键
+
+        Returns:
+            int: 本次清理的键数量
+        """
+        redis_client = await get_redis_client()
+        removed = 0
+
+        while True:
+            now = time.time()
+            keys = await redis_client.zrangebyscore(
+                STREAM_EXPIRY_INDEX, "-inf", now, start=0, num=self.batch_size
+            )
+            if not keys:
+                break
+
+            pipe = redis_client.pipeline(transaction=False)
+            pipe.delete(*keys)
+            pipe.zrem(STREAM_EXPIRY_INDEX, *keys)
+            await pipe.execute()
+            removed += len(keys)
+
+            if len(keys) < self.batch_size:
+                break
+
+        self.sweeps += 1
+        self.removed += removed
+        self.last_sweep = time.time()
+        if removed:
+            logger.debug(f"流式数据清理完成: {removed}个键")
+        return removed
+
+    def stats(self) -> Dict[str, Any]:
+        """清理统计"""
+        return {
+            "running": self._task is not None,
+            "interval": self.interval,
+            "sweeps": self.sweeps,
+            "removed": self.removed,
+            "last_sweep": self.last_sweep
+        }
+
+    async def _run(self):
+        """定时清理循环"""
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.sweep_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"流式数据清理失败: {str(e)}")
+
+
+# 全局清理任务实例
+_stream_sweeper: Optional[StreamSweeper] = None
+
+def get_stream_sweeper() -> StreamSweeper:
+    """获取全局流式数据清理任务"""
+    global _stream_sweeper
+
+    if _stream_sweeper is None:
+        settings = get_settings()
+        _stream_sweeper = StreamSweeper(
+            interval=settings.concurrency.cleanup_interval,
+            batch_size=settings.stream.cleanup_batch_size
+        )
+
+    return _stream_sweeper
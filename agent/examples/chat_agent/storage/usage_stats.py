@@ -0,0 +1,296 @@
+"""
+使用统计模块
+- 每日独立客户数使用HyperLogLog计数，每天固定约12KB
+- 对话数/token数写入按时间分桶、随机分片的计数器，避免所有worker争用同一个热键
+- 后台任务将已关闭的时间桶通过Lua脚本原子汇总到每日统计，水位键保证只汇总一次
+"""
+
+import asyncio
+import random
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Any, Optional, List
+
+from utils.logger import get_logger
+from storage.redis_client import get_redis_client
+from config.settings import get_settings, MonitoringSettings
+
+logger = get_logger(__name__)
+
+# 汇总水位：最后一个已汇总时间桶的起始时间戳
+ROLLUP_WATERMARK_KEY = "stats:rollup:watermark"
+
+# 时间桶保留的桶数量（汇总和速率查询只回看这个范围）
+BUCKET_RETENTION = 120
+
+# 时间桶结束后等待的宽限期(秒)，给跨越桶边界的写入留出提交时间
+ROLLUP_GRACE_SECONDS = 5
+
+# 汇总脚本：把一个时间桶的全部分片累加到每日统计
+# KEYS[1]: 水位键  KEYS[2]: 每日统计键  KEYS[3..]: 分片计数键
+# ARGV[1]: 桶起始时间  ARGV[2]: 每日统计TTL(秒)
+ROLLUP_SCRIPT = """
+local watermark = tonumber(redis.call('GET', KEYS[1]) or '0')
+local bucket = tonumber(ARGV[1])
+if bucket <= watermark then
+    return 0
+end
+for i = 3, #KEYS do
+    local fields = redis.call('HGETALL', KEYS[i])
+    for j = 1, #fields, 2 do
+        redis.call('HINCRBY', KEYS[2], fields[j], fields[j + 1])
+    end
+end
+redis.call('SET', KEYS[1], ARGV[1])
+redis.call('EXPIRE', KEYS[2], tonumber(ARGV[2]))
+return 1
+"""
+
+
+def _field(data: Dict[Any, Any], name: str) -> int:
+    """读取计数Hash字段（兼容未开启decode_responses时的bytes键）"""
+    value = data.get(name)
+    if value is None:
+        value = data.get(name.encode("utf-8"), 0)
+    return int(value)
+
+
+class UsageStats:
+    """使用统计的写入、汇总与查询"""
+
+    def __init__(self, settings: MonitoringSettings):
+        self.bucket_seconds = max(1, settings.stats_bucket_seconds)
+        self.shards = max(1, settings.stats_counter_shards)
+        self.rollup_interval = settings.stats_rollup_interval
+        self.retention_seconds = settings.stats_retention_days * 86400
+        self._rollup_script = None
+        self._task: Optional[asyncio.Task] = None
+
+    # ------------------------------------------------------------------
+    # 键名
+    # ------------------------------------------------------------------
+    @staticmethod
+    def daily_key(date: str) -> str:
+        """每日汇总统计键"""
+        return f"stats:daily:{date}"
+
+    @staticmethod
+    def uniques_key(date: str) -> str:
+        """每日独立客户HyperLogLog键"""
+        return f"stats:uniques:{date}"
+
+    @staticmethod
+    def bucket_key(bucket: int, shard: int) -> str:
+        """时间桶分片计数键"""
+        return f"stats:bucket:{bucket}:{shard}"
+
+    def bucket_of(self, timestamp: float) -> int:
+        """时间戳 -> 所在时间桶的起始时间"""
+        return int(timestamp // self.bucket_seconds) * self.bucket_seconds
+
+    # ------------------------------------------------------------------
+    # 写入
+    # ------------------------------------------------------------------
+    def queue_record(self, pipe, uid: str, tokens_used: int):
+        """
+        在管道中追加一次对话的统计命令
+
+        Args:
+            pipe: Redis管道（通常是StoreProfile的写入事务）
+            uid: 客户ID
+            tokens_used: 本轮token使用量
+        """
+        now = time.time()
+        today = datetime.fromtimestamp(now).strftime("%Y-%m-%d")
+
+        # 独立客户数
+        uniques_key = self.uniques_key(today)
+        pipe.pfadd(uniques_key, uid)
+        pipe.expire(uniques_key, self.retention_seconds)
+
+        # 随机选择分片，同一时间桶的写入分散到多个键
+        bucket_key = self.bucket_key(self.bucket_of(now), random.randrange(self.shards))
+        pipe.hincrby(bucket_key, "total_conversations", 1)
+        pipe.hincrby(bucket_key, "total_tokens", tokens_used)
+        pipe.expire(bucket_key, self.bucket_seconds * BUCKET_RETENTION)
+
+        # 客户维度统计
+        user_stats_key = f"stats:user:{uid}"
+        pipe.hincrby(user_stats_key, "conversations_today", 1)
+        pipe.hincrby(user_stats_key, "tokens_today", tokens_used)
+        pipe.expire(user_stats_key, 86400)  # 每日重置
+
+    # ------------------------------------------------------------------
+    # 汇总
+    # ------------------------------------------------------------------
+    async def rollup(self) -> int:
+        """
+        汇总所有已关闭且尚未汇总的时间桶
+
+        Returns:
+            int: 本次汇总的时间桶数量
+        """
+        redis_client = await get_redis_client()
+        if self._rollup_script is None:
+            self._rollup_script = redis_client.register_script(ROLLUP_SCRIPT)
+
+        watermark = int(await redis_client.get(ROLLUP_WATERMARK_KEY) or 0)
+        rolled = 0
+
+        for bucket in self._closed_buckets(watermark):
+            date = datetime.fromtimestamp(bucket).strftime("%Y-%m-%d")
+            keys = [ROLLUP_WATERMARK_KEY, self.daily_key(date)]
+            keys.extend(self.bucket_key(bucket, shard) for shard in range(self.shards))
+            rolled += int(await self._rollup_script(keys=keys, args=[bucket, self.retention_seconds]))
+
+        if rolled:
+            logger.debug(f"使用统计汇总完成: {rolled}个时间桶")
+        return rolled
+
+    def _closed_buckets(self, watermark: int) -> List[int]:
+        """水位之后、已经关闭的时间桶（最多回看BUCKET_RETENTION个）"""
+        last_closed = self.bucket_of(time.time() - ROLLUP_GRACE_SECONDS) - self.bucket_seconds
+        first = max(watermark + self.bucket_seconds, last_closed - (BUCKET_RETENTION - 1) * self.bucket_seconds)
+        return list(range(first, last_closed + 1, self.bucket_seconds))
+
+    async def start(self):
+        """启动定时汇总任务"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"📊 使用统计汇总任务已启动: 每{self.rollup_interval}秒")
+
+    async def stop(self):
+        """停止定时汇总任务"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        """定时汇总循环"""
+        while True:
+            await asyncio.sleep(self.rollup_interval)
+            try:
+                await self.rollup()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"使用统计汇总失败: {str(e)}")
+
+    # ------------------------------------------------------------------
+    # 查询
+    # ------------------------------------------------------------------
+    async def query(self, days: int = 1) -> Dict[str, Any]:
+        """
+        查询最近若干天的使用统计
+
+        当天尚未汇总的时间桶会实时累加，结果不依赖汇总任务的进度
+
+        Args:
+            days: 查询天数（含今天）
+
+        Returns:
+            Dict[str, Any]: 总对话数、总token数、独立客户数（近似值）及每日明细
+        """
+        redis_client = await get_redis_client()
+        today = datetime.now().date()
+        dates = [(today - timedelta(days=offset)).strftime("%Y-%m-%d") for offset in range(max(1, days))]
+
+        pipe = redis_client.pipeline(transaction=False)
+        for date in dates:
+            pipe.hgetall(self.daily_key(date))
+        for date in dates:
+            pipe.pfcount(self.uniques_key(date))
+        # 多个HLL键一次PFCOUNT得到跨天去重后的客户数
+        pipe.pfcount(*[self.uniques_key(date) for date in dates])
+        pipe.get(ROLLUP_WATERMARK_KEY)
+        results = await pipe.execute()
+
+        daily_hashes = results[:len(dates)]
+        daily_uniques = results[len(dates):2 * len(dates)]
+        unique_users, watermark = results[-2], int(results[-1] or 0)
+
+        daily = {}
+        for date, data, uniques in zip(dates, daily_hashes, daily_uniques):
+            daily[date] = {
+                "total_conversations": _field(data, "total_conversations"),
+                "total_tokens": _field(data, "total_tokens"),
+                "unique_users": uniques
+            }
+
+        # 合并尚未汇总的时间桶
+        pending = await self._read_buckets(redis_client, self._pending_buckets(watermark))
+        for bucket, counters in pending.items():
+            date = datetime.fromtimestamp(bucket).strftime("%Y-%m-%d")
+            if date in daily:
+                daily[date]["total_conversations"] += counters["total_conversations"]
+                daily[date]["total_tokens"] += counters["total_tokens"]
+
+        return {
+            "days": len(dates),
+            "total_conversations": sum(day["total_conversations"] for day in daily.values()),
+            "total_tokens": sum(day["total_tokens"] for day in daily.values()),
+            "unique_users": unique_users,
+            "daily": daily
+        }
+
+    async def rate(self, window_seconds: int = 60) -> Dict[str, float]:
+        """
+        最近时间窗口内的对话速率，基于已关闭的时间桶计算
+
+        Returns:
+            Dict[str, float]: 每秒对话数、每秒token数
+        """
+        redis_client = await get_redis_client()
+        count = max(1, min(BUCKET_RETENTION, window_seconds // self.bucket_seconds))
+        current = self.bucket_of(time.time())
+        buckets = [current - self.bucket_seconds * (index + 1) for index in range(count)]
+
+        counters = await self._read_buckets(redis_client, buckets)
+        span = count * self.bucket_seconds
+        return {
+            "conversations_per_second": sum(c["total_conversations"] for c in counters.values()) / span,
+            "tokens_per_second": sum(c["total_tokens"] for c in counters.values()) / span
+        }
+
+    def _pending_buckets(self, watermark: int) -> List[int]:
+        """水位之后尚未汇总的时间桶（含当前桶）"""
+        current = self.bucket_of(time.time())
+        first = max(watermark + self.bucket_seconds, current - (BUCKET_RETENTION - 1) * self.bucket_seconds)
+        return list(range(first, current + 1, self.bucket_seconds))
+
+    async def _read_buckets(self, redis_client, buckets: List[int]) -> Dict[int, Dict[str, int]]:
+        """读取时间桶的全部分片并按桶求和"""
+        if not buckets:
+            return {}
+
+        pipe = redis_client.pipeline(transaction=False)
+        for bucket in buckets:
+            for shard in range(self.shards):
+                pipe.hgetall(self.bucket_key(bucket, shard))
+        results = await pipe.execute()
+
+        counters = {}
+        for index, bucket in enumerate(buckets):
+            shards = results[index * self.shards:(index + 1) * self.shards]
+            counters[bucket] = {
+                "total_conversations": sum(_field(data, "total_conversations") for data in shards),
+                "total_tokens": sum(_field(data, "total_tokens") for data in shards)
+            }
+        return counters
+
+
+# 全局使用统计实例
+_usage_stats: Optional[UsageStats] = None
+
+def get_usage_stats() -> UsageStats:
+    """获取全局使用统计实例"""
+    global _usage_stats
+
+    if _usage_stats is None:
+        _usage_stats = UsageStats(get_settings().monitoring)
+
+    return _usage_stats
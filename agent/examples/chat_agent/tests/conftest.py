@@ -0,0 +1,43 @@
+"""
+测试公共配置
+- 把chat_agent目录加入sys.path，与服务运行时的导入方式一致
+- 配置校验要求OPENAI_API_KEY，测试不访问LLM，未设置时填入占位值
+- redis fixture：用fakeredis替换全局Redis客户端，测试之间互不影响
+"""
+
+import os
+import sys
+
+import pytest
+import pytest_asyncio
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+
+import storage.redis_client as redis_client_module
+import storage.profile_storage as profile_storage_module
+from config.settings import get_settings
+
+
+@pytest_asyncio.fixture
+async def redis(monkeypatch):
+    """全局Redis客户端替换为fakeredis，返回底层客户端便于直接断言"""
+    fakeredis = pytest.importorskip("fakeredis")
+
+    client = redis_client_module.RedisClient()
+    client._client = fakeredis.FakeAsyncRedis(decode_responses=True)
+    previous = redis_client_module._redis_client
+    redis_client_module._redis_client = client
+    # 单文档存储缓存了注册在客户端上的CAS脚本，换客户端时一并重建
+    monkeypatch.setattr(profile_storage_module, "_document_store", None)
+    try:
+        yield client._client
+    finally:
+        redis_client_module._redis_client = previous
+        await client._client.aclose()
+
+
+@pytest.fixture
+def settings():
+    """全局配置，测试中修改的字段请配合monkeypatch.setattr使用"""
+    return get_settings()
@@ -0,0 +1,150 @@
+"""AdmissionController：AIMD并发上限、按服务等级的份额与等级解析"""
+
+from datetime import datetime
+
+import pytest
+
+import storage.profile_cache as profile_cache_module
+from config.settings import ConcurrencySettings
+from core.admission import AdmissionController
+from models.api_models import CustomerMemory, CustomerProfile
+from storage.profile_cache import ProfileCache
+from storage.profile_storage import get_profile_document_store
+
+
+def make_controller(**overrides):
+    fields = dict(
+        max_concurrent_users=10,
+        admission_initial_limit=4,
+        admission_min_limit=2,
+        admission_decrease_factor=0.5,
+        admission_latency_tolerance=2.0,
+        admission_priority_shares={"premium": 1.0, "standard": 0.5}
+    )
+    fields.update(overrides)
+    return AdmissionController(ConcurrencySettings(**fields))
+
+
+def fill(controller, count, level="premium"):
+    return [controller.try_acquire(f"u{index}", service_level=level) for index in range(count)]
+
+
+def test_sheds_beyond_limit():
+    controller = make_controller()
+    tickets = fill(controller, 4)
+
+    assert all(tickets)
+    assert controller.try_acquire("late", service_level="premium") is None
+    assert controller.stats()["shed_by_level"] == {"premium": 1}
+
+
+def test_lower_levels_shed_first():
+    controller = make_controller()
+    assert all(fill(controller, 2, level="standard"))
+
+    # standard只能使用一半的上限，premium仍有余量
+    assert controller.try_acquire("s3", service_level="standard") is None
+    assert controller.try_acquire("p1", service_level="premium") is not None
+    assert controller.inflight == 3
+
+
+def test_has_capacity_does_not_take_a_slot():
+    controller = make_controller()
+    fill(controller, 3)
+
+    assert controller.has_capacity("u", service_level="premium")
+    assert not controller.has_capacity("u", service_level="standard")
+    assert controller.inflight == 3
+    assert controller.shed == 0
+
+
+def test_additive_increase_only_when_saturated():
+    controller = make_controller()
+    tickets = fill(controller, 4)
+
+    controller.release(tickets[0], latency=1.0)
+    assert controller.limit == pytest.approx(4.25)
+
+    # 上限未被用满时不增长
+    controller.release(tickets[1], latency=1.0)
+    assert controller.limit == pytest.approx(4.25)
+
+
+def test_multiplicative_decrease_on_failure():
+    controller = make_controller()
+    ticket = controller.try_acquire("u", service_level="premium")
+
+    controller.release(ticket, failed=True)
+
+    assert controller.limit == pytest.approx(2.0)
+    assert controller.inflight == 0
+
+
+def test_decrease_on_latency_regression_respects_floor():
+    controller = make_controller(admission_initial_limit=10)
+    for _ in range(5):
+        controller.release(controller.try_acquire("u", service_level="premium"), latency=1.0)
+    baseline_limit = controller.limit
+
+    controller.release(controller.try_acquire("u", service_level="premium"), latency=20.0)
+    assert controller.limit == pytest.approx(baseline_limit * 0.5)
+
+    # 连续劣化在一个典型耗时内只下降一次，且不低于下限
+    controller.release(controller.try_acquire("u", service_level="premium"), latency=20.0)
+    assert controller.limit == pytest.approx(baseline_limit * 0.5)
+    for _ in range(3):
+        controller._last_decrease = 0.0
+        controller.release(controller.try_acquire("u", service_level="premium"), failed=True)
+    assert controller.limit == pytest.approx(2.0)
+
+
+def test_limit_capped_at_max_concurrent_users():
+    controller = make_controller(max_concurrent_users=4, admission_initial_limit=4)
+    for _ in range(20):
+        tickets = fill(controller, 4)
+        for ticket in tickets:
+            controller.release(ticket, latency=1.0)
+
+    assert controller.limit == 4
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = ProfileCache(max_size=10, ttl=60)
+    monkeypatch.setattr(profile_cache_module, "_profile_cache", cache)
+    return cache
+
+
+def make_profile(uid, service_level):
+    now = datetime.now()
+    return CustomerProfile(
+        uid=uid, created_at=now, last_active=now, total_conversations=0, total_tokens=0, service_level=service_level
+    )
+
+
+@pytest.mark.asyncio
+async def test_service_level_from_cache(redis, cache):
+    cache.put("u1", make_profile("u1", "premium"), CustomerMemory(short_term=[], total_context_tokens=0), {})
+
+    assert await make_controller().resolve_service_level("u1") == "premium"
+
+
+@pytest.mark.asyncio
+async def test_service_level_from_hash_store_on_cache_miss(redis, cache):
+    await redis.hset("profile:u1", "service_level", "premium")
+    await redis.hset("profile:u2", "service_level", "gold")
+    controller = make_controller()
+
+    assert await controller.resolve_service_level("u1") == "premium"
+    # 未配置份额的等级与新客户都按standard处理
+    assert await controller.resolve_service_level("u2") == "standard"
+    assert await controller.resolve_service_level("new") == "standard"
+
+
+@pytest.mark.asyncio
+async def test_service_level_from_document_store_warms_cache(redis, cache, settings, monkeypatch):
+    monkeypatch.setattr(settings.redis, "profile_backend", "document")
+    await get_profile_document_store().update("u1", lambda document: document["profile"].update(service_level="premium"))
+
+    assert await make_controller().resolve_service_level("u1") == "premium"
+    assert cache.peek("u1").profile.service_level == "premium"
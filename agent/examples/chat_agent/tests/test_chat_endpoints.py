@@ -0,0 +1,92 @@
+"""聊天端点：超时或失败后释放客户租约，同一客户的下一个请求可以继续处理；流式生成失败时写入错误终止事件"""
+
+import asyncio
+import json
+
+import pytest
+from fastapi import HTTPException
+
+import main
+from core.admission import AdmissionController
+from core.stream_relay import FINAL_FIELD, stream_key
+from core.user_manager import LocalLeaseBackend, UserLeaseManager, UserRequestQueue
+from models.api_models import ChatRequest
+
+
+@pytest.fixture
+def queue(redis, settings, monkeypatch):
+    """每客户一个租约槽位的独立队列，排队超时缩短到0.2秒"""
+    concurrency = settings.concurrency.model_copy(update={"max_requests_per_user": 1, "queue_wait_timeout": 0.2})
+    lease_manager = UserLeaseManager(LocalLeaseBackend(1, 4), concurrency)
+    queue = UserRequestQueue(lease_manager, concurrency)
+    monkeypatch.setattr(main, "request_queue", queue)
+    monkeypatch.setattr(main, "admission", AdmissionController(settings.concurrency))
+    return queue
+
+
+def fake_flow(monkeypatch, behavior):
+    async def process_chat_request(request_data, parallel=False):
+        return await behavior(request_data)
+
+    monkeypatch.setattr(main, "process_chat_request", process_chat_request)
+
+
+async def succeed(request_data):
+    return {"flow_completed": True, "response_content": "你好", "session_id": request_data["session_id"]}
+
+
+async def hang(request_data):
+    await asyncio.sleep(10)
+
+
+async def crash(request_data):
+    raise RuntimeError("boom")
+
+
+async def incomplete(request_data):
+    return {"flow_completed": False, "flow_error": "LLM调用失败"}
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("behavior, status", [(hang, 504), (crash, 500), (incomplete, 500)])
+async def test_lease_released_after_failure(queue, settings, monkeypatch, behavior, status):
+    monkeypatch.setattr(settings.concurrency, "request_timeout", 0.05)
+    fake_flow(monkeypatch, behavior)
+
+    with pytest.raises(HTTPException) as failure:
+        await main.chat_non_stream(ChatRequest(uid="u1", message="你好"))
+    assert failure.value.status_code == status
+    assert queue.lease_manager.active_users() == []
+
+    fake_flow(monkeypatch, succeed)
+    response = await main.chat_non_stream(ChatRequest(uid="u1", message="你好"))
+
+    assert response.response == "你好"
+    assert queue.lease_manager.active_users() == []
+
+
+async def failed_generation(request_data):
+    return {"flow_completed": True, "response_content": "很抱歉", "processing_error": "上游连接断开"}
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("behavior, error", [
+    (incomplete, "LLM调用失败"),
+    (failed_generation, "上游连接断开"),
+    (succeed, None)
+])
+async def test_stream_final_event_reflects_flow_result(queue, redis, monkeypatch, behavior, error):
+    fake_flow(monkeypatch, behavior)
+    lease = await queue.acquire("u1")
+    ticket = main.admission.try_acquire("u1")
+
+    await main.run_stream_generation({"uid": "u1", "session_id": "s1"}, lease, ticket)
+
+    final = json.loads(await redis.hget(stream_key("u1", "s1"), FINAL_FIELD))
+    if error:
+        assert final["type"] == "error"
+        assert error in final["error"]
+    else:
+        assert final["type"] == "complete"
+    assert main.admission.inflight == 0
+    assert queue.lease_manager.active_users() == []
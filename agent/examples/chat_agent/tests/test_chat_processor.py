@@ -0,0 +1,46 @@
+"""ChatProcessor：上游延迟只统计到首个输出事件，不含工具调用和生成时长"""
+
+import asyncio
+
+import pytest
+
+from core.chat_processor import ChatProcessor
+
+
+def fake_stream(events):
+    """按 (等待秒数, 事件) 依次产出，模拟LLM客户端的流式输出"""
+    async def generate(self, context, enhanced_data):
+        yield {"type": "start", "message": "开始生成回复"}
+        for delay, event in events:
+            await asyncio.sleep(delay)
+            yield event
+    return generate
+
+
+@pytest.mark.asyncio
+async def test_upstream_latency_excludes_tool_calls(redis, monkeypatch):
+    monkeypatch.setattr(ChatProcessor, "_generate_stream_response", fake_stream([
+        (0.01, {"type": "response.created"}),
+        (0.04, {"type": "response.output_item.done", "item": {"type": "function_call", "name": "add"}}),
+        # 工具调用与第二轮请求
+        (0.2, {"type": "response.output_text.delta", "delta": "3"}),
+        (0.0, {"type": "response.completed"}),
+    ]))
+
+    result = await ChatProcessor().process({"uid": "u1", "session_id": "s1", "message": "1+2"})
+
+    assert result["response_content"] == "3"
+    assert 0.04 <= result["llm_upstream_latency"] < 0.15
+    assert result["llm_duration"] >= 0.25
+
+
+@pytest.mark.asyncio
+async def test_upstream_latency_missing_when_upstream_only_errors(redis, monkeypatch):
+    monkeypatch.setattr(ChatProcessor, "_generate_stream_response", fake_stream([
+        (0.0, {"type": "response.created"}),
+        (0.0, {"type": "error", "error": "rate limited"}),
+    ]))
+
+    result = await ChatProcessor().process({"uid": "u1", "session_id": "s1", "message": "你好"})
+
+    assert result["llm_upstream_latency"] is None
@@ -0,0 +1,97 @@
+"""应用容器：LLM客户端池的借还与重置失败后的名额回收，写回队列共用容器的StoreProfile"""
+
+import asyncio
+
+import pytest
+
+import core.write_behind as write_behind_module
+from config.settings import get_settings
+from core.container import AppContainer, LLMClientPool
+
+
+class FakeClient:
+    """记录生命周期调用的LLM客户端替身"""
+
+    def __init__(self, fail_reset=False):
+        self.fail_reset = fail_reset
+        self.closed = False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    async def reset(self):
+        if self.fail_reset:
+            raise RuntimeError("reset failed")
+
+    async def close(self):
+        self.closed = True
+
+
+@pytest.mark.asyncio
+async def test_released_client_is_reused():
+    pool = LLMClientPool(FakeClient, 1)
+
+    async with pool.lease() as first:
+        pass
+    async with pool.lease() as second:
+        assert second is first
+
+    assert pool.stats() == {"size": 1, "created": 1, "in_use": 0, "idle": 1}
+
+
+@pytest.mark.asyncio
+async def test_waiter_gets_replacement_when_reset_fails():
+    created = []
+
+    def factory():
+        client = FakeClient(fail_reset=not created)
+        created.append(client)
+        return client
+
+    pool = LLMClientPool(factory, 1)
+    broken = await pool.acquire()
+    waiter = asyncio.create_task(pool.acquire())
+    await asyncio.sleep(0)
+    assert not waiter.done()
+
+    await pool.release(broken)
+    replacement = await asyncio.wait_for(waiter, timeout=1)
+
+    assert replacement is not broken
+    assert broken.closed
+    assert pool.stats() == {"size": 1, "created": 1, "in_use": 1, "idle": 0}
+
+
+@pytest.mark.asyncio
+async def test_failed_creation_frees_the_slot():
+    attempts = []
+
+    def factory():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise RuntimeError("connect failed")
+        return FakeClient()
+
+    pool = LLMClientPool(factory, 1)
+    with pytest.raises(RuntimeError):
+        await pool.acquire()
+
+    client = await asyncio.wait_for(pool.acquire(), timeout=1)
+    assert isinstance(client, FakeClient)
+    assert pool.stats()["created"] == 1
+
+
+@pytest.mark.asyncio
+async def test_write_behind_uses_shared_store_profile(redis, monkeypatch):
+    monkeypatch.setattr(write_behind_module, "_write_behind_queue", None)
+    container = AppContainer(get_settings())
+    await container.start()
+    try:
+        assert container.write_behind.handler == container.store_profile.process
+        assert container.core_flow().write_behind is container.write_behind
+        assert container.core_flow().store_profile is container.store_profile
+    finally:
+        await container.close()
@@ -0,0 +1,36 @@
+"""LoadProfile：缓存命中与从Redis加载都记录加载活动"""
+
+import pytest
+
+import storage.profile_cache as profile_cache_module
+from core.load_profile import LoadProfile
+from storage.profile_cache import ProfileCache
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = ProfileCache(max_size=10, ttl=60)
+    monkeypatch.setattr(profile_cache_module, "_profile_cache", cache)
+    return cache
+
+
+@pytest.mark.asyncio
+async def test_load_activity_recorded_on_miss_and_hit(redis, cache):
+    loader = LoadProfile()
+
+    miss = await loader.process({"uid": "u1", "session_id": "s1"})
+    hit = await loader.process({"uid": "u1", "session_id": "s1"})
+
+    assert "profile_cache_hit" not in miss and hit["profile_cache_hit"] is True
+    assert await redis.hget("activity:u1", "load_count") == "2"
+
+
+@pytest.mark.asyncio
+async def test_document_backend_skips_load_activity(redis, cache, settings, monkeypatch):
+    monkeypatch.setattr(settings.redis, "profile_backend", "document")
+    loader = LoadProfile()
+
+    await loader.process({"uid": "u1", "session_id": "s1"})
+    await loader.process({"uid": "u1", "session_id": "s1"})
+
+    assert not await redis.exists("activity:u1")
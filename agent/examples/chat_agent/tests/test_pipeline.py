@@ -0,0 +1,210 @@
+"""Pipeline：依赖推导、并发执行、失败隔离与延后阶段"""
+
+import asyncio
+
+import pytest
+
+from core.pipeline import Pipeline, PipelineError, Stage
+
+
+def make_stage(name, inputs=(), outputs=(), optional_inputs=(), deferred=False, error_key=None, func=None, log=None):
+    """按声明产出固定值的阶段，log记录执行顺序"""
+    async def default_func(context):
+        if log is not None:
+            log.append(name)
+        return {key: f"{name}:{key}" for key in outputs}
+
+    return Stage(
+        name=name,
+        func=func or default_func,
+        inputs=tuple(inputs),
+        optional_inputs=tuple(optional_inputs),
+        outputs=tuple(outputs),
+        error_key=error_key,
+        deferred=deferred
+    )
+
+
+def test_dependencies_inferred_from_fields():
+    pipeline = Pipeline([
+        make_stage("Store", inputs=("reply",), outputs=("stored",)),
+        make_stage("Chat", inputs=("profile",), outputs=("reply",)),
+        make_stage("Load", inputs=("uid",), outputs=("profile",)),
+    ])
+
+    assert pipeline.dependencies == {"Store": {"Chat"}, "Chat": {"Load"}, "Load": set()}
+    assert pipeline.order == ["Load", "Chat", "Store"]
+
+
+def test_optional_inputs_only_affect_ordering():
+    pipeline = Pipeline([
+        make_stage("Chat", inputs=("uid",), optional_inputs=("profile",), outputs=("reply",)),
+        make_stage("Load", inputs=("uid",), outputs=("profile",)),
+    ])
+
+    assert pipeline.dependencies["Chat"] == {"Load"}
+
+
+@pytest.mark.parametrize("stages, message", [
+    ([make_stage("A", outputs=("x",)), make_stage("B", outputs=("x",))], "同时由"),
+    ([make_stage("A", inputs=("y",), outputs=("x",)), make_stage("B", inputs=("x",), outputs=("y",))], "循环依赖"),
+    ([make_stage("A", outputs=("x",), deferred=True), make_stage("B", inputs=("x",))], "延后执行"),
+    ([make_stage("A"), make_stage("A")], "名称重复"),
+])
+def test_invalid_graphs_rejected(stages, message):
+    with pytest.raises(PipelineError, match=message):
+        Pipeline(stages)
+
+
+@pytest.mark.asyncio
+async def test_independent_stages_run_concurrently():
+    both_started = asyncio.Event()
+    started = []
+
+    def waiting_stage(name):
+        async def func(context):
+            started.append(name)
+            if len(started) == 2:
+                both_started.set()
+            # 两个阶段都启动后才能完成，串行执行会超时
+            await asyncio.wait_for(both_started.wait(), timeout=1)
+            return {name.lower(): True}
+        return make_stage(name, inputs=("uid",), outputs=(name.lower(),), func=func)
+
+    pipeline = Pipeline([waiting_stage("Load"), waiting_stage("Hot")])
+    run = await pipeline.run({"uid": "u1"})
+
+    assert run.context["load"] is True and run.context["hot"] is True
+    assert {name: result.status for name, result in run.results.items()} == {"Load": "completed", "Hot": "completed"}
+
+
+@pytest.mark.asyncio
+async def test_failure_isolated_and_missing_inputs_skipped():
+    async def broken(context):
+        raise RuntimeError("boom")
+
+    log = []
+    pipeline = Pipeline([
+        make_stage("Load", inputs=("uid",), outputs=("profile",), func=broken),
+        make_stage("Chat", inputs=("uid",), optional_inputs=("profile",), outputs=("reply",), log=log),
+        make_stage("Summarize", inputs=("profile",), outputs=("summary",), log=log),
+    ])
+    run = await pipeline.run({"uid": "u1"})
+
+    assert run.results["Load"].status == "failed"
+    assert run.results["Chat"].status == "completed"
+    assert run.results["Summarize"].status == "skipped"
+    assert log == ["Chat"]
+    assert run.context["flow_errors"][0]["job"] == "Load"
+    assert run.context["load_error"] == "boom"
+
+
+@pytest.mark.asyncio
+async def test_error_key_reported_without_exception():
+    async def soft_error(context):
+        return {"reply": "", "processing_error": "upstream timeout"}
+
+    pipeline = Pipeline([
+        make_stage("Chat", inputs=("uid",), outputs=("reply", "processing_error"),
+                   error_key="processing_error", func=soft_error),
+    ])
+    run = await pipeline.run({"uid": "u1"})
+
+    assert run.results["Chat"].status == "error"
+    assert run.results["Chat"].error == "upstream timeout"
+    assert run.context["reply"] == ""
+
+
+@pytest.mark.asyncio
+async def test_only_declared_outputs_merged():
+    async def noisy(context):
+        return {"reply": "hi", "uid": "overwritten"}
+
+    pipeline = Pipeline([make_stage("Chat", inputs=("uid",), outputs=("reply",), func=noisy)])
+    run = await pipeline.run({"uid": "u1"})
+
+    assert run.context["uid"] == "u1"
+    assert run.context["reply"] == "hi"
+
+
+@pytest.mark.asyncio
+async def test_deferred_stage_submitted_after_main_graph():
+    log = []
+    submitted = []
+
+    async def submit(stage, context):
+        submitted.append((stage.name, context["reply"], list(log)))
+        return True
+
+    pipeline = Pipeline([
+        make_stage("Chat", inputs=("uid",), outputs=("reply",), log=log),
+        make_stage("Store", inputs=("reply",), outputs=("stored",), deferred=True, log=log),
+    ])
+    run = await pipeline.run({"uid": "u1"}, submit_deferred=submit)
+
+    # 提交时主图已经完成，延后阶段本身没有在流程内执行
+    assert submitted == [("Store", "Chat:reply", ["Chat"])]
+    assert run.results["Store"].status == "deferred"
+    assert "stored" not in run.context
+
+
+@pytest.mark.asyncio
+async def test_deferred_stage_runs_inline_when_not_accepted():
+    log = []
+
+    async def reject(stage, context):
+        return False
+
+    pipeline = Pipeline([
+        make_stage("Chat", inputs=("uid",), outputs=("reply",), log=log),
+        make_stage("Store", inputs=("reply",), outputs=("stored",), deferred=True, log=log),
+    ])
+
+    run = await pipeline.run({"uid": "u1"}, submit_deferred=reject)
+    assert log == ["Chat", "Store"]
+    assert run.results["Store"].status == "completed"
+    assert run.context["stored"] == "Store:stored"
+
+    log.clear()
+    run = await pipeline.run({"uid": "u1"})
+    assert log == ["Chat", "Store"]
+
+
+@pytest.mark.asyncio
+async def test_deferred_stage_skipped_when_inputs_missing():
+    submitted = []
+
+    async def submit(stage, context):
+        submitted.append(stage.name)
+        return True
+
+    async def broken(context):
+        raise RuntimeError("llm down")
+
+    pipeline = Pipeline([
+        make_stage("Chat", inputs=("uid",), outputs=("reply",), func=broken),
+        make_stage("Store", inputs=("reply",), outputs=("stored",), deferred=True),
+    ])
+    run = await pipeline.run({"uid": "u1"}, submit_deferred=submit)
+
+    assert submitted == []
+    assert run.results["Store"].status == "skipped"
+
+
+@pytest.mark.asyncio
+async def test_cancellation_cancels_running_stages():
+    cancelled = asyncio.Event()
+
+    async def slow(context):
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+        return {}
+
+    pipeline = Pipeline([make_stage("Chat", inputs=("uid",), outputs=("reply",), func=slow)])
+    with pytest.raises(asyncio.TimeoutError):
+        await asyncio.wait_for(pipeline.run({"uid": "u1"}), timeout=0.05)
+
+    await asyncio.wait_for(cancelled.wait(), timeout=1)
@@ -0,0 +1,137 @@
+"""ProfileCodec：Hash/文档往返、版本校验与两种JSON后端的一致性"""
+
+import json
+from datetime import datetime
+
+import pytest
+
+import storage.profile_codec as profile_codec
+from storage.profile_codec import CODEC_VERSION, CodecVersionError, ProfileCodec, check_version, dumps, loads
+from models.api_models import ConversationInfo, CustomerMemory, CustomerProfile
+
+NOW = datetime(2024, 5, 1, 12, 30, 45, 123456)
+
+
+def make_profile(**overrides):
+    fields = dict(
+        uid="u1", created_at=NOW, last_active=NOW, total_conversations=3, total_tokens=120,
+        preferences={"language": "中文", "verbose": True}, learning_data={"topics": ["产品咨询"]},
+        satisfaction_score=4.5, service_level="premium"
+    )
+    fields.update(overrides)
+    return CustomerProfile(**fields)
+
+
+def make_conversation(**overrides):
+    fields = dict(
+        id="c1", timestamp=NOW, customer_message="价格是多少？", agent_message="100元",
+        tokens_used=12, context_summary="客户询问: 价格是多少？", satisfaction_rating=5
+    )
+    fields.update(overrides)
+    return ConversationInfo(**fields)
+
+
+def as_redis_hash(mapping):
+    """模拟Redis读取：值全部为字符串"""
+    return {key: str(value) for key, value in mapping.items()}
+
+
+def test_profile_hash_round_trip():
+    profile = make_profile()
+    data = ProfileCodec.profile_to_hash(profile)
+
+    assert data["_v"] == str(CODEC_VERSION)
+    assert ProfileCodec.profile_from_hash("u1", as_redis_hash(data)) == profile
+
+
+def test_profile_hash_without_counters():
+    data = ProfileCodec.profile_to_hash(make_profile(), include_counters=False)
+    assert "total_conversations" not in data and "total_tokens" not in data
+
+
+def test_profile_hash_accepts_bytes():
+    data = ProfileCodec.profile_to_hash(make_profile())
+    raw = {key.encode(): str(value).encode() for key, value in data.items()}
+
+    assert ProfileCodec.profile_from_hash("u1", raw) == make_profile()
+
+
+def test_profile_dict_round_trip():
+    profile = make_profile(satisfaction_score=None)
+    assert ProfileCodec.profile_from_dict(json.loads(dumps(ProfileCodec.profile_to_dict(profile)))) == profile
+
+
+def test_conversation_round_trips():
+    conversation = make_conversation()
+
+    data = ProfileCodec.conversation_to_hash(conversation, session_id="s1")
+    assert ProfileCodec.conversation_from_hash(as_redis_hash(data)) == conversation
+
+    document = json.loads(dumps(ProfileCodec.conversation_to_dict(conversation)))
+    assert ProfileCodec.conversation_from_dict(document) == conversation
+
+
+def test_memory_dict_round_trip():
+    memory = CustomerMemory(
+        short_term=[make_conversation(), make_conversation(id="c2", satisfaction_rating=None)],
+        long_term_summary="最近关注话题: 价格",
+        key_topics=["产品咨询"],
+        total_context_tokens=24
+    )
+    document = json.loads(dumps(ProfileCodec.memory_to_dict(memory)))
+
+    assert ProfileCodec.memory_from_dict(document) == memory
+
+
+def test_preferences_round_trip():
+    preferences = {"language": "中文", "max_length": 200, "tags": ["a", "b"], "nested": {"x": None}}
+    data = ProfileCodec.preferences_to_hash(preferences)
+
+    assert ProfileCodec.preferences_from_hash(as_redis_hash(data)) == preferences
+
+
+def test_datetime_format_identical_across_backends(monkeypatch):
+    value = {"at": NOW, "items": [NOW]}
+    with_default_backend = dumps(value)
+    monkeypatch.setattr(profile_codec, "orjson", None)
+
+    assert dumps(value) == with_default_backend
+    assert json.loads(with_default_backend)["at"] == NOW.isoformat()
+
+
+def test_loads_falls_back_to_python_literals():
+    assert loads("{'a': True, 'b': None}") == {"a": True, "b": None}
+    assert loads("not json", default={}) == {}
+    assert loads(None, default=[]) == []
+
+
+@pytest.mark.parametrize("data, expected", [
+    ({}, 0),
+    ({"_v": ""}, 0),
+    ({"_v": "1"}, 1),
+    ({b"_v": b"1"}, 1),
+    ({"_v": 1}, 1),
+])
+def test_check_version_accepts_known_versions(data, expected):
+    assert check_version(data) == expected
+
+
+@pytest.mark.parametrize("data", [{"_v": str(CODEC_VERSION + 1)}, {"_v": "abc"}])
+def test_check_version_rejects_unknown_versions(data):
+    with pytest.raises(CodecVersionError):
+        check_version(data)
+
+
+def test_decode_rejects_newer_version():
+    data = as_redis_hash(ProfileCodec.profile_to_hash(make_profile()))
+    data["_v"] = str(CODEC_VERSION + 1)
+
+    with pytest.raises(CodecVersionError):
+        ProfileCodec.profile_from_hash("u1", data)
+
+
+def test_legacy_hash_without_version_still_decodes():
+    data = as_redis_hash(ProfileCodec.conversation_to_hash(make_conversation()))
+    data.pop("_v", None)
+
+    assert ProfileCodec.conversation_from_hash(data) == make_conversation()
@@ -0,0 +1,114 @@
+"""StoreProfile：重放幂等、fencing token校验与长期摘要只计算一次"""
+
+import json
+from datetime import datetime
+
+import pytest
+
+from core.store_profile import StoreProfile
+from models.api_models import ConversationInfo, CustomerMemory, CustomerProfile
+
+BACKENDS = ["hash", "document"]
+
+
+def make_turn(uid, turns=0, **extra):
+    now = datetime.now()
+    history = [
+        ConversationInfo(
+            id=f"old-{index}", timestamp=now, customer_message=f"问题{index}", agent_message="回复",
+            tokens_used=1, context_summary=f"客户询问: 问题{index}"
+        )
+        for index in range(turns)
+    ]
+    return {
+        "uid": uid,
+        "session_id": "s1",
+        "message": "产品价格是多少",
+        "response_content": "100元",
+        "tokens_used": 7,
+        "customer_profile": CustomerProfile(
+            uid=uid, created_at=now, last_active=now, total_conversations=0, total_tokens=0
+        ),
+        "customer_memory": CustomerMemory(short_term=history, total_context_tokens=len(history)),
+        **extra
+    }
+
+
+async def stored_counters(redis, backend, uid):
+    """(total_conversations, 对话条数)"""
+    if backend == "document":
+        document = json.loads(await redis.get(f"profile_doc:{uid}"))
+        return document["profile"]["total_conversations"], len(document["memory"]["short_term"])
+    profile = await redis.hgetall(f"profile:{uid}")
+    return int(profile["total_conversations"]), await redis.llen(f"memory:{uid}:conversations")
+
+
+@pytest.fixture(params=BACKENDS)
+def backend(request, settings, monkeypatch):
+    monkeypatch.setattr(settings.redis, "profile_backend", request.param)
+    return request.param
+
+
+@pytest.mark.asyncio
+async def test_replayed_turn_is_not_applied_twice(redis, backend):
+    store = StoreProfile()
+    payload = make_turn("u1")
+
+    first = await store.process(payload)
+    # 写回重试使用同一个payload（turn_id在第一次处理时生成）
+    second = await store.process(payload)
+
+    assert first.get("storage_error") is None and second.get("storage_error") is None
+    assert await stored_counters(redis, backend, "u1") == (1, 1)
+
+
+@pytest.mark.asyncio
+async def test_distinct_turns_are_all_applied(redis, backend):
+    store = StoreProfile()
+    for _ in range(3):
+        await store.process(make_turn("u1"))
+
+    assert await stored_counters(redis, backend, "u1") == (3, 3)
+
+
+@pytest.mark.asyncio
+async def test_stale_fence_rejected_with_redis_leases(redis, backend, settings, monkeypatch):
+    monkeypatch.setattr(settings.concurrency, "lease_backend", "redis")
+    store = StoreProfile()
+
+    await store.process(make_turn("u1", lease_slot=0, lease_fence=6))
+    stale = await store.process(make_turn("u1", lease_slot=0, lease_fence=5))
+    other_slot = await store.process(make_turn("u1", lease_slot=1, lease_fence=5))
+
+    assert stale.get("storage_error") and stale["storage_retryable"] is False
+    assert other_slot.get("storage_error") is None
+    assert await stored_counters(redis, backend, "u1") == (2, 2)
+    assert await redis.hgetall("lease:{u1}:written") == {"0": "6", "1": "5"}
+
+
+@pytest.mark.asyncio
+async def test_fence_ignored_with_local_leases(redis, backend):
+    store = StoreProfile()
+
+    await store.process(make_turn("u1", lease_slot=0, lease_fence=6))
+    # 进程内租约的fencing计数随重启归零，不参与校验
+    result = await store.process(make_turn("u1", lease_slot=0, lease_fence=1))
+
+    assert result.get("storage_error") is None
+    assert await stored_counters(redis, backend, "u1") == (2, 2)
+
+
+@pytest.mark.asyncio
+async def test_long_term_summary_generated_once(redis, backend, monkeypatch):
+    calls = []
+    original = StoreProfile._generate_long_term_summary
+
+    async def counting(self, conversations):
+        calls.append(len(conversations))
+        return await original(self, conversations)
+
+    monkeypatch.setattr(StoreProfile, "_generate_long_term_summary", counting)
+
+    await StoreProfile().process(make_turn("u1", turns=10))
+
+    assert calls == [10]
@@ -0,0 +1,170 @@
+"""流式中转：续传游标、终止事件、会话复用与生成任务登记"""
+
+import asyncio
+import json
+
+import pytest
+
+from core.stream_relay import (
+    GenerationRegistry, GenerationRunningError, publish_final, reset_stream, stream_key, tail_stream
+)
+
+UID, SESSION = "u1", "s1"
+
+
+def delta(text):
+    return json.dumps({"type": "response.output_text.delta", "delta": text}, ensure_ascii=False)
+
+
+def parse(frames):
+    """SSE帧 -> [(事件ID, 数据)]"""
+    events = []
+    for frame in frames:
+        fields = dict(line.split(": ", 1) for line in frame.decode().strip().split("\n") if ": " in line)
+        events.append((int(fields["id"]) if "id" in fields else None, json.loads(fields["data"])))
+    return events
+
+
+async def collect(last_event_id=None, timeout=1.0):
+    return parse([frame async for frame in tail_stream(UID, SESSION, last_event_id, timeout=timeout)])
+
+
+async def push(redis, *texts):
+    await redis.rpush(f"{stream_key(UID, SESSION)}:chunks", *(delta(text) for text in texts))
+
+
+@pytest.mark.asyncio
+async def test_tail_from_start(redis):
+    await push(redis, "a", "b")
+    await redis.rpush(f"{stream_key(UID, SESSION)}:chunks", json.dumps({"type": "start"}))
+    await publish_final(UID, SESSION, {"type": "complete", "full_content": "ab"})
+
+    events = await collect()
+
+    # 非转发类型的数据块不输出，但仍占用事件ID
+    assert [(event_id, data.get("delta")) for event_id, data in events[:-1]] == [(0, "a"), (1, "b")]
+    assert events[-1] == (3, {"type": "complete", "full_content": "ab"})
+
+
+@pytest.mark.asyncio
+async def test_resume_after_last_event_id(redis):
+    await push(redis, "a", "b", "c")
+    await publish_final(UID, SESSION, {"type": "complete"})
+
+    events = await collect(last_event_id=1)
+
+    assert [event_id for event_id, _ in events] == [2, 3]
+    assert events[0][1]["delta"] == "c"
+
+
+@pytest.mark.asyncio
+async def test_resume_after_final_received_sends_nothing(redis):
+    await push(redis, "a")
+    await publish_final(UID, SESSION, {"type": "complete"})
+
+    assert await collect(last_event_id=1) == []
+
+
+@pytest.mark.asyncio
+async def test_follows_live_writes(redis, settings, monkeypatch):
+    monkeypatch.setattr(settings.stream, "read_interval", 0.01)
+    await push(redis, "a")
+
+    async def writer():
+        await asyncio.sleep(0.05)
+        await push(redis, "b")
+        await publish_final(UID, SESSION, {"type": "complete"})
+
+    writer_task = asyncio.create_task(writer())
+    events = await collect(last_event_id=0)
+    await writer_task
+
+    assert [(event_id, data.get("delta")) for event_id, data in events] == [(1, "b"), (2, None)]
+
+
+@pytest.mark.asyncio
+async def test_timeout_emits_error(redis, settings, monkeypatch):
+    monkeypatch.setattr(settings.stream, "read_interval", 0.01)
+
+    events = await collect(timeout=0.05)
+
+    assert events[-1][1]["type"] == "error"
+
+
+@pytest.mark.asyncio
+async def test_final_is_not_overwritten(redis):
+    await publish_final(UID, SESSION, {"type": "error", "error": "truncated"})
+    await publish_final(UID, SESSION, {"type": "complete"})
+
+    assert (await collect())[-1][1]["type"] == "error"
+
+
+@pytest.mark.asyncio
+async def test_reset_clears_previous_turn(redis):
+    await push(redis, "old")
+    await publish_final(UID, SESSION, {"type": "complete", "full_content": "old"})
+    await redis.hset(stream_key(UID, SESSION), "metadata", "{}")
+
+    await reset_stream(UID, SESSION)
+
+    assert await redis.llen(f"{stream_key(UID, SESSION)}:chunks") == 0
+    assert await redis.hget(stream_key(UID, SESSION), "final") is None
+    assert await redis.hget(stream_key(UID, SESSION), "metadata") == "{}"
+
+
+@pytest.mark.asyncio
+async def test_registry_starts_on_a_clean_stream(redis):
+    await push(redis, "old")
+    await publish_final(UID, SESSION, {"type": "complete", "full_content": "old"})
+    registry = GenerationRegistry()
+
+    async def generation():
+        await push(redis, "new")
+        await publish_final(UID, SESSION, {"type": "complete", "full_content": "new"})
+
+    await registry.start(UID, SESSION, generation())
+    events = await collect()
+
+    assert [data.get("delta") or data.get("full_content") for _, data in events] == ["new", "new"]
+
+
+@pytest.mark.asyncio
+async def test_registry_rejects_concurrent_generation(redis):
+    registry = GenerationRegistry()
+    release = asyncio.Event()
+
+    async def generation():
+        await release.wait()
+
+    task = await registry.start(UID, SESSION, generation())
+    assert registry.is_running(UID, SESSION)
+
+    second = generation()
+    with pytest.raises(GenerationRunningError):
+        await registry.start(UID, SESSION, second)
+    # 被拒绝的协程已关闭，不会产生 "never awaited" 警告
+    assert second.cr_frame is None
+
+    release.set()
+    await task
+    await asyncio.sleep(0)
+    assert not registry.is_running(UID, SESSION)
+    assert registry.stats() == {"running": 0, "started": 1, "rejected": 1}
+
+
+@pytest.mark.asyncio
+async def test_registry_shutdown_cancels_stragglers(redis):
+    registry = GenerationRegistry()
+    cancelled = asyncio.Event()
+
+    async def generation():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    await registry.start(UID, SESSION, generation())
+    await registry.shutdown(timeout=0.05)
+
+    assert cancelled.is_set()
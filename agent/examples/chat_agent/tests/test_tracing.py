@@ -0,0 +1,49 @@
+"""链路追踪：单条trace的span数量上限"""
+
+from utils.tracing import InMemorySink, Tracer
+
+
+def make_tracer(max_spans):
+    memory = InMemorySink(10)
+    return Tracer(True, [memory], memory, max_spans=max_spans)
+
+
+def test_leaf_spans_beyond_limit_are_counted_not_kept():
+    tracer = make_tracer(max_spans=5)
+
+    with tracer.start_trace("chat") as root:
+        with tracer.span("LoadProfile"):
+            with tracer.span("redis HGETALL"):
+                pass
+        with tracer.span("ChatProcessor"):
+            for _ in range(100):
+                with tracer.span("redis RPUSH"):
+                    pass
+        with tracer.span("StoreProfile"):
+            with tracer.span("redis MULTI"):
+                pass
+
+    trace = tracer.memory.get(root.trace.trace_id)
+    names = [span.name for span in trace.spans]
+
+    # 结构性span与根span超过上限后仍然保留
+    assert {"chat", "LoadProfile", "ChatProcessor", "StoreProfile"} <= set(names)
+    assert names.count("redis RPUSH") == 3
+    assert "redis MULTI" not in names
+    assert trace.dropped_spans == 98
+    assert trace.root.attributes["dropped_spans"] == 98
+    assert trace.summary()["dropped_spans"] == 98
+
+
+def test_small_trace_keeps_every_span():
+    tracer = make_tracer(max_spans=10)
+
+    with tracer.start_trace("chat") as root:
+        with tracer.span("LoadProfile"):
+            with tracer.span("redis HGETALL"):
+                pass
+
+    trace = tracer.memory.get(root.trace.trace_id)
+    assert len(trace.spans) == 3
+    assert trace.dropped_spans == 0
+    assert "dropped_spans" not in trace.summary()
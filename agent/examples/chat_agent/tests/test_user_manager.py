@@ -0,0 +1,74 @@
+"""客户租约：进程内后端的槽位/fencing token与租约丢失时中止处理"""
+
+import asyncio
+
+import pytest
+
+from core.user_manager import LeaseLostError, LocalLeaseBackend, UserLease
+
+
+@pytest.mark.asyncio
+async def test_local_backend_slots_and_fences():
+    backend = LocalLeaseBackend(max_per_user=2, shards=4)
+
+    first = await backend.acquire("u1")
+    second = await backend.acquire("u1")
+    assert (first.slot, first.fence) == (0, 1)
+    assert (second.slot, second.fence) == (1, 2)
+    assert await backend.acquire("u1") is None
+
+    assert await backend.release(first)
+    assert not await backend.release(first)
+
+    # 释放的槽位被复用，fencing token继续递增
+    third = await backend.acquire("u1")
+    assert (third.slot, third.fence) == (0, 3)
+
+
+@pytest.mark.asyncio
+async def test_guard_returns_result():
+    lease = UserLease(uid="u1", slot=0, fence=1)
+
+    assert await lease.guard(asyncio.sleep(0, result="done")) == "done"
+
+
+@pytest.mark.asyncio
+async def test_guard_cancels_work_when_lease_lost():
+    lease = UserLease(uid="u1", slot=0, fence=1)
+    cancelled = asyncio.Event()
+
+    async def work():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    asyncio.get_running_loop().call_later(0.01, lease.mark_lost)
+    with pytest.raises(LeaseLostError):
+        await lease.guard(work())
+
+    assert cancelled.is_set()
+
+
+@pytest.mark.asyncio
+async def test_guard_rejects_already_lost_lease():
+    lease = UserLease(uid="u1", slot=0, fence=1)
+    lease.mark_lost()
+    work = asyncio.sleep(0)
+
+    with pytest.raises(LeaseLostError):
+        await lease.guard(work)
+    # 未执行的协程已关闭，不会产生 "never awaited" 警告
+    assert work.cr_frame is None
+
+
+@pytest.mark.asyncio
+async def test_guard_propagates_errors():
+    lease = UserLease(uid="u1", slot=0, fence=1)
+
+    async def broken():
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError, match="boom"):
+        await lease.guard(broken())
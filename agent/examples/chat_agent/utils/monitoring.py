@@ -0,0 +1,359 @@
+"""
+监控工具模块
+进程内指标注册表（计数器、仪表、对数分桶延迟直方图、滑动窗口速率），
+Prometheus文本格式导出，以及带缓存的Redis INFO采样
+
+所有指标只在事件循环线程内更新，单线程下无需加锁
+"""
+
+import asyncio
+import math
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, Any, Optional, List, Tuple
+
+from utils.logger import get_logger
+from config.settings import get_settings
+
+logger = get_logger(__name__)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+# 直方图精度：每个2倍区间划分的子桶数（约9%相对误差）
+HISTOGRAM_SUB_BUCKETS = 8
+# 直方图可分辨的最小值(秒)
+HISTOGRAM_MIN_VALUE = 1e-6
+# 导出的分位数
+EXPORT_QUANTILES = (0.5, 0.9, 0.99)
+
+
+def _label_key(labels: Dict[str, Any]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key: LabelKey, extra: Optional[Dict[str, str]] = None) -> str:
+    items = list(key) + list((extra or {}).items())
+    if not items:
+        return ""
+    body = ",".join(f'{k}="{_escape(v)}"' for k, v in items)
+    return "{" + body + "}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Counter:
+    """单调递增计数器"""
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+
+class Gauge:
+    """可增可减的瞬时值"""
+
+    def __init__(self):
+        self.value = 0.0
+
+    def set(self, value: float):
+        self.value = value
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+    def dec(self, amount: float = 1.0):
+        self.value -= amount
+
+
+class Histogram:
+    """
+    对数分桶直方图（HDR风格）
+    桶边界按 2^(1/HISTOGRAM_SUB_BUCKETS) 几何增长，内存与样本数无关
+    """
+
+    _log_growth = math.log(2) / HISTOGRAM_SUB_BUCKETS
+
+    def __init__(self):
+        self.buckets: Dict[int, int] = {}
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        index = self._index(value)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q: float) -> float:
+        """分位数估计（返回所在桶的上界）"""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= target:
+                return min(self._upper_bound(index), self.max)
+        return self.max
+
+    @property
+    def mean(self) -> float:
+        return self.sum / self.count if self.count else 0.0
+
+    def _index(self, value: float) -> int:
+        if value <= HISTOGRAM_MIN_VALUE:
+            return 0
+        return int(math.ceil(math.log(value / HISTOGRAM_MIN_VALUE) / self._log_growth))
+
+    def _upper_bound(self, index: int) -> float:
+        return HISTOGRAM_MIN_VALUE * math.exp(index * self._log_growth)
+
+
+class RateMeter:
+    """按秒分槽的滑动窗口速率"""
+
+    def __init__(self, window: int = 60):
+        self.window = window
+        self._slots: deque = deque()  # (秒, 次数)
+        self.total = 0
+
+    def mark(self, amount: int = 1):
+        now = int(time.monotonic())
+        if self._slots and self._slots[-1][0] == now:
+            second, count = self._slots[-1]
+            self._slots[-1] = (second, count + amount)
+        else:
+            self._slots.append((now, amount))
+        self.total += amount
+        self._expire(now)
+
+    def rate(self) -> float:
+        """最近window秒内的平均每秒次数"""
+        now = int(time.monotonic())
+        self._expire(now)
+        return sum(count for _, count in self._slots) / self.window
+
+    def _expire(self, now: int):
+        while self._slots and self._slots[0][0] <= now - self.window:
+            self._slots.popleft()
+
+
+class MetricsRegistry:
+    """指标注册表"""
+
+    def __init__(self):
+        self.started_at = time.time()
+        self._metrics: Dict[str, Dict[str, Any]] = {}
+        self._meters: Dict[str, RateMeter] = {}
+
+    def _get(self, kind: str, name: str, description: str, labels: Dict[str, Any]):
+        family = self._metrics.get(name)
+        if family is None:
+            family = {"kind": kind, "help": description, "series": {}}
+            self._metrics[name] = family
+        key = _label_key(labels)
+        metric = family["series"].get(key)
+        if metric is None:
+            metric = {"counter": Counter, "gauge": Gauge, "histogram": Histogram}[kind]()
+            family["series"][key] = metric
+        return metric
+
+    def counter(self, name: str, description: str = "", **labels) -> Counter:
+        return self._get("counter", name, description, labels)
+
+    def gauge(self, name: str, description: str = "", **labels) -> Gauge:
+        return self._get("gauge", name, description, labels)
+
+    def histogram(self, name: str, description: str = "", **labels) -> Histogram:
+        return self._get("histogram", name, description, labels)
+
+    def meter(self, name: str) -> RateMeter:
+        """滑动窗口速率（只用于接口查询，不导出）"""
+        meter = self._meters.get(name)
+        if meter is None:
+            meter = RateMeter()
+            self._meters[name] = meter
+        return meter
+
+    @contextmanager
+    def timer(self, name: str, description: str = "", **labels):
+        """记录代码块耗时到直方图"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.histogram(name, description, **labels).observe(time.perf_counter() - started)
+
+    def total(self, name: str) -> float:
+        """计数器所有标签的合计"""
+        family = self._metrics.get(name)
+        if not family:
+            return 0.0
+        return sum(metric.value for metric in family["series"].values())
+
+    def merged_histogram(self, name: str) -> Histogram:
+        """合并所有标签的直方图"""
+        merged = Histogram()
+        family = self._metrics.get(name)
+        for metric in (family or {}).get("series", {}).values():
+            for index, count in metric.buckets.items():
+                merged.buckets[index] = merged.buckets.get(index, 0) + count
+            merged.count += metric.count
+            merged.sum += metric.sum
+            merged.max = max(merged.max, metric.max)
+        return merged
+
+    def uptime(self) -> float:
+        return time.time() - self.started_at
+
+    def render_prometheus(self) -> str:
+        """Prometheus文本格式（直方图以summary形式导出分位数）"""
+        lines: List[str] = []
+        for name, family in sorted(self._metrics.items()):
+            kind = "summary" if family["kind"] == "histogram" else family["kind"]
+            if family["help"]:
+                lines.append(f"# HELP {name} {family['help']}")
+            lines.append(f"# TYPE {name} {kind}")
+            for key, metric in family["series"].items():
+                if family["kind"] == "histogram":
+                    for q in EXPORT_QUANTILES:
+                        lines.append(f"{name}{_format_labels(key, {'quantile': str(q)})} {metric.quantile(q):.6g}")
+                    lines.append(f"{name}_sum{_format_labels(key)} {metric.sum:.6g}")
+                    lines.append(f"{name}_count{_format_labels(key)} {metric.count}")
+                else:
+                    lines.append(f"{name}{_format_labels(key)} {metric.value:.6g}")
+        lines.append("# TYPE process_uptime_seconds gauge")
+        lines.append(f"process_uptime_seconds {self.uptime():.3f}")
+        return "\n".join(lines) + "\n"
+
+
+class CpuSampler:
+    """进程CPU使用率（两次采样之间的process_time增量 / 墙钟增量）"""
+
+    def __init__(self):
+        self._last_wall = time.monotonic()
+        self._last_cpu = time.process_time()
+        self._last_percent = 0.0
+
+    def sample(self) -> float:
+        wall, cpu = time.monotonic(), time.process_time()
+        elapsed = wall - self._last_wall
+        if elapsed >= 0.5:
+            self._last_percent = round((cpu - self._last_cpu) / elapsed * 100, 2)
+            self._last_wall, self._last_cpu = wall, cpu
+        return self._last_percent
+
+
+class RedisInfoSampler:
+    """缓存Redis INFO结果，避免每次接口调用都执行INFO"""
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._info: Dict[str, Any] = {}
+        self._fetched_at = 0.0
+        self._refreshing: Optional[asyncio.Task] = None
+
+    async def get(self) -> Dict[str, Any]:
+        if time.monotonic() - self._fetched_at < self.ttl:
+            return self._info
+        # 并发调用共享同一次INFO请求
+        if self._refreshing is None or self._refreshing.done():
+            self._refreshing = asyncio.create_task(self._refresh())
+        await asyncio.shield(self._refreshing)
+        return self._info
+
+    async def _refresh(self):
+        from storage.redis_client import get_redis_client
+
+        redis_client = await get_redis_client()
+        self._info = await redis_client.info()
+        self._fetched_at = time.monotonic()
+
+
+class MetricsServer:
+    """Prometheus抓取端点（独立端口，基于asyncio的最小HTTP服务）"""
+
+    def __init__(self, registry: MetricsRegistry, host: str, port: int):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self):
+        try:
+            self._server = await asyncio.start_server(self._handle, self.host, self.port)
+            logger.info(f"📈 Prometheus指标端点: http://{self.host}:{self.port}/metrics")
+        except OSError as e:
+            logger.warning(f"指标端口启动失败 {self.port}: {str(e)}")
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+            # 丢弃请求头
+            while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b"\r\n", b"\n", b""):
+                pass
+
+            parts = request_line.decode("latin-1").split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] in ("/", "/metrics"):
+                status, body = "200 OK", self.registry.render_prometheus().encode("utf-8")
+            else:
+                status, body = "404 Not Found", b"not found\n"
+
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                f"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: close\r\n\r\n".encode("latin-1") + body
+            )
+            await writer.drain()
+        except Exception as e:
+            logger.debug(f"指标请求处理失败: {str(e)}")
+        finally:
+            writer.close()
+
+
+# 全局实例
+_registry: Optional[MetricsRegistry] = None
+_info_sampler: Optional[RedisInfoSampler] = None
+_cpu_sampler: Optional[CpuSampler] = None
+
+def get_metrics_registry() -> MetricsRegistry:
+    """获取全局指标注册表"""
+    global _registry
+
+    if _registry is None:
+        _registry = MetricsRegistry()
+
+    return _registry
+
+def get_redis_info_sampler() -> RedisInfoSampler:
+    """获取全局Redis INFO采样器"""
+    global _info_sampler
+
+    if _info_sampler is None:
+        _info_sampler = RedisInfoSampler(get_settings().monitoring.redis_info_cache_ttl)
+
+    return _info_sampler
+
+def get_cpu_sampler() -> CpuSampler:
+    """获取全局CPU采样器"""
+    global _cpu_sampler
+
+    if _cpu_sampler is None:
+        _cpu_sampler = CpuSampler()
+
+    return _cpu_sampler
@@ -0,0 +1,127 @@
+"""
+JSON序列化模块
+流式链路（Redis中转 -> SSE）统一使用的序列化层：优先使用orjson，缺失时回退到标准库json
+
+- 流式数据块序列化时把type放在第一个字段，读取端用peek_type直接从字节中取出类型，
+  不需要为了过滤类型而完整解析JSON
+- Redis中读取的数据块原样拼进SSE帧（见utils/sse.py），不再经过 loads -> dumps 的二次编解码
+"""
+
+import json
+from typing import Any, Optional, Union
+
+try:
+    import orjson
+except ImportError:  # orjson为可选依赖，缺失时回退到标准库json
+    orjson = None
+
+from config.settings import get_settings
+
+RawValue = Union[str, bytes, bytearray, memoryview, None]
+
+# 数据块序列化后的固定前缀，peek_type依赖它定位type字段
+TYPE_PREFIX = b'{"type":"'
+
+
+class Serializer:
+    """标准库json实现"""
+
+    name = "json"
+
+    def dumpb(self, value: Any) -> bytes:
+        return json.dumps(value, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+
+    def dumps(self, value: Any) -> str:
+        return json.dumps(value, ensure_ascii=False, separators=(",", ":"), default=str)
+
+    def loads(self, raw: RawValue) -> Any:
+        if isinstance(raw, (bytearray, memoryview)):
+            raw = bytes(raw)
+        return json.loads(raw)
+
+
+class OrjsonSerializer(Serializer):
+    """orjson实现（直接输出UTF-8字节）"""
+
+    name = "orjson"
+    _options = orjson.OPT_NON_STR_KEYS if orjson is not None else 0
+
+    def dumpb(self, value: Any) -> bytes:
+        return orjson.dumps(value, default=str, option=self._options)
+
+    def dumps(self, value: Any) -> str:
+        return self.dumpb(value).decode("utf-8")
+
+    def loads(self, raw: RawValue) -> Any:
+        return orjson.loads(raw)
+
+
+def _create_serializer(backend: str) -> Serializer:
+    if backend in ("auto", "orjson") and orjson is not None:
+        return OrjsonSerializer()
+    return Serializer()
+
+
+def _to_bytes(raw: RawValue) -> bytes:
+    if isinstance(raw, str):
+        return raw.encode("utf-8")
+    return bytes(raw or b"")
+
+
+def dumpb(value: Any) -> bytes:
+    """序列化为UTF-8字节"""
+    return get_serializer().dumpb(value)
+
+
+def dumps(value: Any) -> str:
+    """序列化为字符串"""
+    return get_serializer().dumps(value)
+
+
+def loads(raw: RawValue) -> Any:
+    """解析JSON（str或bytes）"""
+    return get_serializer().loads(raw)
+
+
+def dump_chunk(chunk_type: str, payload: dict) -> bytes:
+    """
+    序列化流式数据块，type固定为第一个字段
+
+    Args:
+        chunk_type: 数据块类型
+        payload: 其余字段（其中的type字段会被忽略）
+    """
+    return get_serializer().dumpb({"type": chunk_type, **{k: v for k, v in payload.items() if k != "type"}})
+
+
+def peek_type(raw: RawValue) -> Optional[str]:
+    """
+    不解析整个JSON，直接读取dump_chunk写入的type字段
+
+    Returns:
+        Optional[str]: 数据块类型；不是dump_chunk格式时完整解析兜底，无法解析时返回None
+    """
+    data = _to_bytes(raw)
+    if data.startswith(TYPE_PREFIX):
+        end = data.find(b'"', len(TYPE_PREFIX))
+        # 类型名不含转义字符时可以直接截取
+        if end != -1 and b"\\" not in data[len(TYPE_PREFIX):end]:
+            return data[len(TYPE_PREFIX):end].decode("utf-8")
+    try:
+        value = loads(data)
+    except ValueError:
+        return None
+    return value.get("type") if isinstance(value, dict) else None
+
+
+# 全局序列化器实例
+_serializer: Optional[Serializer] = None
+
+def get_serializer() -> Serializer:
+    """获取全局序列化器（STREAM_JSON_BACKEND: auto/orjson/json）"""
+    global _serializer
+
+    if _serializer is None:
+        _serializer = _create_serializer(get_settings().stream.json_backend)
+
+    return _serializer
@@ -0,0 +1,231 @@
+"""
+SSE输出模块
+把流式生成器包装成 text/event-stream 字节流：
+
+- 帧直接以字节生成（id/event/data字段），StreamingResponse不再对字符串二次编码
+- 长时间没有数据时发送注释帧作为心跳，避免代理和负载均衡断开空闲连接
+- 发送端把缓冲区内已就绪的帧合并成一次写入，可选的flush窗口内到达的帧也一并合并
+- 缓冲区按字节数限制：客户端读取慢时上游生成器被挂起（背压），而不是无限堆积在内存中
+"""
+
+import asyncio
+from collections import deque
+from typing import Any, AsyncIterator, Deque, Dict, Optional, Union
+
+from fastapi.responses import StreamingResponse
+
+from config.settings import get_settings
+from utils.logger import get_logger
+from utils.monitoring import get_metrics_registry
+from utils.serialization import dumpb
+
+logger = get_logger(__name__)
+
+SSE_MEDIA_TYPE = "text/event-stream"
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "Connection": "keep-alive",
+    # 关闭nginx等反向代理的响应缓冲
+    "X-Accel-Buffering": "no",
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Allow-Headers": "*"
+}
+
+RawData = Union[str, bytes, bytearray, memoryview]
+
+
+def encode_frame(data: RawData, event_id: Optional[Any] = None, event: Optional[str] = None) -> bytes:
+    """
+    已编码的数据 -> SSE帧（数据按原始字节拼接，不重新序列化）
+
+    Args:
+        data: 单行数据（JSON序列化结果不包含换行）
+        event_id: 事件ID，客户端重连时通过Last-Event-ID带回
+        event: 事件名，为空时客户端按默认message事件处理
+    """
+    payload = data.encode("utf-8") if isinstance(data, str) else bytes(data)
+    head = b""
+    if event_id is not None:
+        head += b"id: " + str(event_id).encode("utf-8") + b"\n"
+    if event:
+        head += b"event: " + event.encode("utf-8") + b"\n"
+    return head + b"data: " + payload + b"\n\n"
+
+
+def encode_event(value: Any, event_id: Optional[Any] = None, event: Optional[str] = None) -> bytes:
+    """对象 -> SSE帧"""
+    return encode_frame(dumpb(value), event_id=event_id, event=event)
+
+
+def encode_comment(text: str = "") -> bytes:
+    """注释帧（客户端忽略，用作心跳）"""
+    return b": " + text.encode("utf-8") + b"\n\n"
+
+
+def encode_retry(milliseconds: int) -> bytes:
+    """重连间隔帧"""
+    return b"retry: " + str(int(milliseconds)).encode("utf-8") + b"\n\n"
+
+
+class _FrameBuffer:
+    """单生产者/单消费者的字节数受限缓冲区"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max(1, max_bytes)
+        self.size = 0
+        self._frames: Deque[bytes] = deque()
+        self._readable = asyncio.Event()
+        self._writable = asyncio.Event()
+        self._writable.set()
+        self.closed = False
+        self.aborted = False
+        self.error: Optional[BaseException] = None
+
+    async def put(self, frame: bytes) -> bool:
+        """写入一帧，缓冲区已满时等待消费；发送端已退出时返回False"""
+        # 缓冲区为空时总是接受，保证超过上限的单帧也能发出
+        if self.size and self.size + len(frame) > self.max_bytes and not self.aborted:
+            get_metrics_registry().counter("sse_backpressure_total", "SSE缓冲区满导致上游等待的次数").inc()
+            while self.size and self.size + len(frame) > self.max_bytes and not self.aborted:
+                self._writable.clear()
+                await self._writable.wait()
+        if self.aborted:
+            return False
+        self._frames.append(frame)
+        self.size += len(frame)
+        self._readable.set()
+        return True
+
+    def abort(self):
+        """发送端退出（客户端断开），唤醒并拒绝后续写入"""
+        self.aborted = True
+        self._writable.set()
+
+    def close(self, error: Optional[BaseException] = None):
+        self.closed = True
+        self.error = error
+        self._readable.set()
+
+    async def wait_readable(self, timeout: Optional[float]) -> bool:
+        """等待可读（有数据或已关闭），超时返回False"""
+        if self._frames or self.closed:
+            return True
+        self._readable.clear()
+        try:
+            await asyncio.wait_for(self._readable.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    def drain(self, max_bytes: int) -> bytes:
+        """取出不超过max_bytes的已就绪帧（至少一帧）并合并"""
+        batch = [self._frames.popleft()]
+        taken = len(batch[0])
+        while self._frames and taken + len(self._frames[0]) <= max_bytes:
+            frame = self._frames.popleft()
+            batch.append(frame)
+            taken += len(frame)
+        self.size -= taken
+        self._writable.set()
+        return batch[0] if len(batch) == 1 else b"".join(batch)
+
+    def __bool__(self) -> bool:
+        return bool(self._frames)
+
+
+class SSEEmitter:
+    """
+    SSE发送器
+    上游生成器在独立任务中运行并写入缓冲区，发送端按批取出写给客户端
+    """
+
+    def __init__(
+        self,
+        source: AsyncIterator[bytes],
+        heartbeat_interval: float = 15.0,
+        flush_window: float = 0.0,
+        max_batch_bytes: int = 65536,
+        max_buffer_bytes: int = 1048576,
+        retry_ms: int = 0
+    ):
+        self.source = source
+        self.heartbeat_interval = heartbeat_interval if heartbeat_interval > 0 else None
+        self.flush_window = flush_window
+        self.max_batch_bytes = max(1, max_batch_bytes)
+        self.retry_ms = retry_ms
+        self._buffer = _FrameBuffer(max_buffer_bytes)
+
+    async def _produce(self):
+        """读取上游生成器；缓冲区满时挂起上游"""
+        error = None
+        try:
+            async for frame in self.source:
+                if not await self._buffer.put(frame):
+                    break
+        except Exception as e:
+            error = e
+        finally:
+            # 保证上游生成器的finally（释放租约等）在本任务内执行
+            aclose = getattr(self.source, "aclose", None)
+            if aclose:
+                await aclose()
+            self._buffer.close(error)
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        registry = get_metrics_registry()
+        producer = asyncio.create_task(self._produce())
+        try:
+            if self.retry_ms > 0:
+                yield encode_retry(self.retry_ms)
+
+            while True:
+                if not await self._buffer.wait_readable(self.heartbeat_interval):
+                    registry.counter("sse_heartbeats_total", "SSE心跳帧数").inc()
+                    yield encode_comment("ping")
+                    continue
+
+                if not self._buffer:
+                    break
+
+                # flush窗口：等待更多帧到达后合并写入
+                if self.flush_window > 0 and self._buffer.size < self.max_batch_bytes and not self._buffer.closed:
+                    await asyncio.sleep(self.flush_window)
+
+                batch = self._buffer.drain(self.max_batch_bytes)
+                registry.histogram("sse_write_bytes", "SSE单次写入字节数").observe(len(batch))
+                yield batch
+
+            if self._buffer.error is not None:
+                raise self._buffer.error
+        finally:
+            # 客户端断开时取消上游；上游吞掉取消（如Redis客户端在命令执行中被取消）时，写入下一帧时退出
+            self._buffer.abort()
+            if not producer.done():
+                producer.cancel()
+                try:
+                    await producer
+                except asyncio.CancelledError:
+                    pass
+
+
+def create_emitter(source: AsyncIterator[bytes]) -> SSEEmitter:
+    """按STREAM_SSE_*配置创建发送器"""
+    stream_settings = get_settings().stream
+    return SSEEmitter(
+        source,
+        heartbeat_interval=stream_settings.sse_heartbeat_interval,
+        flush_window=stream_settings.sse_flush_window,
+        max_batch_bytes=stream_settings.sse_max_batch_bytes,
+        max_buffer_bytes=stream_settings.sse_buffer_bytes,
+        retry_ms=stream_settings.sse_retry_ms
+    )
+
+
+def sse_response(source: AsyncIterator[bytes], headers: Optional[Dict[str, str]] = None) -> StreamingResponse:
+    """把SSE帧生成器包装成 text/event-stream 响应"""
+    return StreamingResponse(
+        create_emitter(source),
+        media_type=SSE_MEDIA_TYPE,
+        headers={**SSE_HEADERS, **(headers or {})}
+    )
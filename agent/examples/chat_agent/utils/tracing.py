@@ -0,0 +1,331 @@
+"""
+链路追踪模块
+轻量级span追踪：通过contextvars在协程间传递当前span，请求结束时整条trace交给sink导出
+
+- 内存sink：保留最近N条trace，供调试接口和响应metadata使用
+- 文件sink：每个span一行JSON（字段与OTLP span一致，时间为Unix纳秒），由单独线程写入
+- 当前没有活动trace时，span()只返回空上下文，开销可以忽略
+- 每条trace最多保留 max_spans 个span：超出后叶子span（如流式写入时的每条Redis命令）只计数，
+  有子span的结构性span（阶段、LLM调用、工具调用）和根span始终保留
+"""
+
+import json
+import os
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Dict, Any, Optional, List, Set
+
+from utils.logger import get_logger
+from config.settings import get_settings
+
+logger = get_logger(__name__)
+
+_current_span: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+
+
+@dataclass
+class Span:
+    """一次操作的耗时记录"""
+    trace: "Trace"
+    name: str
+    span_id: str = field(default_factory=lambda: uuid.uuid4().hex[:16])
+    parent_id: Optional[str] = None
+    start_ns: int = field(default_factory=time.time_ns)
+    end_ns: Optional[int] = None
+    attributes: Dict[str, Any] = field(default_factory=dict)
+    events: List[Dict[str, Any]] = field(default_factory=list)
+    error: Optional[str] = None
+
+    @property
+    def duration_ms(self) -> float:
+        end = self.end_ns if self.end_ns is not None else time.time_ns()
+        return (end - self.start_ns) / 1e6
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def add_event(self, name: str, **attributes):
+        self.events.append({"name": name, "time_ns": time.time_ns(), "attributes": attributes})
+
+    def end(self, error: Optional[str] = None):
+        """结束span（重复调用无效）"""
+        if self.end_ns is not None:
+            return
+        self.end_ns = time.time_ns()
+        if error:
+            self.error = error
+        self.trace.record(self)
+
+    def to_otlp(self) -> Dict[str, Any]:
+        """OTLP JSON风格的span表示"""
+        return {
+            "traceId": self.trace.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_id or "",
+            "name": self.name,
+            "startTimeUnixNano": self.start_ns,
+            "endTimeUnixNano": self.end_ns,
+            "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in self.attributes.items()],
+            "events": [
+                {
+                    "name": event["name"],
+                    "timeUnixNano": event["time_ns"],
+                    "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in event["attributes"].items()]
+                }
+                for event in self.events
+            ],
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 1}
+        }
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class Trace:
+    """一次请求的全部span"""
+
+    def __init__(self, name: str, max_spans: int = 256):
+        self.trace_id = uuid.uuid4().hex
+        self.name = name
+        self.max_spans = max(1, max_spans)
+        self.spans: List[Span] = []
+        self.root: Optional[Span] = None
+        # 已结束span的父span ID：子span先于父span结束，父span结束时据此判断是否为叶子
+        self._parent_ids: Set[str] = set()
+        self.dropped_spans = 0
+
+    def record(self, span: Span):
+        """记录已结束的span，超过上限时丢弃叶子span并计数"""
+        if span.parent_id:
+            self._parent_ids.add(span.parent_id)
+        if len(self.spans) < self.max_spans or span is self.root or span.span_id in self._parent_ids:
+            if span is self.root and self.dropped_spans:
+                span.set_attribute("dropped_spans", self.dropped_spans)
+            self.spans.append(span)
+        else:
+            self.dropped_spans += 1
+
+    def summary(self) -> Dict[str, Any]:
+        """
+        trace摘要：按开始时间排序的span列表（相对根span的偏移与耗时，单位毫秒）
+
+        同一父span下同名的叶子span（如流式写入时的大量Redis命令）合并为一项，记录次数与总耗时
+        """
+        spans = sorted(self.spans, key=lambda s: s.start_ns)
+        origin = self.root.start_ns if self.root else (spans[0].start_ns if spans else 0)
+        parents = {span.parent_id for span in spans if span.parent_id}
+
+        depth: Dict[str, int] = {}
+        entries: List[Dict[str, Any]] = []
+        merged: Dict[tuple, Dict[str, Any]] = {}
+        for span in spans:
+            depth[span.span_id] = depth[span.parent_id] + 1 if span.parent_id in depth else 0
+            is_leaf = span.span_id not in parents
+
+            if is_leaf and (span.parent_id, span.name) in merged:
+                entry = merged[(span.parent_id, span.name)]
+                entry["count"] += 1
+                entry["duration_ms"] = round(entry["duration_ms"] + span.duration_ms, 2)
+                if span.error:
+                    entry["error"] = span.error
+                continue
+
+            entry = {
+                "name": span.name,
+                "depth": depth[span.span_id],
+                "offset_ms": round((span.start_ns - origin) / 1e6, 2),
+                "duration_ms": round(span.duration_ms, 2)
+            }
+            if span.attributes:
+                entry["attributes"] = span.attributes
+            if span.error:
+                entry["error"] = span.error
+            if is_leaf:
+                entry["count"] = 1
+                merged[(span.parent_id, span.name)] = entry
+            entries.append(entry)
+
+        summary = {
+            "trace_id": self.trace_id,
+            "duration_ms": round(self.root.duration_ms, 2) if self.root else None,
+            "spans": entries
+        }
+        if self.dropped_spans:
+            summary["dropped_spans"] = self.dropped_spans
+        return summary
+
+
+class InMemorySink:
+    """保留最近若干条trace"""
+
+    def __init__(self, capacity: int):
+        self.capacity = max(1, capacity)
+        self._traces: "OrderedDict[str, Trace]" = OrderedDict()
+
+    def export(self, trace: Trace):
+        self._traces[trace.trace_id] = trace
+        while len(self._traces) > self.capacity:
+            self._traces.popitem(last=False)
+
+    def get(self, trace_id: str) -> Optional[Trace]:
+        return self._traces.get(trace_id)
+
+    def recent(self, count: int = 20) -> List[Trace]:
+        return list(self._traces.values())[-count:]
+
+    def close(self):
+        pass
+
+
+class FileSink:
+    """以JSON Lines格式追加写入span，文件IO放到单独线程，不阻塞事件循环"""
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # 单线程保证写入顺序
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="trace-sink")
+
+    def export(self, trace: Trace):
+        lines = "".join(json.dumps(span.to_otlp(), ensure_ascii=False, default=str) + "\n" for span in trace.spans)
+        self._executor.submit(self._write, lines)
+
+    def _write(self, lines: str):
+        try:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(lines)
+        except OSError as e:
+            logger.warning(f"trace写入失败 {self.path}: {str(e)}")
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+
+class Tracer:
+    """span的创建与导出"""
+
+    def __init__(self, enabled: bool, sinks: List[Any], memory: Optional[InMemorySink] = None, max_spans: int = 256):
+        self.enabled = enabled
+        self.sinks = sinks
+        self.memory = memory
+        self.max_spans = max_spans
+
+    @contextmanager
+    def start_trace(self, name: str, **attributes):
+        """开启一条新trace并进入其根span；退出时导出整条trace"""
+        if not self.enabled:
+            yield None
+            return
+
+        trace = Trace(name, self.max_spans)
+        root = Span(trace=trace, name=name, attributes=attributes)
+        trace.root = root
+        token = _current_span.set(root)
+        try:
+            yield root
+        except BaseException as e:
+            root.end(error=f"{type(e).__name__}: {e}")
+            raise
+        finally:
+            root.end()
+            _current_span.reset(token)
+            self._export(trace)
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        """在当前trace下开启子span；没有活动trace时不做任何记录"""
+        parent = _current_span.get()
+        if parent is None:
+            yield None
+            return
+
+        span = Span(trace=parent.trace, name=name, parent_id=parent.span_id, attributes=attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.end(error=f"{type(e).__name__}: {e}")
+            raise
+        finally:
+            span.end()
+            _current_span.reset(token)
+
+    def start_span(self, name: str, **attributes) -> Optional[Span]:
+        """
+        手动开启子span（不改变当前span），用于无法用with包住的操作，
+        由调用方负责调用span.end()；没有活动trace时返回None
+        """
+        parent = _current_span.get()
+        if parent is None:
+            return None
+        return Span(trace=parent.trace, name=name, parent_id=parent.span_id, attributes=attributes)
+
+    @contextmanager
+    def activate(self, span: Optional[Span]):
+        """把手动开启的span设为当前span（不负责结束），其间创建的span成为它的子span"""
+        if span is None:
+            yield None
+            return
+
+        token = _current_span.set(span)
+        try:
+            yield span
+        finally:
+            _current_span.reset(token)
+
+    def _export(self, trace: Trace):
+        for sink in self.sinks:
+            try:
+                sink.export(trace)
+            except Exception as e:
+                logger.warning(f"trace导出失败: {str(e)}")
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
+
+
+def current_span() -> Optional[Span]:
+    """当前活动span"""
+    return _current_span.get()
+
+
+def current_trace() -> Optional[Trace]:
+    """当前活动trace"""
+    span = _current_span.get()
+    return span.trace if span else None
+
+
+# 全局追踪器实例
+_tracer: Optional[Tracer] = None
+
+def get_tracer() -> Tracer:
+    """获取全局追踪器"""
+    global _tracer
+
+    if _tracer is None:
+        settings = get_settings().monitoring
+        sinks: List[Any] = []
+        memory = None
+        if settings.trace_enabled:
+            memory = InMemorySink(settings.trace_buffer_size)
+            sinks.append(memory)
+            if settings.trace_file_path:
+                sinks.append(FileSink(settings.trace_file_path))
+        _tracer = Tracer(settings.trace_enabled, sinks, memory, settings.trace_max_spans)
+
+    return _tracer
@@ -6,9 +6,9 @@
 
 import sys
 import os
-import json
-import asyncio
-from typing import Optional, AsyncGenerator
+import itertools
+import time
+from typing import Optional, AsyncGenerator, AsyncIterator, Dict, Any
 
 # 添加client目录到Python路径
 project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
@@ -16,6 +16,10 @@ client_path = os.path.join(project_root, 'client')
 sys.path.insert(0, client_path)
 
 from openai_client import OpenAIClient
+from response_cache import ResponseCache
+from tool_cache import ToolCache
+from coalescing import RequestCoalescer
+from sse import sse_event
 
 # 默认系统提示词
 DEFAULT_SYSTEM_PROMPT = """你是一个智能AI助手，能够帮助用户解答问题、提供信息和协助完成任务。你有以下特点：
@@ -27,9 +31,85 @@ DEFAULT_SYSTEM_PROMPT = """你是一个智能AI助手，能够帮助用户解答
 
 请用中文与用户交流，保持简洁明了的回答风格。"""
 
+# 输出节奏：文本增量按该间隔(毫秒)合并为一帧，0表示不合并（默认，面向API客户端）
+STREAM_PACING_MS = int(os.getenv("STREAM_PACING_MS", "0"))
+
+# 响应缓存：RESPONSE_CACHE_TTL>0 时启用；RESPONSE_CACHE_ALL 为真时所有请求都视为可缓存
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "0"))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1000"))
+RESPONSE_CACHE_REDIS_URL = os.getenv("RESPONSE_CACHE_REDIS_URL")
+RESPONSE_CACHE_ALL = os.getenv("RESPONSE_CACHE_ALL", "false").lower() in ("1", "true", "yes")
+
+# MCP工具结果缓存：TOOL_CACHE_TTL>0 时缓存MCP服务器声明为确定性（readOnlyHint且openWorldHint=false）的工具
+TOOL_CACHE_TTL = float(os.getenv("TOOL_CACHE_TTL", "0"))
+TOOL_CACHE_MAX_ENTRIES = int(os.getenv("TOOL_CACHE_MAX_ENTRIES", "1000"))
+
+# 请求合并：并发的相同可缓存请求（同上，temperature=0或cacheable）共享一次上游调用
+REQUEST_COALESCING = os.getenv("REQUEST_COALESCING", "false").lower() in ("1", "true", "yes")
+
 class ChatProcessor:
     """聊天处理器"""
     
+    # 共享客户端（SDK连接池与MCP工具目录），由lifespan初始化
+    shared_client: Optional[OpenAIClient] = None
+    
+    @classmethod
+    async def startup(cls):
+        """初始化共享客户端（MCP连接与工具发现只执行一次）"""
+        if cls.shared_client is None:
+            try:
+                client = cls.create_client()
+                await client.__aenter__()
+            except Exception as e:
+                # 启动时不可用（如未设置API密钥）时退化为每个请求创建客户端
+                print(f"⚠️ 共享OpenAI客户端初始化失败: {str(e)}")
+                return
+            cls.shared_client = client
+            print(f"✅ 共享OpenAI客户端初始化完成，可用工具: {len(client.get_available_tools())}")
+    
+    @classmethod
+    async def shutdown(cls):
+        """关闭共享客户端"""
+        client, cls.shared_client = cls.shared_client, None
+        if client:
+            await client.__aexit__(None, None, None)
+            await client.close()
+            await client.client.close()
+    
+    @classmethod
+    async def open_client(cls) -> OpenAIClient:
+        """
+        获取本次请求使用的客户端
+        
+        Returns:
+            OpenAIClient: 共享客户端上的独立会话；未初始化共享客户端时（未经lifespan直接调用）创建新客户端
+        """
+        if cls.shared_client is not None:
+            return cls.shared_client.create_session()
+        
+        client = cls.create_client()
+        await client.__aenter__()
+        return client
+    
+    @classmethod
+    def cache_stats(cls) -> Dict[str, Any]:
+        """共享客户端上的响应缓存、工具结果缓存与请求合并统计"""
+        client = cls.shared_client
+        return {
+            "response_cache": client.response_cache.stats() if client and client.response_cache else None,
+            "tool_cache": client.tool_cache.stats() if client and client.tool_cache else None,
+            "coalescing": client.coalescer.stats() if client and client.coalescer else None
+        }
+    
+    @staticmethod
+    async def release_client(client: OpenAIClient):
+        """释放本次请求使用的客户端（会话只丢弃自身状态）"""
+        try:
+            await client.__aexit__(None, None, None)
+            await client.close()
+        except Exception as e:
+            print(f"⚠️ 关闭客户端时发生错误: {str(e)}")
+    
     @staticmethod
     def create_client() -> OpenAIClient:
         """
@@ -48,10 +128,22 @@ class ChatProcessor:
         mcp_url = os.getenv("MCP_URL", "http://39.103.228.66:8165/mcp/")
         base_url = os.getenv("OPENAI_BASE_URL", "http://43.130.31.174:8003/v1")
         
+        response_cache = None
+        if RESPONSE_CACHE_TTL > 0:
+            response_cache = ResponseCache(
+                max_entries=RESPONSE_CACHE_MAX_ENTRIES,
+                ttl=RESPONSE_CACHE_TTL,
+                redis_url=RESPONSE_CACHE_REDIS_URL,
+                replay_interval=STREAM_PACING_MS / 1000
+            )
+        
         return OpenAIClient(
             api_key=api_key,
             base_url=base_url,
-            mcp_urls=[mcp_url] if mcp_url else None
+            mcp_urls=[mcp_url] if mcp_url else None,
+            response_cache=response_cache,
+            tool_cache=ToolCache(max_entries=TOOL_CACHE_MAX_ENTRIES, default_ttl=TOOL_CACHE_TTL) if TOOL_CACHE_TTL > 0 else None,
+            coalescer=RequestCoalescer() if REQUEST_COALESCING else None
         )
     
     @staticmethod
@@ -69,12 +161,48 @@ class ChatProcessor:
         system_prompt = system_prompt or DEFAULT_SYSTEM_PROMPT
         return f"系统提示词：\n{system_prompt}\n\n用户消息：\n{message}"
     
+    @staticmethod
+    async def pace_deltas(
+        chunks: AsyncIterator[Dict[str, Any]],
+        interval: float
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """
+        按帧间隔合并文本增量（不引入等待，只在下一个chunk到达时判断是否发出）
+        
+        Args:
+            chunks: 客户端返回的流式chunk
+            interval: 帧间隔(秒)
+            
+        Yields:
+            Dict[str, Any]: 合并后的chunk，文本增量之外的chunk原样透传（透传前先发出已合并的文本）
+        """
+        pending = []
+        last_flush = time.monotonic()
+        async for chunk in chunks:
+            if chunk.get("type") == "response.output_text.delta":
+                pending.append(chunk.get("delta", ""))
+                if time.monotonic() - last_flush < interval:
+                    continue
+                chunk = None
+            
+            if pending:
+                yield {"type": "response.output_text.delta", "delta": "".join(pending)}
+                pending = []
+                last_flush = time.monotonic()
+            if chunk is not None:
+                yield chunk
+        
+        if pending:
+            yield {"type": "response.output_text.delta", "delta": "".join(pending)}
+    
     @staticmethod
     async def process_stream_chat(
         message: str, 
         uid: str, 
-        system_prompt: Optional[str] = None
-    ) -> AsyncGenerator[str, None]:
+        system_prompt: Optional[str] = None,
+        pacing_ms: Optional[int] = None,
+        cacheable: Optional[bool] = None
+    ) -> AsyncGenerator[bytes, None]:
         """
         处理流式聊天请求
         
@@ -82,27 +210,35 @@ class ChatProcessor:
             message: 用户消息
             uid: 用户ID
             system_prompt: 可选的自定义系统提示词
+            pacing_ms: 文本增量合并间隔(毫秒)，None时使用STREAM_PACING_MS
+            cacheable: 是否允许使用响应缓存，None时使用RESPONSE_CACHE_ALL
             
         Yields:
-            str: 流式响应数据（JSON格式）
+            bytes: 已编码的SSE帧
         """
         client = None
+        # 事件ID为本次响应内的帧序号
+        event_ids = itertools.count()
         try:
             print(f"📝 用户 {uid} 开始流式处理: {message[:50]}{'...' if len(message) > 50 else ''}")
             
-            # 创建并初始化客户端
-            client = ChatProcessor.create_client()
-            await client.__aenter__()
+            # 获取客户端会话（共享连接与工具目录）
+            client = await ChatProcessor.open_client()
             
             # 构建prompt
             full_prompt = ChatProcessor.build_prompt(message, system_prompt)
             
             # 发送开始事件
-            yield f"data: {json.dumps({'type': 'start', 'message': '开始生成响应...', 'uid': uid}, ensure_ascii=False)}\n\n"
+            yield sse_event({'type': 'start', 'message': '开始生成响应...', 'uid': uid}, event_id=next(event_ids))
             
-            # 处理流式响应
+            # 处理流式响应（开启输出节奏时按帧间隔合并文本增量）
             content_buffer = ""
-            async for chunk in client.stream_chat(full_prompt):
+            pacing_ms = STREAM_PACING_MS if pacing_ms is None else pacing_ms
+            cacheable = RESPONSE_CACHE_ALL if cacheable is None else cacheable
+            chunks = client.stream_chat(full_prompt, cacheable=cacheable)
+            if pacing_ms > 0:
+                chunks = ChatProcessor.pace_deltas(chunks, pacing_ms / 1000)
+            async for chunk in chunks:
                 chunk_type = chunk.get("type", "")
                 
                 # 处理文本内容的增量更新
@@ -110,8 +246,7 @@ class ChatProcessor:
                     delta_text = chunk.get("delta", "")
                     if delta_text:
                         content_buffer += delta_text
-                        yield f"data: {json.dumps({'type': 'content', 'chunk': delta_text, 'uid': uid}, ensure_ascii=False)}\n\n"
-                        await asyncio.sleep(0.01)  # 流式效果延迟
+                        yield sse_event({'type': 'content', 'chunk': delta_text, 'uid': uid}, event_id=next(event_ids))
                 
                 # 处理工具调用开始
                 elif chunk_type == "response.output_item.added":
@@ -119,7 +254,7 @@ class ChatProcessor:
                     if item.get("type") == "function_call":
                         function_name = item.get("name", "unknown")
                         print(f"🔧 用户 {uid} 调用工具: {function_name}")
-                        yield f"data: {json.dumps({'type': 'tool_call', 'tool': function_name, 'status': 'started', 'uid': uid}, ensure_ascii=False)}\n\n"
+                        yield sse_event({'type': 'tool_call', 'tool': function_name, 'status': 'started', 'uid': uid}, event_id=next(event_ids))
                 
                 # 处理工具调用完成
                 elif chunk_type == "response.output_item.done":
@@ -128,15 +263,15 @@ class ChatProcessor:
                         function_name = item.get("name", "unknown")
                         arguments = item.get("arguments", "{}")
                         print(f"✅ 用户 {uid} 工具完成: {function_name}")
-                        yield f"data: {json.dumps({'type': 'tool_call', 'tool': function_name, 'status': 'completed', 'arguments': arguments, 'uid': uid}, ensure_ascii=False)}\n\n"
+                        yield sse_event({'type': 'tool_call', 'tool': function_name, 'status': 'completed', 'arguments': arguments, 'uid': uid}, event_id=next(event_ids))
                 
                 # 处理响应创建
                 elif chunk_type == "response.created":
-                    yield f"data: {json.dumps({'type': 'thinking', 'message': '正在思考...', 'uid': uid}, ensure_ascii=False)}\n\n"
+                    yield sse_event({'type': 'thinking', 'message': '正在思考...', 'uid': uid}, event_id=next(event_ids))
                 
                 # 处理内容部分添加
                 elif chunk_type == "response.content_part.added":
-                    yield f"data: {json.dumps({'type': 'content_start', 'message': '开始生成内容...', 'uid': uid}, ensure_ascii=False)}\n\n"
+                    yield sse_event({'type': 'content_start', 'message': '开始生成内容...', 'uid': uid}, event_id=next(event_ids))
             
             # 发送完成事件和统计信息
             completion_data = {
@@ -150,7 +285,7 @@ class ChatProcessor:
                     "total_cost": round(client.usage.total_cost, 6)
                 }
             }
-            yield f"data: {json.dumps(completion_data, ensure_ascii=False)}\n\n"
+            yield sse_event(completion_data, event_id=next(event_ids))
             
             print(f"✅ 用户 {uid} 流式响应完成，总计 {client.usage.total_tokens} tokens")
             
@@ -161,21 +296,19 @@ class ChatProcessor:
                 "error": f"处理请求时发生错误: {str(e)}",
                 "uid": uid
             }
-            yield f"data: {json.dumps(error_data, ensure_ascii=False)}\n\n"
+            yield sse_event(error_data, event_id=next(event_ids))
         
         finally:
-            # 确保关闭客户端
+            # 确保释放客户端
             if client:
-                try:
-                    await client.__aexit__(None, None, None)
-                except Exception as e:
-                    print(f"⚠️ 关闭客户端时发生错误: {str(e)}")
+                await ChatProcessor.release_client(client)
     
     @staticmethod
     async def process_chat(
         message: str, 
         uid: str, 
-        system_prompt: Optional[str] = None
+        system_prompt: Optional[str] = None,
+        cacheable: Optional[bool] = None
     ) -> dict:
         """
         处理非流式聊天请求
@@ -184,6 +317,7 @@ class ChatProcessor:
             message: 用户消息
             uid: 用户ID
             system_prompt: 可选的自定义系统提示词
+            cacheable: 是否允许使用响应缓存，None时使用RESPONSE_CACHE_ALL
             
         Returns:
             dict: 包含响应内容和统计信息的字典
@@ -195,15 +329,15 @@ class ChatProcessor:
         try:
             print(f"📝 用户 {uid} 开始非流式处理: {message[:50]}{'...' if len(message) > 50 else ''}")
             
-            # 创建并初始化客户端
-            client = ChatProcessor.create_client()
-            await client.__aenter__()
+            # 获取客户端会话（共享连接与工具目录）
+            client = await ChatProcessor.open_client()
             
             # 构建prompt
             full_prompt = ChatProcessor.build_prompt(message, system_prompt)
             
             # 调用OpenAI客户端
-            response = await client.chat(full_prompt)
+            cacheable = RESPONSE_CACHE_ALL if cacheable is None else cacheable
+            response = await client.chat(full_prompt, cacheable=cacheable)
             
             # 提取响应内容
             assistant_message = response["choices"][0]["message"]["content"]
@@ -227,9 +361,6 @@ class ChatProcessor:
             return chat_response
             
         finally:
-            # 确保关闭客户端
+            # 确保释放客户端
             if client:
-                try:
-                    await client.__aexit__(None, None, None)
-                except Exception as e:
-                    print(f"⚠️ 关闭客户端时发生错误: {str(e)}") 
\ No newline at end of file
+                await ChatProcessor.release_client(client) 
\ No newline at end of file
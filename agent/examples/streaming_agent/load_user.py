@@ -1,83 +1,213 @@
 #!/usr/bin/env python3
 """
 用户管理模块 - 负责用户并发控制和状态管理
+
+默认使用进程内分片锁；设置 USER_LEASE_BACKEND=redis 后改用Redis租约，
+多个uvicorn worker或多台主机之间共享同一份用户并发状态
 """
 
 import asyncio
-from typing import Set
-from datetime import datetime
+import os
+import uuid
+import zlib
+from typing import Dict, List, Optional
+
+# 获取租约：SET NX PX 成功后递增fencing计数器
+# KEYS[1]: 槽位键  KEYS[2]: fencing计数器  ARGV[1]: 持有者标识  ARGV[2]: 租约时长(毫秒)
+ACQUIRE_SCRIPT = """
+if redis.call('SET', KEYS[1], ARGV[1], 'NX', 'PX', ARGV[2]) then
+    local fence = redis.call('INCR', KEYS[2])
+    redis.call('PEXPIRE', KEYS[2], 86400000)
+    return fence
+end
+return false
+"""
+
+# 续期/释放：比较持有者，避免操作已被他人接管的租约
+RENEW_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class RedisLeaseStore:
+    """基于Redis的用户租约（SET NX PX + fencing token + 心跳续期）"""
+
+    def __init__(self, redis_url: str, ttl: float):
+        # redis为可选依赖，只有启用Redis后端时才需要安装
+        import redis.asyncio as redis
+
+        self._client = redis.from_url(redis_url, decode_responses=True)
+        self.ttl_ms = int(ttl * 1000)
+        self.renew_interval = max(0.1, ttl / 3)
+        self._acquire = self._client.register_script(ACQUIRE_SCRIPT)
+        self._renew = self._client.register_script(RENEW_SCRIPT)
+        self._release = self._client.register_script(RELEASE_SCRIPT)
+
+    @staticmethod
+    def _slot_key(uid: str) -> str:
+        return f"lease:{{{uid}}}:slot:0"
+
+    @staticmethod
+    def _fence_key(uid: str) -> str:
+        return f"lease:{{{uid}}}:fence"
+
+    async def acquire(self, uid: str, owner: str) -> Optional[int]:
+        """获取租约，成功时返回fencing token"""
+        fence = await self._acquire(keys=[self._slot_key(uid), self._fence_key(uid)], args=[owner, self.ttl_ms])
+        return int(fence) if fence else None
+
+    async def renew(self, uid: str, owner: str) -> bool:
+        """续期租约，返回是否仍然持有"""
+        return bool(int(await self._renew(keys=[self._slot_key(uid)], args=[owner, self.ttl_ms])))
+
+    async def release(self, uid: str, owner: str):
+        """释放租约"""
+        await self._release(keys=[self._slot_key(uid)], args=[owner])
+
+    async def close(self):
+        await self._client.aclose()
+
 
 class UserManager:
     """用户状态管理器"""
-    
-    def __init__(self):
-        # 正在处理的用户ID集合
-        self._processing_users: Set[str] = set()
-        # 异步锁
-        self._lock = asyncio.Lock()
-    
+
+    def __init__(self, lock_shards: int = 64, lease_store: Optional[RedisLeaseStore] = None):
+        # 正在处理的用户ID -> 租约持有者标识
+        self._processing_users: Dict[str, str] = {}
+        # 按uid分片的锁，不同用户的准入互不阻塞
+        self._locks: List[asyncio.Lock] = [asyncio.Lock() for _ in range(max(1, lock_shards))]
+        # 可选的Redis租约存储
+        self._lease_store = lease_store
+        self._heartbeat_task: Optional[asyncio.Task] = None
+
+    def _lock_for(self, uid: str) -> asyncio.Lock:
+        return self._locks[zlib.crc32(uid.encode("utf-8")) % len(self._locks)]
+
+    async def start(self):
+        """启动租约心跳（仅Redis后端）"""
+        if self._lease_store and self._heartbeat_task is None:
+            self._heartbeat_task = asyncio.create_task(self._heartbeat())
+            print(f"💓 用户租约心跳已启动: 每{self._lease_store.renew_interval:.1f}秒")
+
+    async def stop(self):
+        """停止心跳并释放本进程持有的租约"""
+        if self._heartbeat_task:
+            self._heartbeat_task.cancel()
+            try:
+                await self._heartbeat_task
+            except asyncio.CancelledError:
+                pass
+            self._heartbeat_task = None
+
+        for uid in list(self._processing_users):
+            await self.unmark_user_processing(uid)
+
+        if self._lease_store:
+            await self._lease_store.close()
+
     async def check_and_mark_user_processing(self, uid: str) -> bool:
         """
         检查并标记用户处理状态
-        
+
         Args:
             uid: 用户ID
-            
+
         Returns:
             bool: 是否可以开始处理（True=可以处理，False=已在处理中）
         """
-        async with self._lock:
+        async with self._lock_for(uid):
             if uid in self._processing_users:
-                return False  # 用户已在处理中
-            
+                return False  # 用户已在本进程处理中
+
+            owner = uuid.uuid4().hex
+            if self._lease_store:
+                fence = await self._lease_store.acquire(uid, owner)
+                if fence is None:
+                    return False  # 用户已在其他进程处理中
+                print(f"🔒 用户 {uid} 开始处理 (fence={fence})")
+            else:
+                print(f"🔒 用户 {uid} 开始处理")
+
             # 标记用户为正在处理
-            self._processing_users.add(uid)
-            print(f"🔒 用户 {uid} 开始处理")
+            self._processing_users[uid] = owner
             return True  # 可以开始处理
-    
+
     async def unmark_user_processing(self, uid: str):
         """
         取消用户处理标记
-        
+
         Args:
             uid: 用户ID
         """
-        try:
-            async with self._lock:
-                self._processing_users.discard(uid)
-                print(f"🔓 用户 {uid} 处理完成")
-        except Exception as e:
-            # 如果锁获取失败，直接操作（这是最后的保障）
-            print(f"⚠️ 锁获取失败，直接移除用户 {uid}: {str(e)}")
-            self._processing_users.discard(uid)
-    
+        async with self._lock_for(uid):
+            owner = self._processing_users.pop(uid, None)
+
+        if owner and self._lease_store:
+            try:
+                await self._lease_store.release(uid, owner)
+            except Exception as e:
+                # 释放失败时租约会在TTL后自动过期
+                print(f"⚠️ 用户 {uid} 租约释放失败: {str(e)}")
+
+        print(f"🔓 用户 {uid} 处理完成")
+
     async def get_processing_users(self) -> dict:
         """
         获取当前处理状态
-        
+
         Returns:
             dict: 包含活跃用户数和用户列表的字典
         """
-        async with self._lock:
-            active_users = len(self._processing_users)
-            users_list = list(self._processing_users)
-        
+        users_list = list(self._processing_users)
+
         return {
-            "active_users": active_users,
+            "active_users": len(users_list),
             "processing_users": users_list
         }
-    
+
     def is_user_processing(self, uid: str) -> bool:
         """
         同步方法检查用户是否正在处理中
-        
+
         Args:
             uid: 用户ID
-            
+
         Returns:
             bool: 用户是否正在处理中
         """
         return uid in self._processing_users
 
+    async def _heartbeat(self):
+        """定期续期本进程持有的租约"""
+        while True:
+            await asyncio.sleep(self._lease_store.renew_interval)
+            for uid, owner in list(self._processing_users.items()):
+                try:
+                    if not await self._lease_store.renew(uid, owner):
+                        print(f"⚠️ 用户 {uid} 的租约已丢失")
+                except Exception as e:
+                    print(f"⚠️ 用户 {uid} 租约续期失败: {str(e)}")
+
+
+def create_user_manager() -> UserManager:
+    """根据环境变量创建用户管理器"""
+    if os.getenv("USER_LEASE_BACKEND", "local") == "redis":
+        lease_store = RedisLeaseStore(
+            redis_url=os.getenv("REDIS_URL", "redis://localhost:6379/0"),
+            ttl=float(os.getenv("USER_LEASE_TTL", "30"))
+        )
+        return UserManager(lease_store=lease_store)
+    return UserManager()
+
 # 全局用户管理器实例
-user_manager = UserManager() 
\ No newline at end of file
+user_manager = create_user_manager()
@@ -5,7 +5,6 @@
 """
 
 from fastapi import FastAPI, HTTPException
-from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from contextlib import asynccontextmanager
 from typing import Optional
@@ -14,13 +13,19 @@ import uvicorn
 # 导入自定义模块
 from load_user import user_manager
 from chat_processor import ChatProcessor
+from sse import sse_event, sse_response
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """应用生命周期管理"""
     print("🚀 启动模块化流式Agent服务...")
+    await user_manager.start()
+    # 共享OpenAI客户端：MCP连接与工具发现只在启动时执行一次
+    await ChatProcessor.startup()
     yield
     print("🔄 正在关闭流式Agent服务...")
+    await ChatProcessor.shutdown()
+    await user_manager.stop()
 
 # 创建FastAPI应用
 app = FastAPI(
@@ -36,6 +41,8 @@ class ChatRequest(BaseModel):
     message: str
     uid: str  # 用户唯一标识符
     system_prompt: Optional[str] = None  # 可选的自定义系统提示词
+    pacing_ms: Optional[int] = None  # 可选的文本增量合并间隔(毫秒)，面向浏览器渲染可设为30-50
+    cacheable: Optional[bool] = None  # 可选，是否允许使用响应缓存（需设置RESPONSE_CACHE_TTL）
 
 @app.get("/")
 async def root():
@@ -82,19 +89,9 @@ async def stream_chat(request: ChatRequest):
         
         # 返回错误的流式响应
         async def error_response():
-            import json
-            yield f"data: {json.dumps({'type': 'error', 'error': error_msg, 'uid': uid}, ensure_ascii=False)}\n\n"
+            yield sse_event({'type': 'error', 'error': error_msg, 'uid': uid})
         
-        return StreamingResponse(
-            error_response(),
-            media_type="text/plain",
-            headers={
-                "Cache-Control": "no-cache",
-                "Connection": "keep-alive",
-                "Access-Control-Allow-Origin": "*",
-                "Access-Control-Allow-Headers": "*"
-            }
-        )
+        return sse_response(error_response())
     
     # 处理流式聊天请求
     async def stream_with_cleanup():
@@ -103,23 +100,16 @@ async def stream_chat(request: ChatRequest):
             async for chunk in ChatProcessor.process_stream_chat(
                 request.message, 
                 uid, 
-                request.system_prompt
+                request.system_prompt,
+                pacing_ms=request.pacing_ms,
+                cacheable=request.cacheable
             ):
                 yield chunk
         finally:
             # 确保取消用户处理标记
             await user_manager.unmark_user_processing(uid)
     
-    return StreamingResponse(
-        stream_with_cleanup(),
-        media_type="text/plain",
-        headers={
-            "Cache-Control": "no-cache",
-            "Connection": "keep-alive",
-            "Access-Control-Allow-Origin": "*",
-            "Access-Control-Allow-Headers": "*"
-        }
-    )
+    return sse_response(stream_with_cleanup())
 
 @app.post("/chat")
 async def chat_non_stream(request: ChatRequest):
@@ -148,7 +138,8 @@ async def chat_non_stream(request: ChatRequest):
         response = await ChatProcessor.process_chat(
             request.message, 
             uid, 
-            request.system_prompt
+            request.system_prompt,
+            cacheable=request.cacheable
         )
         return response
         
@@ -169,7 +160,8 @@ async def get_stats():
         "service_stats": {
             "active_users": processing_info["active_users"],
             "processing_users": processing_info["processing_users"]
-        }
+        },
+        "cache_stats": ChatProcessor.cache_stats()
     }
 
 if __name__ == "__main__":
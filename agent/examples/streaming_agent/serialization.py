@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+"""
+序列化模块 - 流式响应的JSON编码
+优先使用orjson直接输出UTF-8字节，未安装时回退到标准库json（JSON_BACKEND=json 可强制使用标准库）
+"""
+
+import json
+import os
+from typing import Any
+
+try:
+    import orjson
+except ImportError:  # orjson为可选依赖
+    orjson = None
+
+USE_ORJSON = orjson is not None and os.getenv("JSON_BACKEND", "auto") != "json"
+
+
+def dumpb(value: Any) -> bytes:
+    """序列化为UTF-8字节"""
+    if USE_ORJSON:
+        return orjson.dumps(value, default=str, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+
+
+def dumps(value: Any) -> str:
+    """序列化为字符串"""
+    return dumpb(value).decode("utf-8")
+
+
+def loads(raw) -> Any:
+    """解析JSON（str或bytes）"""
+    if USE_ORJSON:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+SSE输出模块 - 把流式生成器包装成 text/event-stream 字节流
+- 帧直接以字节生成（id/data字段），StreamingResponse不再对字符串二次编码
+- 长时间没有数据时发送注释帧作为心跳
+- 缓冲区内已就绪的帧合并成一次写入，可选的flush窗口内到达的帧也一并合并
+- 缓冲区按字节数限制，客户端读取慢时挂起上游生成器（背压）
+
+配置（环境变量）:
+    SSE_HEARTBEAT_INTERVAL  心跳间隔(秒)，默认15，0表示不发送
+    SSE_FLUSH_WINDOW        合并写入窗口(秒)，默认0（只合并已就绪的帧）
+    SSE_MAX_BATCH_BYTES     单次写入最大字节数，默认65536
+    SSE_BUFFER_BYTES        每个连接的缓冲区上限(字节)，默认1048576
+"""
+
+import asyncio
+import os
+from collections import deque
+from typing import Any, AsyncIterator, Deque, Optional
+
+from fastapi.responses import StreamingResponse
+
+from serialization import dumpb
+
+SSE_HEARTBEAT_INTERVAL = float(os.getenv("SSE_HEARTBEAT_INTERVAL", "15"))
+SSE_FLUSH_WINDOW = float(os.getenv("SSE_FLUSH_WINDOW", "0"))
+SSE_MAX_BATCH_BYTES = int(os.getenv("SSE_MAX_BATCH_BYTES", "65536"))
+SSE_BUFFER_BYTES = int(os.getenv("SSE_BUFFER_BYTES", "1048576"))
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "Connection": "keep-alive",
+    "X-Accel-Buffering": "no",
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Allow-Headers": "*"
+}
+
+
+def sse_event(value: Any, event_id: Optional[Any] = None) -> bytes:
+    """对象 -> SSE帧字节"""
+    head = b"id: " + str(event_id).encode("utf-8") + b"\n" if event_id is not None else b""
+    return head + b"data: " + dumpb(value) + b"\n\n"
+
+
+def sse_comment(text: str = "") -> bytes:
+    """注释帧（客户端忽略，用作心跳）"""
+    return b": " + text.encode("utf-8") + b"\n\n"
+
+
+class SSEEmitter:
+    """SSE发送器：上游生成器在独立任务中写入缓冲区，发送端按批写给客户端"""
+
+    def __init__(
+        self,
+        source: AsyncIterator[bytes],
+        heartbeat_interval: float = SSE_HEARTBEAT_INTERVAL,
+        flush_window: float = SSE_FLUSH_WINDOW,
+        max_batch_bytes: int = SSE_MAX_BATCH_BYTES,
+        max_buffer_bytes: int = SSE_BUFFER_BYTES
+    ):
+        self.source = source
+        self.heartbeat_interval = heartbeat_interval if heartbeat_interval > 0 else None
+        self.flush_window = flush_window
+        self.max_batch_bytes = max(1, max_batch_bytes)
+        self.max_buffer_bytes = max(1, max_buffer_bytes)
+
+        self._frames: Deque[bytes] = deque()
+        self._size = 0
+        self._closed = False
+        self._aborted = False
+        self._error: Optional[BaseException] = None
+        self._readable = asyncio.Event()
+        self._writable = asyncio.Event()
+        self._writable.set()
+
+    async def _produce(self):
+        """读取上游生成器；缓冲区满时等待发送端取走数据"""
+        try:
+            async for frame in self.source:
+                while self._size and self._size + len(frame) > self.max_buffer_bytes and not self._aborted:
+                    self._writable.clear()
+                    await self._writable.wait()
+                if self._aborted:
+                    break
+                self._frames.append(frame)
+                self._size += len(frame)
+                self._readable.set()
+        except Exception as e:
+            self._error = e
+        finally:
+            # 保证上游生成器的finally（取消用户处理标记等）在本任务内执行
+            await self.source.aclose()
+            self._closed = True
+            self._readable.set()
+
+    def _drain(self) -> bytes:
+        """取出不超过max_batch_bytes的已就绪帧（至少一帧）并合并"""
+        batch = [self._frames.popleft()]
+        taken = len(batch[0])
+        while self._frames and taken + len(self._frames[0]) <= self.max_batch_bytes:
+            frame = self._frames.popleft()
+            batch.append(frame)
+            taken += len(frame)
+        self._size -= taken
+        self._writable.set()
+        return b"".join(batch)
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        producer = asyncio.create_task(self._produce())
+        try:
+            while True:
+                if not self._frames and not self._closed:
+                    self._readable.clear()
+                    try:
+                        await asyncio.wait_for(self._readable.wait(), self.heartbeat_interval)
+                    except asyncio.TimeoutError:
+                        yield sse_comment("ping")
+                        continue
+
+                if not self._frames:
+                    break
+
+                if self.flush_window > 0 and self._size < self.max_batch_bytes and not self._closed:
+                    await asyncio.sleep(self.flush_window)
+
+                yield self._drain()
+
+            if self._error is not None:
+                raise self._error
+        finally:
+            # 客户端断开时取消上游；上游吞掉取消时在写入下一帧时退出
+            self._aborted = True
+            self._writable.set()
+            if not producer.done():
+                producer.cancel()
+                try:
+                    await producer
+                except asyncio.CancelledError:
+                    pass
+
+
+def sse_response(source: AsyncIterator[bytes]) -> StreamingResponse:
+    """把SSE帧生成器包装成 text/event-stream 响应"""
+    return StreamingResponse(SSEEmitter(source), media_type="text/event-stream", headers=SSE_HEADERS)
@@ -1,10 +1,14 @@
 """LLM 客户端基类"""
 import asyncio
+import copy
 from dataclasses import dataclass
 from typing import AsyncIterator, Optional, Dict, Any, List, Union
 from fastmcp import Client as MCPClient
 from fastmcp.client.transports import StreamableHttpTransport
 from exceptions import StreamTimeoutError
+from response_cache import ResponseCache, is_cacheable, make_cache_key
+from coalescing import RequestCoalescer
+from tool_cache import ToolCache
 from utils.retry import async_retry, mcp_tool_retry
 
 @dataclass
@@ -60,6 +64,7 @@ class Tool:
     description: str
     input_schema: Dict[str, Any]
     url: str  # 工具所属的 MCP URL
+    annotations: Optional[Dict[str, Any]] = None  # MCP 服务器声明的工具注解（readOnlyHint 等）
 
 class BaseLLMClient:
     """LLM 客户端基类"""
@@ -67,15 +72,24 @@ class BaseLLMClient:
     # 默认的 chunk 超时时间（秒）
     DEFAULT_CHUNK_TIMEOUT = 10.0
     
+    # 会话级状态：create_session() 为每个会话重新创建，其余属性（SDK 客户端、MCP 工具与传输）共享
+    SESSION_STATE_FIELDS = ("current_conversation", "tool_results", "thinking_process")
+    
     def __init__(
         self,
         api_key: str,
         mcp_urls: Optional[Union[str, List[str]]] = None,  # MCP 服务器 URL列表
         enable_timeout_retry: bool = True,  # 是否启用超时重试
+        response_cache: Optional["ResponseCache"] = None,  # 可选的响应缓存
+        tool_cache: Optional["ToolCache"] = None,  # 可选的 MCP 工具结果缓存
+        coalescer: Optional["RequestCoalescer"] = None,  # 可选的并发相同请求合并器
         **kwargs
     ):
         self.api_key = api_key
         self.enable_timeout_retry = enable_timeout_retry
+        self.response_cache = response_cache
+        self.tool_cache = tool_cache
+        self.coalescer = coalescer
         self.kwargs = kwargs
         
         # MCP 相关
@@ -86,6 +100,9 @@ class BaseLLMClient:
         # 初始化usage统计（子类应该重新设置价格）
         self.usage = Usage()
         
+        # 会话所属的共享客户端（共享客户端自身为 None）
+        self.parent: Optional["BaseLLMClient"] = None
+        
     @mcp_tool_retry(max_retries=3, timeout=30.0, backoff_delay=2.0)
     async def _init_mcp_connection(self, url: str):
         """初始化单个 MCP 连接并获取工具列表
@@ -116,13 +133,27 @@ class BaseLLMClient:
                     name=tool.name,
                     description=tool.description,
                     input_schema=tool.inputSchema,
-                    url=url
+                    url=url,
+                    annotations=self._dump_annotations(getattr(tool, "annotations", None))
                 )
                 
         print(f"DEBUG: MCP连接初始化完成 - {url}")
 
+    @staticmethod
+    def _dump_annotations(annotations: Any) -> Optional[Dict[str, Any]]:
+        """MCP 工具注解 -> 以协议字段名（readOnlyHint 等）为 key 的字典"""
+        if annotations is None:
+            return None
+        if hasattr(annotations, "model_dump"):
+            return annotations.model_dump(by_alias=True, exclude_none=True)
+        return dict(annotations)
+    
     async def __aenter__(self):
         """初始化 MCP 连接"""
+        if self.is_session:
+            # 会话复用共享客户端已发现的工具
+            return self
+        
         # 初始化所有 MCP 客户端
         for url in self.mcp_urls:
             try:
@@ -155,8 +186,36 @@ class BaseLLMClient:
         # 注意：不重置 mcp_tools 和 mcp_transports，因为它们是连接级别的资源
         # 如果需要重置 MCP 连接，应该使用 close() 然后重新初始化
     
+    def create_session(self) -> "BaseLLMClient":
+        """创建会话
+        
+        会话与当前客户端共享 SDK 客户端（HTTP 连接池）、MCP 传输和工具目录，
+        只持有独立的对话状态和 usage，创建开销可以忽略，不需要再调用 __aenter__
+        
+        Returns:
+            与当前客户端同类型的会话实例
+        """
+        root = self.parent or self
+        session = copy.copy(root)
+        for name in self.SESSION_STATE_FIELDS:
+            if hasattr(root, name):
+                setattr(session, name, type(getattr(root, name))())
+        session.usage = Usage(input_price=root.usage.input_price, output_price=root.usage.output_price)
+        session.parent = root
+        return session
+    
+    @property
+    def is_session(self) -> bool:
+        """是否为 create_session() 创建的会话"""
+        return self.parent is not None
+    
     async def close(self):
         """显式关闭连接和清理资源"""
+        if self.is_session:
+            # 会话不拥有共享资源，只清理自身状态
+            self.usage.reset()
+            return
+        
         # 清理 MCP 传输连接
         self.mcp_transports.clear()
         self.mcp_tools.clear()
@@ -164,6 +223,42 @@ class BaseLLMClient:
         # 重置使用统计
         self.usage.reset()
                 
+    async def _cached_create(self, create, cacheable: bool = False, **request) -> tuple:
+        """调用 SDK 的 create()；请求符合缓存条件时先查询响应缓存
+        
+        Args:
+            create: SDK 的 create 方法
+            cacheable: 是否显式标记为可缓存（否则只缓存 temperature=0 的请求）
+            **request: create 的参数
+            
+        Returns:
+            (响应字典, 是否复用了缓存或并发相同请求的结果)，复用的响应不应计入 usage
+        """
+        key = self._request_key(request, cacheable)
+        if key and self.response_cache:
+            cached = await self.response_cache.get(key)
+            if cached is not None:
+                print(f"DEBUG: 命中响应缓存 {key}")
+                return copy.deepcopy(cached), True
+        
+        if key and self.coalescer:
+            response, shared = await self.coalescer.call(key, lambda: create(**request))
+        else:
+            response, shared = await create(**request), False
+        
+        response_data = response.model_dump()
+        if key and self.response_cache and not shared:
+            await self.response_cache.set(key, copy.deepcopy(response_data))
+        return response_data, shared
+    
+    def _request_key(self, request: Dict[str, Any], cacheable: bool = False) -> Optional[str]:
+        """确定性请求的缓存/合并键；不符合条件或未启用缓存与合并时返回 None"""
+        if self.response_cache:
+            return self.response_cache.key_for(request, cacheable)
+        if self.coalescer and is_cacheable(request, cacheable):
+            return make_cache_key(request)
+        return None
+    
     def get_available_tools(self) -> List[Tool]:
         """获取所有可用的工具列表"""
         return list(self.mcp_tools.values())
@@ -172,9 +267,8 @@ class BaseLLMClient:
         """根据工具名称获取工具信息"""
         return self.mcp_tools.get(tool_name)
     
-    @mcp_tool_retry(max_retries=3, timeout=15.0, backoff_delay=1.0)
     async def call_mcp_tool(self, tool_name: str, params: Dict[str, Any]) -> Any:
-        """调用 MCP 工具
+        """调用 MCP 工具（配置了工具结果缓存时，可缓存的工具先查缓存）
         
         Args:
             tool_name: 工具名称
@@ -192,7 +286,20 @@ class BaseLLMClient:
             
         if tool.url not in self.mcp_transports:
             raise ValueError(f"MCP connection for {tool.url} not initialized")
-            
+        
+        if self.tool_cache is None:
+            return await self._call_mcp_tool_uncached(tool, params)
+        return await self.tool_cache.get_or_call(
+            tool_name,
+            params,
+            lambda: self._call_mcp_tool_uncached(tool, params),
+            annotations=tool.annotations
+        )
+    
+    @mcp_tool_retry(max_retries=3, timeout=15.0, backoff_delay=1.0)
+    async def _call_mcp_tool_uncached(self, tool: Tool, params: Dict[str, Any]) -> Any:
+        """向 MCP 服务器发起工具调用（带重试）"""
+        tool_name = tool.name
         print(f"DEBUG: MCP工具调用开始 - {tool_name}, URL: {tool.url}")
         
         # 每次调用都创建新的客户端
@@ -29,6 +29,8 @@ class ClaudeClient(BaseLLMClient):
             mcp_kwargs['mcp_urls'] = kwargs.pop('mcp_urls')
         if 'enable_timeout_retry' in kwargs:
             mcp_kwargs['enable_timeout_retry'] = kwargs.pop('enable_timeout_retry')
+        if 'tool_cache' in kwargs:
+            mcp_kwargs['tool_cache'] = kwargs.pop('tool_cache')
             
         super().__init__(api_key, **mcp_kwargs)
         # 初始化 Claude 客户端
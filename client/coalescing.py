@@ -0,0 +1,160 @@
+"""请求合并（single-flight）
+
+挂到客户端上（coalescer=RequestCoalescer()）后，并发的相同确定性请求
+（temperature=0 或显式 cacheable=True，键与响应缓存相同）共享一次上游调用：
+- 非流式请求：后到的请求等待第一个请求的上游结果
+- 流式请求：上游流在独立任务中读取，数据块追加到共享缓冲区，
+  每个订阅者持有自己的游标，从头读取缓冲区并跟随后续数据块，读取速度互不影响
+- 所有订阅者都离开时取消上游调用；上游结束后移除，之后的相同请求重新发起（或命中响应缓存）
+"""
+import asyncio
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+
+class _Flight:
+    """进行中的非流式上游调用"""
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class _Broadcast:
+    """进行中的流式上游调用及其已收到的数据块"""
+
+    def __init__(self):
+        self.chunks: List[Any] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self.task: Optional[asyncio.Task] = None
+        self.changed = asyncio.Event()
+
+    def append(self, chunk: Any):
+        self.chunks.append(chunk)
+        self._notify()
+
+    def finish(self, error: Optional[BaseException] = None):
+        self.done = True
+        self.error = error
+        self._notify()
+
+    def _notify(self):
+        # 唤醒等待中的订阅者，后续等待使用新的事件
+        changed, self.changed = self.changed, asyncio.Event()
+        changed.set()
+
+
+class RequestCoalescer:
+    """并发相同请求合并器"""
+
+    def __init__(self):
+        self._calls: Dict[str, _Flight] = {}
+        self._streams: Dict[str, _Broadcast] = {}
+        self._stats = {"upstream_calls": 0, "coalesced_calls": 0, "upstream_streams": 0, "coalesced_streams": 0}
+
+    async def call(self, key: str, factory: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """执行或加入相同的非流式调用
+
+        Args:
+            key: 请求键
+            factory: 发起上游调用的协程函数
+
+        Returns:
+            (上游结果, 是否复用了其他请求发起的调用)
+        """
+        flight = self._calls.get(key)
+        shared = flight is not None
+        if flight is None:
+            flight = _Flight(asyncio.create_task(factory()))
+            self._calls[key] = flight
+            flight.task.add_done_callback(lambda _, k=key, f=flight: self._discard(self._calls, k, f))
+            self._stats["upstream_calls"] += 1
+        else:
+            self._stats["coalesced_calls"] += 1
+
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task), shared
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                # 所有等待者都已离开（取消），不再需要上游结果
+                self._discard(self._calls, key, flight)
+                flight.task.cancel()
+
+    async def subscribe(
+        self,
+        key: str,
+        factory: Callable[[], AsyncIterator[Any]]
+    ) -> AsyncIterator[Tuple[Any, bool]]:
+        """订阅相同的流式调用
+
+        Args:
+            key: 请求键
+            factory: 创建上游流的函数
+
+        Yields:
+            (数据块, 是否复用了其他请求发起的上游流)；加入时已收到的数据块会先全部回放
+        """
+        broadcast = self._streams.get(key)
+        shared = broadcast is not None
+        if broadcast is None:
+            broadcast = _Broadcast()
+            self._streams[key] = broadcast
+            broadcast.task = asyncio.create_task(self._pump(key, broadcast, factory))
+            self._stats["upstream_streams"] += 1
+        else:
+            self._stats["coalesced_streams"] += 1
+
+        broadcast.subscribers += 1
+        cursor = 0
+        try:
+            while True:
+                changed = broadcast.changed
+                while cursor < len(broadcast.chunks):
+                    yield broadcast.chunks[cursor], shared
+                    cursor += 1
+                if broadcast.done:
+                    if broadcast.error is not None:
+                        raise broadcast.error
+                    return
+                await changed.wait()
+        finally:
+            broadcast.subscribers -= 1
+            if broadcast.subscribers == 0 and not broadcast.done:
+                # 所有订阅者都已离开：取消上游，之后的相同请求重新发起
+                self._discard(self._streams, key, broadcast)
+                broadcast.task.cancel()
+
+    async def _pump(self, key: str, broadcast: _Broadcast, factory: Callable[[], AsyncIterator[Any]]):
+        """读取上游流写入共享缓冲区"""
+        stream = factory()
+        error = None
+        try:
+            async for chunk in stream:
+                broadcast.append(chunk)
+        except asyncio.CancelledError:
+            error = asyncio.CancelledError("upstream stream cancelled")
+            raise
+        except Exception as e:
+            error = e
+        finally:
+            aclose = getattr(stream, "aclose", None)
+            if aclose:
+                await aclose()
+            broadcast.finish(error)
+            self._discard(self._streams, key, broadcast)
+
+    @staticmethod
+    def _discard(registry: Dict[str, Any], key: str, entry: Any):
+        if registry.get(key) is entry:
+            del registry[key]
+
+    def stats(self) -> Dict[str, Any]:
+        """合并统计"""
+        return {
+            **self._stats,
+            "inflight_calls": len(self._calls),
+            "inflight_streams": len(self._streams)
+        }
@@ -1,4 +1,5 @@
 """OpenAI API 客户端"""
+import copy
 import json
 from dataclasses import dataclass
 from openai import AsyncOpenAI
@@ -32,6 +33,12 @@ class OpenAIClient(BaseLLMClient):
             mcp_kwargs['mcp_urls'] = kwargs.pop('mcp_urls')
         if 'enable_timeout_retry' in kwargs:
             mcp_kwargs['enable_timeout_retry'] = kwargs.pop('enable_timeout_retry')
+        if 'response_cache' in kwargs:
+            mcp_kwargs['response_cache'] = kwargs.pop('response_cache')
+        if 'tool_cache' in kwargs:
+            mcp_kwargs['tool_cache'] = kwargs.pop('tool_cache')
+        if 'coalescer' in kwargs:
+            mcp_kwargs['coalescer'] = kwargs.pop('coalescer')
             
         super().__init__(api_key, **mcp_kwargs)
         # 初始化 OpenAI 客户端
@@ -184,17 +191,62 @@ class OpenAIClient(BaseLLMClient):
                         text_content += block.get("text", "")
         return text_content
 
+    async def _open_response_stream(self, cacheable: bool = False, **request) -> AsyncIterator[Dict[str, Any]]:
+        """流式调用 Response API
+        
+        命中响应缓存时按块回放；启用请求合并时并发的相同请求共享一个上游流；
+        上游流完成后写入响应缓存
+        
+        Args:
+            cacheable: 是否显式标记为可缓存
+            **request: responses.create 的参数（不含 stream）
+            
+        Yields:
+            流式响应的 chunk 字典
+        """
+        key = self._request_key(request, cacheable)
+        if key and self.response_cache:
+            cached = await self.response_cache.get(key)
+            if cached is not None:
+                print(f"DEBUG: 命中响应缓存，回放流式响应 {key}")
+                async for chunk_data in self.response_cache.replay_response_stream(cached):
+                    yield chunk_data
+                return
+        
+        if key and self.coalescer:
+            async for chunk_data, shared in self.coalescer.subscribe(key, lambda: self._stream_upstream(key, request)):
+                if shared and chunk_data.get("type") == "response.completed":
+                    # usage 只计入发起上游调用的请求
+                    chunk_data = {**chunk_data, "response": {**chunk_data["response"], "usage": None}}
+                yield chunk_data
+            return
+        
+        async for chunk_data in self._stream_upstream(key, request):
+            yield chunk_data
+    
+    async def _stream_upstream(self, key: Optional[str], request: Dict[str, Any]) -> AsyncIterator[Dict[str, Any]]:
+        """读取 Response API 上游流，完成后写入响应缓存"""
+        async with await self.client.responses.create(stream=True, **request) as stream:
+            print("DEBUG: 流式会话创建成功")  # 调试信息
+            async for chunk in stream:
+                chunk_data = chunk.model_dump()
+                if key and self.response_cache and chunk_data.get("type") == "response.completed":
+                    await self.response_cache.set(key, copy.deepcopy(chunk_data.get("response")))
+                yield chunk_data
+
     @async_retry(timeout=60.0)
     async def chat(self, content: str, **kwargs) -> Dict[str, Any]:
         """对话 - 使用 Response API（无状态模式）
 
         Args:
             content: 当前轮次的对话内容
+            cacheable: 显式允许缓存响应（默认只缓存 temperature=0 的请求）
 
         Returns:
             对话响应
         """
         print(f"DEBUG: chat开始处理用户输入: {content}")  # 调试信息
+        cacheable = kwargs.pop("cacheable", False)
 
         # 更新当前对话内容（客户端管理状态）
         if self.current_conversation:
@@ -220,20 +272,20 @@ class OpenAIClient(BaseLLMClient):
 
             print(f"DEBUG: 准备调用 Response API（无状态模式）...")  # 调试信息
 
-            # 调用 Response API（无状态模式：store=False）
-            response = await self.client.responses.create(
+            # 调用 Response API（无状态模式：store=False，符合条件时先查询响应缓存并合并并发的相同请求）
+            response_data, reused = await self._cached_create(
+                self.client.responses.create,
+                cacheable,
                 model=self.model,
                 input=[{"role": "user", "content": self.current_conversation}],
                 tools=all_tools if all_tools else None,
                 store=False,  # 🔑 关键：不使用服务端状态管理，保持客户端管理
                 **kwargs
             )
-
-            response_data = response.model_dump()
             print(f"DEBUG: 收到 Response API 响应")  # 调试信息
 
-            # 更新usage统计（Response API 使用 input_tokens/output_tokens）
-            if usage := response_data.get("usage"):
+            # 更新usage统计（Response API 使用 input_tokens/output_tokens，缓存命中或合并的请求不重复计入）
+            if not reused and (usage := response_data.get("usage")):
                 self.usage.input_tokens += usage.get("input_tokens", 0)
                 self.usage.output_tokens += usage.get("output_tokens", 0)
                 print(f"DEBUG: 更新usage - 输入:{usage.get('input_tokens', 0)}, 输出:{usage.get('output_tokens', 0)}")
@@ -276,11 +328,13 @@ class OpenAIClient(BaseLLMClient):
         
         Args:
             content: 当前轮次的对话内容
+            cacheable: 显式允许缓存响应（默认只缓存 temperature=0 的请求）
             
         Yields:
-            流式响应的 chunks
+            流式响应的 chunks（命中缓存时为按块回放的缓存响应）
         """
         print(f"DEBUG: stream_chat开始处理用户输入: {content}")  # 调试信息
+        cacheable = kwargs.pop("cacheable", False)
         
         # 更新当前对话内容
         if self.current_conversation:
@@ -307,44 +361,41 @@ class OpenAIClient(BaseLLMClient):
             print("DEBUG: 准备创建流式会话...")  # 调试信息
             print(all_tools)  # 调试信息
             try:
-                # 使用上下文管理器创建流式会话（无状态模式）
-                async with await self.client.responses.create(
+                # 创建流式会话（无状态模式，命中响应缓存时回放缓存）
+                stream = self._open_response_stream(
+                    cacheable,
                     model=self.model,
                     input=[{"role": "user", "content": self.current_conversation}],
                     tools=all_tools if all_tools else None,
                     store=False,  # 🔑 关键：不使用服务端状态管理，保持客户端管理
-                    stream=True,
                     **kwargs
-                ) as stream:
-                    print("DEBUG: 流式会话创建成功")  # 调试信息
-                    
-                    # 处理流式响应
-                    print("DEBUG: 开始处理流式响应...")  # 调试信息
-                    final_message = None
-                    async for chunk in stream:
-                        chunk_data = chunk.model_dump()
-                        
-                        # 如果是最后一个完整的消息，保存下来
-                        if chunk_data.get("type") == "response.completed":
-                            final_message = chunk_data.get("response")
-                            # 更新 usage 统计
-                            if usage := final_message.get("usage"):
-                                self.usage.input_tokens += usage.get("input_tokens", 0)
-                                self.usage.output_tokens += usage.get("output_tokens", 0)
-                        
-                        # 将每个 chunk 返回给调用者
-                        yield chunk_data
+                )
+                
+                # 处理流式响应
+                print("DEBUG: 开始处理流式响应...")  # 调试信息
+                final_message = None
+                async for chunk_data in stream:
+                    # 如果是最后一个完整的消息，保存下来
+                    if chunk_data.get("type") == "response.completed":
+                        final_message = chunk_data.get("response")
+                        # 更新 usage 统计（缓存回放的 usage 为空）
+                        if usage := final_message.get("usage"):
+                            self.usage.input_tokens += usage.get("input_tokens", 0)
+                            self.usage.output_tokens += usage.get("output_tokens", 0)
                     
-                    # 在同一个上下文中处理工具调用
-                    has_tool_calls = False
-                    if final_message and final_message.get("output"):
-                        for output in final_message["output"]:
-                            print(f"DEBUG: 处理工具调用输出: {output}")  # 调试信息
-                            result = await self._process_stream_tool_call(output)
-                            if result:
-                                has_tool_calls = True
-                                # 添加工具调用结果到对话内容
-                                self.current_conversation += f"Tool <{result.tool_name}> Result Returned: {result.tool_result}\n"
+                    # 将每个 chunk 返回给调用者
+                    yield chunk_data
+                
+                # 处理工具调用
+                has_tool_calls = False
+                if final_message and final_message.get("output"):
+                    for output in final_message["output"]:
+                        print(f"DEBUG: 处理工具调用输出: {output}")  # 调试信息
+                        result = await self._process_stream_tool_call(output)
+                        if result:
+                            has_tool_calls = True
+                            # 添加工具调用结果到对话内容
+                            self.current_conversation += f"Tool <{result.tool_name}> Result Returned: {result.tool_result}\n"
                     
                 print("DEBUG: 流式响应处理完成")  # 调试信息
                 
@@ -38,6 +38,12 @@ class QwenClient(BaseLLMClient):
             mcp_kwargs['mcp_urls'] = kwargs.pop('mcp_urls')
         if 'enable_timeout_retry' in kwargs:
             mcp_kwargs['enable_timeout_retry'] = kwargs.pop('enable_timeout_retry')
+        if 'response_cache' in kwargs:
+            mcp_kwargs['response_cache'] = kwargs.pop('response_cache')
+        if 'tool_cache' in kwargs:
+            mcp_kwargs['tool_cache'] = kwargs.pop('tool_cache')
+        if 'coalescer' in kwargs:
+            mcp_kwargs['coalescer'] = kwargs.pop('coalescer')
             
         super().__init__(api_key, **mcp_kwargs)
         
@@ -313,11 +319,13 @@ class QwenClient(BaseLLMClient):
         
         Args:
             content: 当前轮次的对话内容
+            cacheable: 显式允许缓存响应（默认只缓存 temperature=0 的请求）
             
         Returns:
             对话响应
         """
         print(f"DEBUG: chat开始处理用户输入: {content}")  # 调试信息
+        cacheable = kwargs.pop("cacheable", False)
         
         # 🚀 自动增强prompt以支持结构化输出
         enhanced_content = self._enhance_content_with_json_format(content, **kwargs)
@@ -348,8 +356,10 @@ class QwenClient(BaseLLMClient):
             
             print(f"DEBUG: 准备调用chat completions API...")  # 调试信息
             
-            # 调用chat completions API
-            response = await self.client.chat.completions.create(
+            # 调用chat completions API（符合条件时先查询响应缓存，并合并并发的相同请求）
+            response_data, reused = await self._cached_create(
+                self.client.chat.completions.create,
+                cacheable,
                 model=self.model,
                 messages=[
                     {"role": "user", "content": self.current_conversation}
@@ -357,12 +367,10 @@ class QwenClient(BaseLLMClient):
                 tools=all_tools if all_tools else None,  # 如果没有工具就不传tools参数
                 **kwargs
             )
-            
-            response_data = response.model_dump()
             print(f"DEBUG: 收到API响应")  # 调试信息
             
-            # 更新usage统计
-            if usage := response_data.get("usage"):
+            # 更新usage统计（缓存命中或合并的请求不重复计入）
+            if not reused and (usage := response_data.get("usage")):
                 self.usage.input_tokens += usage.get("prompt_tokens", 0)
                 self.usage.output_tokens += usage.get("completion_tokens", 0)
                 print(f"DEBUG: 更新usage - 输入:{usage.get('prompt_tokens', 0)}, 输出:{usage.get('completion_tokens', 0)}")
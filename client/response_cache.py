@@ -0,0 +1,221 @@
+"""LLM 响应缓存
+
+可选的响应缓存层，挂到客户端上（response_cache=ResponseCache(...)）后生效：
+- 缓存键为模型、输入消息、工具和采样参数的规范化哈希（Unicode NFKC + 空白折叠 + 排序键 JSON）
+- 只有 temperature 为 0 或显式传入 cacheable=True 的请求才会读写缓存
+- 两级存储：进程内 LRU + 可选的 Redis，均带 TTL；Redis 命中时回填进程内缓存
+- 流式请求命中时按块回放缓存的完整响应，事件格式与实时流一致
+"""
+import asyncio
+import hashlib
+import json
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Dict, Optional
+
+# 不参与缓存键计算的请求参数（不影响生成内容）
+IGNORED_PARAMS = {"stream", "store", "timeout", "extra_headers", "user", "metadata"}
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """Unicode NFKC 规范化并折叠连续空白"""
+    return _WHITESPACE.sub(" ", unicodedata.normalize("NFKC", text)).strip()
+
+
+def _normalize(value: Any) -> Any:
+    if isinstance(value, str):
+        return normalize_text(value)
+    if isinstance(value, dict):
+        return {str(k): _normalize(v) for k, v in value.items() if v is not None}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    return value
+
+
+def make_cache_key(request: Dict[str, Any], namespace: str = "llm") -> str:
+    """计算请求的缓存键
+
+    Args:
+        request: 传给 SDK create() 的参数（model、input/messages、tools、采样参数等）
+        namespace: 键前缀
+
+    Returns:
+        缓存键
+    """
+    canonical = _normalize({k: v for k, v in request.items() if k not in IGNORED_PARAMS})
+    payload = json.dumps(canonical, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+    return f"{namespace}:response:{hashlib.sha256(payload.encode('utf-8')).hexdigest()}"
+
+
+def is_cacheable(request: Dict[str, Any], cacheable: bool = False) -> bool:
+    """是否允许缓存：显式标记，或采样温度为 0（确定性输出）"""
+    return cacheable or request.get("temperature") == 0
+
+
+class MemoryTier:
+    """进程内 LRU 缓存（带 TTL）"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max(1, max_entries)
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any, ttl: float):
+        self._entries[key] = (value, time.monotonic() + ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class RedisTier:
+    """Redis 缓存（JSON 序列化，多进程共享）"""
+
+    def __init__(self, url: Optional[str] = None, client: Any = None):
+        if client is None:
+            try:
+                import redis.asyncio as redis
+            except ImportError as e:
+                raise ImportError("使用 Redis 缓存需要安装 redis: pip install redis") from e
+            client = redis.from_url(url or "redis://localhost:6379/0", decode_responses=True)
+        self.client = client
+
+    async def get(self, key: str) -> Optional[Any]:
+        raw = await self.client.get(key)
+        return json.loads(raw) if raw else None
+
+    async def set(self, key: str, value: Any, ttl: float):
+        await self.client.set(key, json.dumps(value, ensure_ascii=False, default=str), ex=max(1, int(ttl)))
+
+
+class ResponseCache:
+    """两级响应缓存"""
+
+    def __init__(
+        self,
+        max_entries: int = 1000,
+        ttl: float = 3600.0,
+        redis_url: Optional[str] = None,
+        redis_client: Any = None,
+        namespace: str = "llm",
+        replay_chunk_chars: int = 16,
+        replay_interval: float = 0.0
+    ):
+        """
+        Args:
+            max_entries: 进程内缓存条目上限
+            ttl: 缓存有效期（秒）
+            redis_url: Redis 地址，与 redis_client 都为空时只使用进程内缓存
+            redis_client: 已创建的 redis.asyncio 客户端
+            namespace: 缓存键前缀
+            replay_chunk_chars: 流式回放时每个文本增量的字符数
+            replay_interval: 流式回放时相邻增量的间隔（秒），0 表示不等待
+        """
+        self.ttl = ttl
+        self.namespace = namespace
+        self.replay_chunk_chars = max(1, replay_chunk_chars)
+        self.replay_interval = replay_interval
+        self.memory = MemoryTier(max_entries)
+        self.redis = RedisTier(redis_url, redis_client) if (redis_url or redis_client) else None
+        self._stats = {"memory_hits": 0, "redis_hits": 0, "misses": 0, "stores": 0, "errors": 0}
+
+    def key_for(self, request: Dict[str, Any], cacheable: bool = False) -> Optional[str]:
+        """符合缓存条件时返回缓存键，否则返回 None"""
+        if not is_cacheable(request, cacheable):
+            return None
+        return make_cache_key(request, self.namespace)
+
+    async def get(self, key: str) -> Optional[Any]:
+        """依次查询进程内缓存和 Redis"""
+        value = self.memory.get(key)
+        if value is not None:
+            self._stats["memory_hits"] += 1
+            return value
+
+        if self.redis:
+            try:
+                value = await self.redis.get(key)
+            except Exception as e:
+                # 缓存故障不影响正常调用
+                self._stats["errors"] += 1
+                print(f"WARNING: 响应缓存读取失败: {type(e).__name__}: {str(e)}")
+                value = None
+            if value is not None:
+                self._stats["redis_hits"] += 1
+                self.memory.set(key, value, self.ttl)
+                return value
+
+        self._stats["misses"] += 1
+        return None
+
+    async def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        """写入两级缓存"""
+        ttl = ttl or self.ttl
+        self.memory.set(key, value, ttl)
+        self._stats["stores"] += 1
+        if self.redis:
+            try:
+                await self.redis.set(key, value, ttl)
+            except Exception as e:
+                self._stats["errors"] += 1
+                print(f"WARNING: 响应缓存写入失败: {type(e).__name__}: {str(e)}")
+
+    async def replay_response_stream(self, response: Dict[str, Any]) -> AsyncIterator[Dict[str, Any]]:
+        """按 Response API 流式事件格式回放缓存的响应
+
+        文本按 replay_chunk_chars 切分为增量事件；response.completed 中的 usage 置空，
+        回放不计入 token 使用量
+        """
+        yield {"type": "response.created", "response": {**response, "output": [], "usage": None}}
+
+        for output_index, item in enumerate(response.get("output") or []):
+            yield {"type": "response.output_item.added", "output_index": output_index, "item": item}
+            if item.get("type") == "message":
+                for content_index, block in enumerate(item.get("content") or []):
+                    text = block.get("text") or ""
+                    for start in range(0, len(text), self.replay_chunk_chars):
+                        if self.replay_interval > 0:
+                            await asyncio.sleep(self.replay_interval)
+                        yield {
+                            "type": "response.output_text.delta",
+                            "item_id": item.get("id"),
+                            "output_index": output_index,
+                            "content_index": content_index,
+                            "delta": text[start:start + self.replay_chunk_chars]
+                        }
+                    yield {
+                        "type": "response.output_text.done",
+                        "item_id": item.get("id"),
+                        "output_index": output_index,
+                        "content_index": content_index,
+                        "text": text
+                    }
+            yield {"type": "response.output_item.done", "output_index": output_index, "item": item}
+
+        yield {"type": "response.completed", "response": {**response, "usage": None}}
+
+    def stats(self) -> Dict[str, Any]:
+        """命中统计"""
+        hits = self._stats["memory_hits"] + self._stats["redis_hits"]
+        lookups = hits + self._stats["misses"]
+        return {
+            **self._stats,
+            "entries": len(self.memory),
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0
+        }
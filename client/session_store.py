@@ -0,0 +1,139 @@
+"""会话存储
+
+在共享客户端之上为每个会话保存独立的对话状态：
+- 不带 session_id 的请求使用一次性会话，请求结束即丢弃
+- 带 session_id 的多轮会话按 LRU 保留，空闲超过 TTL 的会话被淘汰；
+  正在使用（持有会话锁）的会话不会被淘汰，max_sessions 是软上限
+- 同一会话的请求通过会话锁串行执行，不同会话互不影响
+- 单个会话的对话内容超过上限时只保留最近的部分
+"""
+import asyncio
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Dict, Any, Optional
+
+from base_client import BaseLLMClient
+
+
+@dataclass
+class _SessionEntry:
+    """存储中的会话"""
+    session: BaseLLMClient
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    last_used: float = field(default_factory=time.monotonic)
+
+
+class SessionStore:
+    """LRU + TTL 会话存储"""
+
+    def __init__(
+        self,
+        client: BaseLLMClient,
+        max_sessions: int = 1000,
+        ttl: float = 1800.0,
+        max_conversation_chars: int = 20000
+    ):
+        """
+        Args:
+            client: 共享客户端（已完成 __aenter__）
+            max_sessions: 保留的多轮会话数上限（软上限，使用中的会话可以超出）
+            ttl: 会话空闲过期时间（秒）
+            max_conversation_chars: 单个会话对话内容的字符数上限
+        """
+        self.client = client
+        self.max_sessions = max(1, max_sessions)
+        self.ttl = ttl
+        self.max_conversation_chars = max_conversation_chars
+        self._sessions: "OrderedDict[str, _SessionEntry]" = OrderedDict()
+        self._evicted = 0
+        self._expired = 0
+
+    @asynccontextmanager
+    async def session(self, session_id: Optional[str] = None) -> AsyncIterator[BaseLLMClient]:
+        """获取会话并持有会话锁
+
+        Args:
+            session_id: 会话 ID，为空时使用一次性会话
+
+        Yields:
+            会话客户端
+        """
+        if not session_id:
+            yield self.client.create_session()
+            return
+
+        entry = self._get_or_create(session_id)
+        async with entry.lock:
+            try:
+                yield entry.session
+            finally:
+                entry.last_used = time.monotonic()
+                # 按释放时间排序，LRU 顺序与 last_used 一致
+                if self._sessions.get(session_id) is entry:
+                    self._sessions.move_to_end(session_id)
+                self._trim_conversation(entry.session)
+
+    def _get_or_create(self, session_id: str) -> _SessionEntry:
+        self._expire()
+        entry = self._sessions.get(session_id)
+        if entry is None:
+            entry = _SessionEntry(session=self.client.create_session())
+            self._sessions[session_id] = entry
+            self._evict(keep=session_id)
+        else:
+            self._sessions.move_to_end(session_id)
+        entry.last_used = time.monotonic()
+        return entry
+
+    def _evict(self, keep: str):
+        """超过上限时淘汰最久未使用的空闲会话；使用中的会话跳过，全部在使用时暂时超出上限"""
+        excess = len(self._sessions) - self.max_sessions
+        if excess <= 0:
+            return
+        evicted = []
+        for session_id, entry in self._sessions.items():
+            if len(evicted) >= excess:
+                break
+            if session_id != keep and not entry.lock.locked():
+                evicted.append(session_id)
+        for session_id in evicted:
+            del self._sessions[session_id]
+            self._evicted += 1
+
+    def _expire(self):
+        """按 LRU 顺序从最旧的会话开始淘汰过期会话，跳过使用中的会话"""
+        deadline = time.monotonic() - self.ttl
+        expired = []
+        for session_id, entry in self._sessions.items():
+            if entry.lock.locked():
+                continue
+            if entry.last_used > deadline:
+                break
+            expired.append(session_id)
+        for session_id in expired:
+            del self._sessions[session_id]
+            self._expired += 1
+
+    def _trim_conversation(self, session: BaseLLMClient):
+        """对话内容超过上限时从行边界截断，只保留最近的内容"""
+        conversation = getattr(session, "current_conversation", None)
+        if not conversation or len(conversation) <= self.max_conversation_chars:
+            return
+        tail = conversation[-self.max_conversation_chars:]
+        newline = tail.find("\n")
+        session.current_conversation = tail[newline + 1:] if newline != -1 else tail
+
+    def discard(self, session_id: str) -> bool:
+        """删除会话"""
+        return self._sessions.pop(session_id, None) is not None
+
+    def stats(self) -> Dict[str, Any]:
+        """会话存储统计"""
+        return {
+            "sessions": len(self._sessions),
+            "max_sessions": self.max_sessions,
+            "evicted": self._evicted,
+            "expired": self._expired
+        }
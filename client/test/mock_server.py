@@ -0,0 +1,480 @@
+#!/usr/bin/env python3
+"""
+本地模拟服务 - 离线压测和回归测试用的 LLM / MCP 替身
+
+在一个端口上同时提供：
+- OpenAI Responses API:        POST /v1/responses（支持 stream）
+- OpenAI Chat Completions API: POST /v1/chat/completions（支持 stream，兼容 QwenClient）
+- Anthropic Messages API:      POST /v1/messages（支持 stream）
+- MCP streamable-HTTP:         /mcp/（工具 add / greet / sleep）
+- 统计:                        GET /mock/stats
+
+回复内容、输出速率、延迟、错误和工具调用由场景文件中的规则决定（见 scenarios.example.json），
+客户端代码无需修改，只需把地址指向本服务：
+
+    python mock_server.py --port 8900 --scenario scenarios.example.json
+
+    export OPENAI_BASE_URL="http://127.0.0.1:8900/v1"   # OpenAIClient / QwenClient
+    export MCP_URL="http://127.0.0.1:8900/mcp/"
+    # ClaudeClient(api_key="x", base_url="http://127.0.0.1:8900")
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import random
+import re
+import time
+import uuid
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from fastmcp import FastMCP
+
+DEFAULT_TEXT = "这是来自本地模拟服务的回复。This is a reply from the local mock server."
+
+
+@dataclass
+class ToolCallSpec:
+    """规则触发的工具调用"""
+    name: str
+    arguments: Dict[str, Any] = field(default_factory=dict)
+
+
+@dataclass
+class Rule:
+    """场景规则：match 匹配请求中的全部消息文本（正则，为空时匹配所有请求）"""
+    match: str = ""
+    text: Optional[str] = None
+    tool_call: Optional[ToolCallSpec] = None
+    latency_ms: float = 0.0
+    tokens_per_second: Optional[float] = None
+    error_status: Optional[int] = None
+    error_message: str = "mock upstream error"
+    error_rate: float = 1.0
+    disconnect_after_tokens: Optional[int] = None
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Rule":
+        error = data.get("error") or {}
+        tool_call = data.get("tool_call")
+        return cls(
+            match=data.get("match", ""),
+            text=data.get("text"),
+            tool_call=ToolCallSpec(tool_call["name"], tool_call.get("arguments", {})) if tool_call else None,
+            latency_ms=float(data.get("latency_ms", 0)),
+            tokens_per_second=data.get("tokens_per_second"),
+            error_status=error.get("status"),
+            error_message=error.get("message", "mock upstream error"),
+            error_rate=float(error.get("rate", 1.0)),
+            disconnect_after_tokens=data.get("disconnect_after_tokens")
+        )
+
+
+@dataclass
+class Reply:
+    """一次请求的回复计划"""
+    rule: Rule
+    text: str
+    tool_call: Optional[ToolCallSpec]
+    pieces: List[str]
+    input_tokens: int
+    output_tokens: int
+
+
+@dataclass
+class Scenario:
+    """场景：按顺序匹配规则，第一条匹配的规则生效"""
+    rules: List[Rule] = field(default_factory=list)
+    default_text: str = DEFAULT_TEXT
+    tokens_per_second: float = 50.0
+    chars_per_token: int = 4
+
+    @classmethod
+    def load(cls, path: Optional[str] = None, **overrides) -> "Scenario":
+        data: Dict[str, Any] = {}
+        if path:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        scenario = cls(
+            rules=[Rule.from_dict(r) for r in data.get("rules", [])],
+            default_text=data.get("default_text", DEFAULT_TEXT),
+            tokens_per_second=float(data.get("tokens_per_second", 50.0)),
+            chars_per_token=max(1, int(data.get("chars_per_token", 4)))
+        )
+        for name, value in overrides.items():
+            if value is not None:
+                setattr(scenario, name, value)
+        return scenario
+
+    def plan(self, prompt: str) -> Reply:
+        rule = next((r for r in self.rules if re.search(r.match, prompt)), Rule())
+        tool_call = rule.tool_call
+        # 对话中已有该工具的返回结果时（客户端工具循环的下一轮）直接回复文本，避免无限循环
+        if tool_call and re.search(rf"Tool <?{re.escape(tool_call.name)}>?", prompt):
+            tool_call = None
+        text = rule.text if rule.text is not None else self.default_text
+        if tool_call:
+            text = ""
+        pieces = [text[i:i + self.chars_per_token] for i in range(0, len(text), self.chars_per_token)]
+        arguments_tokens = math.ceil(len(json.dumps(tool_call.arguments)) / self.chars_per_token) if tool_call else 0
+        return Reply(
+            rule=rule,
+            text=text,
+            tool_call=tool_call,
+            pieces=pieces,
+            input_tokens=max(1, math.ceil(len(prompt) / self.chars_per_token)),
+            output_tokens=len(pieces) + arguments_tokens
+        )
+
+    def rate_for(self, reply: Reply) -> float:
+        rate = reply.rule.tokens_per_second
+        return self.tokens_per_second if rate is None else float(rate)
+
+
+class MockDisconnect(Exception):
+    """模拟上游在流式输出中途断开"""
+
+
+def _text_of(value: Any) -> str:
+    """提取消息中的全部文本（兼容字符串内容和内容块列表）"""
+    if isinstance(value, str):
+        return value
+    if isinstance(value, list):
+        return "\n".join(_text_of(v) for v in value)
+    if isinstance(value, dict):
+        return "\n".join(_text_of(value[k]) for k in ("content", "text", "input") if k in value)
+    return ""
+
+
+def _new_id(prefix: str) -> str:
+    return f"{prefix}_{uuid.uuid4().hex[:24]}"
+
+
+async def _paced(reply: Reply, rate: float) -> AsyncIterator[str]:
+    """按速率输出文本片段；达到 disconnect_after_tokens 时中断"""
+    interval = 1.0 / rate if rate > 0 else 0.0
+    for index, piece in enumerate(reply.pieces):
+        if reply.rule.disconnect_after_tokens is not None and index >= reply.rule.disconnect_after_tokens:
+            raise MockDisconnect(f"mock disconnect after {index} tokens")
+        if interval:
+            await asyncio.sleep(interval)
+        yield piece
+
+
+def _sse(data: Dict[str, Any], event: Optional[str] = None) -> bytes:
+    head = f"event: {event}\n" if event else ""
+    return f"{head}data: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8")
+
+
+# ========== OpenAI Responses API ==========
+
+def _responses_output(reply: Reply, message_id: str, call_id: str) -> List[Dict[str, Any]]:
+    if reply.tool_call:
+        return [{
+            "type": "function_call",
+            "id": _new_id("fc"),
+            "call_id": call_id,
+            "name": reply.tool_call.name,
+            "arguments": json.dumps(reply.tool_call.arguments, ensure_ascii=False),
+            "status": "completed"
+        }]
+    return [{
+        "type": "message",
+        "id": message_id,
+        "role": "assistant",
+        "status": "completed",
+        "content": [{"type": "output_text", "text": reply.text, "annotations": []}]
+    }]
+
+
+def _responses_object(reply: Reply, model: str, response_id: str, status: str,
+                      output: List[Dict[str, Any]]) -> Dict[str, Any]:
+    return {
+        "id": response_id,
+        "object": "response",
+        "created_at": int(time.time()),
+        "model": model,
+        "status": status,
+        "output": output,
+        "parallel_tool_calls": True,
+        "tool_choice": "auto",
+        "tools": [],
+        "usage": {
+            "input_tokens": reply.input_tokens,
+            "output_tokens": reply.output_tokens,
+            "total_tokens": reply.input_tokens + reply.output_tokens,
+            "input_tokens_details": {"cached_tokens": 0},
+            "output_tokens_details": {"reasoning_tokens": 0}
+        } if status == "completed" else None
+    }
+
+
+async def _responses_stream(reply: Reply, model: str, rate: float) -> AsyncIterator[bytes]:
+    response_id, message_id, call_id = _new_id("resp"), _new_id("msg"), _new_id("call")
+    output = _responses_output(reply, message_id, call_id)
+    sequence = iter(range(1_000_000))
+
+    def event(data: Dict[str, Any]) -> bytes:
+        data["sequence_number"] = next(sequence)
+        return _sse(data, data["type"])
+
+    yield event({"type": "response.created", "response": _responses_object(reply, model, response_id, "in_progress", [])})
+    item = output[0]
+    if reply.tool_call:
+        yield event({"type": "response.output_item.added", "output_index": 0, "item": {**item, "arguments": "", "status": "in_progress"}})
+        yield event({"type": "response.function_call_arguments.delta", "item_id": item["id"], "output_index": 0, "delta": item["arguments"]})
+        yield event({"type": "response.function_call_arguments.done", "item_id": item["id"], "output_index": 0, "arguments": item["arguments"]})
+    else:
+        yield event({"type": "response.output_item.added", "output_index": 0, "item": {**item, "content": [], "status": "in_progress"}})
+        part = {"type": "output_text", "text": "", "annotations": []}
+        yield event({"type": "response.content_part.added", "item_id": message_id, "output_index": 0, "content_index": 0, "part": part})
+        async for piece in _paced(reply, rate):
+            yield event({"type": "response.output_text.delta", "item_id": message_id, "output_index": 0,
+                         "content_index": 0, "delta": piece, "logprobs": []})
+        yield event({"type": "response.output_text.done", "item_id": message_id, "output_index": 0,
+                     "content_index": 0, "text": reply.text, "logprobs": []})
+        yield event({"type": "response.content_part.done", "item_id": message_id, "output_index": 0,
+                     "content_index": 0, "part": {**part, "text": reply.text}})
+    yield event({"type": "response.output_item.done", "output_index": 0, "item": item})
+    yield event({"type": "response.completed", "response": _responses_object(reply, model, response_id, "completed", output)})
+
+
+# ========== OpenAI Chat Completions API ==========
+
+def _chat_tool_calls(reply: Reply) -> List[Dict[str, Any]]:
+    return [{
+        "index": 0,
+        "id": _new_id("call"),
+        "type": "function",
+        "function": {"name": reply.tool_call.name, "arguments": json.dumps(reply.tool_call.arguments, ensure_ascii=False)}
+    }]
+
+
+def _chat_usage(reply: Reply) -> Dict[str, int]:
+    return {
+        "prompt_tokens": reply.input_tokens,
+        "completion_tokens": reply.output_tokens,
+        "total_tokens": reply.input_tokens + reply.output_tokens
+    }
+
+
+def _chat_completion(reply: Reply, model: str) -> Dict[str, Any]:
+    message: Dict[str, Any] = {"role": "assistant", "content": reply.text or None}
+    if reply.tool_call:
+        message["tool_calls"] = [{k: v for k, v in call.items() if k != "index"} for call in _chat_tool_calls(reply)]
+    return {
+        "id": _new_id("chatcmpl"),
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "message": message,
+            "finish_reason": "tool_calls" if reply.tool_call else "stop"
+        }],
+        "usage": _chat_usage(reply)
+    }
+
+
+async def _chat_stream(reply: Reply, model: str, rate: float, include_usage: bool) -> AsyncIterator[bytes]:
+    completion_id, created = _new_id("chatcmpl"), int(time.time())
+
+    def chunk(delta: Dict[str, Any], finish_reason: Optional[str] = None, usage: Any = None) -> bytes:
+        data = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}] if delta is not None else [],
+        }
+        if usage is not None:
+            data["usage"] = usage
+        return _sse(data)
+
+    yield chunk({"role": "assistant", "content": ""})
+    if reply.tool_call:
+        yield chunk({"tool_calls": _chat_tool_calls(reply)})
+    async for piece in _paced(reply, rate):
+        yield chunk({"content": piece})
+    yield chunk({}, "tool_calls" if reply.tool_call else "stop")
+    if include_usage:
+        yield chunk(None, usage=_chat_usage(reply))
+    yield b"data: [DONE]\n\n"
+
+
+# ========== Anthropic Messages API ==========
+
+def _anthropic_content(reply: Reply) -> List[Dict[str, Any]]:
+    if reply.tool_call:
+        return [{"type": "tool_use", "id": _new_id("toolu"), "name": reply.tool_call.name, "input": reply.tool_call.arguments}]
+    return [{"type": "text", "text": reply.text}]
+
+
+def _anthropic_message(reply: Reply, model: str, content: List[Dict[str, Any]], output_tokens: int) -> Dict[str, Any]:
+    return {
+        "id": _new_id("msg"),
+        "type": "message",
+        "role": "assistant",
+        "model": model,
+        "content": content,
+        "stop_reason": ("tool_use" if reply.tool_call else "end_turn") if content else None,
+        "stop_sequence": None,
+        "usage": {"input_tokens": reply.input_tokens, "output_tokens": output_tokens}
+    }
+
+
+async def _anthropic_stream(reply: Reply, model: str, rate: float) -> AsyncIterator[bytes]:
+    def event(data: Dict[str, Any]) -> bytes:
+        return _sse(data, data["type"])
+
+    yield event({"type": "message_start", "message": _anthropic_message(reply, model, [], 1)})
+    block = _anthropic_content(reply)[0]
+    if reply.tool_call:
+        yield event({"type": "content_block_start", "index": 0, "content_block": {**block, "input": {}}})
+        yield event({"type": "content_block_delta", "index": 0,
+                     "delta": {"type": "input_json_delta", "partial_json": json.dumps(block["input"], ensure_ascii=False)}})
+    else:
+        yield event({"type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}})
+        yield event({"type": "ping"})
+        async for piece in _paced(reply, rate):
+            yield event({"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": piece}})
+    yield event({"type": "content_block_stop", "index": 0})
+    yield event({
+        "type": "message_delta",
+        "delta": {"stop_reason": "tool_use" if reply.tool_call else "end_turn", "stop_sequence": None},
+        "usage": {"output_tokens": reply.output_tokens}
+    })
+    yield event({"type": "message_stop"})
+
+
+# ========== MCP ==========
+
+def create_mcp_server() -> FastMCP:
+    """模拟 MCP 服务器：add / greet 声明为确定性工具，sleep 模拟慢工具"""
+    mcp = FastMCP("MockMCP")
+    deterministic = {"readOnlyHint": True, "openWorldHint": False}
+
+    @mcp.tool(annotations=deterministic)
+    def add(a: int, b: int) -> int:
+        """Add two numbers"""
+        return a + b
+
+    @mcp.tool(annotations=deterministic)
+    def greet(name: str) -> str:
+        """Returns a simple greeting."""
+        return f"Hello, {name}!"
+
+    @mcp.tool()
+    async def sleep(seconds: float = 1.0) -> str:
+        """Sleep for the given number of seconds and report it."""
+        await asyncio.sleep(seconds)
+        return f"slept {seconds}s"
+
+    return mcp
+
+
+# ========== 应用 ==========
+
+def create_app(scenario: Scenario) -> FastAPI:
+    """创建模拟服务应用"""
+    mcp_app = create_mcp_server().http_app(path="/mcp/")
+    app = FastAPI(title="Mock LLM & MCP Server", lifespan=mcp_app.lifespan)
+    stats: Counter = Counter()
+
+    async def prepare(protocol: str, prompt: str):
+        """匹配规则、注入延迟；需要注入错误时返回错误状态码"""
+        stats[f"{protocol}_requests"] += 1
+        reply = scenario.plan(prompt)
+        if reply.rule.latency_ms > 0:
+            await asyncio.sleep(reply.rule.latency_ms / 1000)
+        if reply.rule.error_status and random.random() < reply.rule.error_rate:
+            stats[f"{protocol}_errors"] += 1
+            return reply, reply.rule.error_status
+        stats[f"{protocol}_output_tokens"] += reply.output_tokens
+        return reply, None
+
+    def openai_error(status: int, message: str) -> JSONResponse:
+        return JSONResponse({"error": {"message": message, "type": "server_error", "code": status}}, status_code=status)
+
+    def stream(body: AsyncIterator[bytes]) -> StreamingResponse:
+        return StreamingResponse(body, media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+    @app.post("/v1/responses")
+    async def responses(request: Request):
+        body = await request.json()
+        reply, error = await prepare("responses", _text_of(body.get("input")))
+        if error:
+            return openai_error(error, reply.rule.error_message)
+        model = body.get("model", "mock")
+        if body.get("stream"):
+            return stream(_responses_stream(reply, model, scenario.rate_for(reply)))
+        output = _responses_output(reply, _new_id("msg"), _new_id("call"))
+        return _responses_object(reply, model, _new_id("resp"), "completed", output)
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        reply, error = await prepare("chat", _text_of(body.get("messages")))
+        if error:
+            return openai_error(error, reply.rule.error_message)
+        model = body.get("model", "mock")
+        if body.get("stream"):
+            include_usage = bool((body.get("stream_options") or {}).get("include_usage"))
+            return stream(_chat_stream(reply, model, scenario.rate_for(reply), include_usage))
+        return _chat_completion(reply, model)
+
+    @app.post("/v1/messages")
+    async def messages(request: Request):
+        body = await request.json()
+        reply, error = await prepare("messages", _text_of(body.get("messages")))
+        if error:
+            return JSONResponse(
+                {"type": "error", "error": {"type": "api_error", "message": reply.rule.error_message}},
+                status_code=error
+            )
+        model = body.get("model", "mock")
+        if body.get("stream"):
+            return stream(_anthropic_stream(reply, model, scenario.rate_for(reply)))
+        return _anthropic_message(reply, model, _anthropic_content(reply), reply.output_tokens)
+
+    @app.get("/v1/models")
+    async def models():
+        return {"object": "list", "data": [{"id": "mock", "object": "model", "created": 0, "owned_by": "mock"}]}
+
+    @app.get("/mock/stats")
+    async def mock_stats():
+        return dict(stats)
+
+    app.mount("/", mcp_app)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地模拟 LLM / MCP 服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--scenario", help="场景文件（JSON），为空时所有请求返回默认文本")
+    parser.add_argument("--tokens-per-second", type=float, help="流式输出速率，覆盖场景文件，0表示不限速")
+    parser.add_argument("--chars-per-token", type=int, help="每个token的字符数，覆盖场景文件")
+    args = parser.parse_args()
+
+    scenario = Scenario.load(
+        args.scenario,
+        tokens_per_second=args.tokens_per_second,
+        chars_per_token=args.chars_per_token
+    )
+    print(f"🧪 启动本地模拟服务: http://{args.host}:{args.port}")
+    print(f"   OPENAI_BASE_URL=http://{args.host}:{args.port}/v1")
+    print(f"   MCP_URL=http://{args.host}:{args.port}/mcp/")
+    print(f"   规则数: {len(scenario.rules)}, 输出速率: {scenario.tokens_per_second} tokens/s")
+    uvicorn.run(create_app(scenario), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+"""RequestCoalescer：并发相同请求合并、订阅者扇出与取消（pytest + pytest-asyncio）"""
+import sys
+import os
+# 添加client目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import asyncio
+
+import pytest
+
+from coalescing import RequestCoalescer
+
+
+class Upstream:
+    """可控的上游：记录调用次数，release 之前一直挂起"""
+
+    def __init__(self, result="ok"):
+        self.result = result
+        self.calls = 0
+        self.cancelled = 0
+        self.release = asyncio.Event()
+
+    async def call(self):
+        self.calls += 1
+        try:
+            await self.release.wait()
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        if isinstance(self.result, Exception):
+            raise self.result
+        return self.result
+
+    async def stream(self, chunks):
+        self.calls += 1
+        try:
+            for chunk in chunks:
+                await self.release.wait()
+                yield chunk
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+
+
+@pytest.mark.asyncio
+async def test_concurrent_calls_share_one_upstream():
+    coalescer = RequestCoalescer()
+    upstream = Upstream()
+
+    waiters = [asyncio.create_task(coalescer.call("k", upstream.call)) for _ in range(10)]
+    await asyncio.sleep(0)
+    upstream.release.set()
+    results = await asyncio.gather(*waiters)
+
+    assert upstream.calls == 1
+    assert [result for result, _ in results] == ["ok"] * 10
+    assert sum(shared for _, shared in results) == 9
+    assert coalescer.stats()["inflight_calls"] == 0
+
+
+@pytest.mark.asyncio
+async def test_different_keys_not_coalesced():
+    coalescer = RequestCoalescer()
+    upstream = Upstream()
+    upstream.release.set()
+
+    await asyncio.gather(coalescer.call("a", upstream.call), coalescer.call("b", upstream.call))
+
+    assert upstream.calls == 2
+
+
+@pytest.mark.asyncio
+async def test_error_fans_out_to_all_waiters():
+    coalescer = RequestCoalescer()
+    upstream = Upstream(result=RuntimeError("upstream 500"))
+
+    waiters = [asyncio.create_task(coalescer.call("k", upstream.call)) for _ in range(3)]
+    await asyncio.sleep(0)
+    upstream.release.set()
+    results = await asyncio.gather(*waiters, return_exceptions=True)
+
+    assert upstream.calls == 1
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+
+@pytest.mark.asyncio
+async def test_one_waiter_cancelled_others_still_served():
+    coalescer = RequestCoalescer()
+    upstream = Upstream()
+
+    first = asyncio.create_task(coalescer.call("k", upstream.call))
+    second = asyncio.create_task(coalescer.call("k", upstream.call))
+    await asyncio.sleep(0)
+    first.cancel()
+    await asyncio.sleep(0)
+    upstream.release.set()
+
+    assert await second == ("ok", True)
+    assert first.cancelled()
+    assert upstream.cancelled == 0
+
+
+@pytest.mark.asyncio
+async def test_all_waiters_cancelled_cancels_upstream():
+    coalescer = RequestCoalescer()
+    upstream = Upstream()
+
+    waiters = [asyncio.create_task(coalescer.call("k", upstream.call)) for _ in range(2)]
+    await asyncio.sleep(0)
+    for waiter in waiters:
+        waiter.cancel()
+    await asyncio.gather(*waiters, return_exceptions=True)
+    await asyncio.sleep(0)
+
+    assert upstream.cancelled == 1
+    assert coalescer.stats()["inflight_calls"] == 0
+
+    # 之后的相同请求重新发起上游调用
+    upstream.release.set()
+    assert await coalescer.call("k", upstream.call) == ("ok", False)
+    assert upstream.calls == 2
+
+
+async def consume(coalescer, key, factory):
+    return [item async for item in coalescer.subscribe(key, factory)]
+
+
+@pytest.mark.asyncio
+async def test_stream_fans_out_and_replays_for_late_subscribers():
+    coalescer = RequestCoalescer()
+    gate = asyncio.Queue()
+    calls = []
+
+    async def upstream():
+        calls.append(1)
+        while (chunk := await gate.get()) is not None:
+            yield chunk
+
+    early = asyncio.create_task(consume(coalescer, "k", upstream))
+    await gate.put("a")
+    await asyncio.sleep(0.01)
+    # 上游进行中加入的订阅者先回放已收到的数据块，再跟随后续数据块
+    late = asyncio.create_task(consume(coalescer, "k", upstream))
+    await asyncio.sleep(0.01)
+    for chunk in ("b", "c", None):
+        await gate.put(chunk)
+
+    assert await early == [("a", False), ("b", False), ("c", False)]
+    assert await late == [("a", True), ("b", True), ("c", True)]
+    assert len(calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_stream_subscribers_read_at_their_own_pace():
+    coalescer = RequestCoalescer()
+    upstream = Upstream()
+    upstream.release.set()
+    chunks = list(range(20))
+    factory = lambda: upstream.stream(chunks)
+
+    async def slow_consumer():
+        received = []
+        async for chunk, _ in coalescer.subscribe("k", factory):
+            received.append(chunk)
+            await asyncio.sleep(0.001)
+        return received
+
+    fast, slow = await asyncio.gather(consume(coalescer, "k", factory), slow_consumer())
+
+    assert upstream.calls == 1
+    assert [chunk for chunk, _ in fast] == chunks
+    assert slow == chunks
+    assert [shared for _, shared in fast] == [False] * 20
+
+
+@pytest.mark.asyncio
+async def test_stream_upstream_cancelled_when_all_subscribers_leave():
+    coalescer = RequestCoalescer()
+    upstream = Upstream()
+    factory = lambda: upstream.stream(["a", "b", "c"])
+
+    subscribers = [asyncio.create_task(consume(coalescer, "k", factory)) for _ in range(2)]
+    await asyncio.sleep(0.01)
+    for subscriber in subscribers:
+        subscriber.cancel()
+    await asyncio.gather(*subscribers, return_exceptions=True)
+    await asyncio.sleep(0.01)
+
+    assert upstream.cancelled == 1
+    assert coalescer.stats()["inflight_streams"] == 0
+
+
+@pytest.mark.asyncio
+async def test_stream_error_propagates_to_subscribers():
+    coalescer = RequestCoalescer()
+
+    async def failing():
+        yield "a"
+        raise RuntimeError("disconnected")
+
+    received = []
+    with pytest.raises(RuntimeError, match="disconnected"):
+        async for chunk, _ in coalescer.subscribe("k", failing):
+            received.append(chunk)
+
+    assert received == ["a"]
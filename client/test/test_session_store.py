@@ -0,0 +1,115 @@
+"""SessionStore：LRU/TTL 淘汰跳过使用中的会话、会话串行与对话截断（pytest + pytest-asyncio）"""
+import sys
+import os
+# 添加client目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import asyncio
+
+import pytest
+
+import session_store
+from session_store import SessionStore
+
+
+class Session:
+    def __init__(self, number):
+        self.number = number
+        self.current_conversation = ""
+
+
+class Client:
+    """只实现 create_session 的共享客户端"""
+
+    def __init__(self):
+        self.created = 0
+
+    def create_session(self):
+        self.created += 1
+        return Session(self.created)
+
+
+async def use(store, session_id):
+    async with store.session(session_id) as session:
+        return session.number
+
+
+@pytest.mark.asyncio
+async def test_same_session_id_reuses_session():
+    store = SessionStore(Client())
+
+    assert await use(store, "a") == await use(store, "a")
+    assert await use(store, None) != await use(store, None)
+    assert store.stats()["sessions"] == 1
+
+
+@pytest.mark.asyncio
+async def test_lru_eviction():
+    store = SessionStore(Client(), max_sessions=2)
+
+    await use(store, "a")
+    await use(store, "b")
+    await use(store, "a")
+    await use(store, "c")
+
+    assert set(store._sessions) == {"a", "c"}
+    assert store.stats()["evicted"] == 1
+
+
+@pytest.mark.asyncio
+async def test_eviction_skips_sessions_in_use():
+    store = SessionStore(Client(), max_sessions=1)
+
+    async with store.session("a") as held:
+        # 上限已满但 a 正在使用：暂时超出软上限，a 不被淘汰
+        await use(store, "b")
+        assert set(store._sessions) == {"a", "b"}
+        # 空闲的 b 被淘汰，新会话保留
+        await use(store, "c")
+        assert set(store._sessions) == {"a", "c"}
+
+    assert await use(store, "a") == held.number
+
+
+@pytest.mark.asyncio
+async def test_expiry_skips_sessions_in_use(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(session_store.time, "monotonic", lambda: now[0])
+    store = SessionStore(Client(), ttl=10)
+
+    await use(store, "idle")
+    async with store.session("busy") as held:
+        now[0] += 60
+        await use(store, "new")
+        assert set(store._sessions) == {"busy", "new"}
+
+    assert await use(store, "busy") == held.number
+    assert store.stats()["expired"] == 1
+
+
+@pytest.mark.asyncio
+async def test_requests_in_one_session_are_serialized():
+    store = SessionStore(Client())
+    active, overlaps = [], []
+
+    async def request(session_id):
+        async with store.session(session_id):
+            active.append(session_id)
+            overlaps.append(active.count(session_id) > 1)
+            await asyncio.sleep(0.01)
+            active.remove(session_id)
+
+    await asyncio.gather(*(request(session_id) for session_id in ("a", "a", "b", "b")))
+
+    assert not any(overlaps)
+
+
+@pytest.mark.asyncio
+async def test_conversation_trimmed_at_line_boundary():
+    store = SessionStore(Client(), max_conversation_chars=10)
+
+    async with store.session("a") as session:
+        session.current_conversation = "line1\nline2\nline3"
+
+    # 截断后的不完整行被丢弃
+    assert session.current_conversation == "line3"
@@ -0,0 +1,195 @@
+"""ToolCache：可缓存性判断、TTL、single-flight 与取消（pytest + pytest-asyncio）"""
+import sys
+import os
+# 添加client目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import tool_cache
+from tool_cache import ToolCache, is_deterministic_tool, make_tool_key
+
+DETERMINISTIC = {"readOnlyHint": True, "openWorldHint": False}
+
+
+class Tool:
+    """可控的 MCP 工具调用：记录调用次数，release 之前一直挂起"""
+
+    def __init__(self, result="3", error=None):
+        self.result = result
+        self.error = error
+        self.calls = 0
+        self.release = asyncio.Event()
+        self.release.set()
+
+    async def __call__(self):
+        self.calls += 1
+        await self.release.wait()
+        if self.error:
+            raise self.error
+        return self.result
+
+
+@pytest.mark.parametrize("annotations, expected", [
+    (None, False),
+    ({}, False),
+    ({"readOnlyHint": True}, False),  # openWorldHint 缺省为 true
+    ({"readOnlyHint": True, "openWorldHint": True}, False),
+    ({"readOnlyHint": False, "openWorldHint": False}, False),
+    (DETERMINISTIC, True),
+])
+def test_is_deterministic_tool(annotations, expected):
+    assert is_deterministic_tool(annotations) is expected
+
+
+def test_key_ignores_param_order():
+    assert make_tool_key("add", {"a": 1, "b": 2}) == make_tool_key("add", {"b": 2, "a": 1})
+    assert make_tool_key("add", {"a": 1}) != make_tool_key("add", {"a": 2})
+    assert make_tool_key("add", None) == make_tool_key("add", {})
+
+
+def test_ttl_resolution():
+    cache = ToolCache(default_ttl=60, tool_ttls={"weather": 5, "add": 0})
+
+    assert cache.ttl_for("weather") == 5
+    assert cache.ttl_for("add", DETERMINISTIC) == 0  # 配置优先于注解
+    assert cache.ttl_for("greet", DETERMINISTIC) == 60
+    assert cache.ttl_for("greet") == 0
+    assert ToolCache(use_annotations=False).ttl_for("greet", DETERMINISTIC) == 0
+
+
+@pytest.mark.asyncio
+async def test_hit_after_first_call():
+    cache = ToolCache()
+    tool = Tool()
+
+    first = await cache.get_or_call("add", {"a": 1, "b": 2}, tool, DETERMINISTIC)
+    second = await cache.get_or_call("add", {"b": 2, "a": 1}, tool, DETERMINISTIC)
+
+    assert first == second == "3"
+    assert tool.calls == 1
+    assert cache.stats()["hits"] == 1
+
+
+@pytest.mark.asyncio
+async def test_non_cacheable_tool_always_called():
+    cache = ToolCache()
+    tool = Tool()
+
+    for _ in range(3):
+        await cache.get_or_call("search", {"q": "x"}, tool)
+
+    assert tool.calls == 3
+    assert cache.stats()["entries"] == 0
+
+
+@pytest.mark.asyncio
+async def test_entries_expire(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(tool_cache.time, "monotonic", lambda: now[0])
+    cache = ToolCache(default_ttl=10)
+    tool = Tool()
+
+    await cache.get_or_call("add", {}, tool, DETERMINISTIC)
+    now[0] += 5
+    await cache.get_or_call("add", {}, tool, DETERMINISTIC)
+    now[0] += 10
+    await cache.get_or_call("add", {}, tool, DETERMINISTIC)
+
+    assert tool.calls == 2
+
+
+@pytest.mark.asyncio
+async def test_lru_eviction():
+    cache = ToolCache(max_entries=2)
+    tool = Tool()
+
+    for value in (1, 2, 1, 3):
+        await cache.get_or_call("add", {"a": value}, tool, DETERMINISTIC)
+    # a=2 最久未使用，被淘汰
+    await cache.get_or_call("add", {"a": 2}, tool, DETERMINISTIC)
+
+    assert tool.calls == 4
+    assert cache.stats()["evictions"] == 2
+
+
+@pytest.mark.asyncio
+async def test_single_flight_for_concurrent_calls():
+    cache = ToolCache()
+    tool = Tool()
+    tool.release.clear()
+
+    calls = [asyncio.create_task(cache.get_or_call("add", {"a": 1}, tool, DETERMINISTIC)) for _ in range(5)]
+    await asyncio.sleep(0)
+    tool.release.set()
+
+    assert await asyncio.gather(*calls) == ["3"] * 5
+    assert tool.calls == 1
+    assert cache.stats()["coalesced"] == 4
+    assert cache.stats()["inflight"] == 0
+
+
+@pytest.mark.asyncio
+async def test_errors_shared_but_not_cached():
+    cache = ToolCache()
+    tool = Tool(error=RuntimeError("mcp down"))
+    tool.release.clear()
+
+    calls = [asyncio.create_task(cache.get_or_call("add", {}, tool, DETERMINISTIC)) for _ in range(3)]
+    await asyncio.sleep(0)
+    tool.release.set()
+    results = await asyncio.gather(*calls, return_exceptions=True)
+
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert tool.calls == 1
+
+    tool.error = None
+    assert await cache.get_or_call("add", {}, tool, DETERMINISTIC) == "3"
+    assert tool.calls == 2
+
+
+@pytest.mark.asyncio
+async def test_is_error_results_not_cached():
+    cache = ToolCache()
+    tool = Tool(result=SimpleNamespace(isError=True))
+
+    await cache.get_or_call("add", {}, tool, DETERMINISTIC)
+    await cache.get_or_call("add", {}, tool, DETERMINISTIC)
+
+    assert tool.calls == 2
+
+
+@pytest.mark.asyncio
+async def test_follower_calls_tool_when_leader_cancelled():
+    cache = ToolCache()
+    tool = Tool()
+    tool.release.clear()
+
+    leader = asyncio.create_task(cache.get_or_call("add", {}, tool, DETERMINISTIC))
+    await asyncio.sleep(0)
+    follower = asyncio.create_task(cache.get_or_call("add", {}, tool, DETERMINISTIC))
+    await asyncio.sleep(0)
+    leader.cancel()
+    await asyncio.sleep(0)
+    tool.release.set()
+
+    assert await follower == "3"
+    assert leader.cancelled()
+    assert tool.calls == 2
+
+
+@pytest.mark.asyncio
+async def test_invalidate():
+    cache = ToolCache()
+    tool = Tool()
+
+    await cache.get_or_call("add", {}, tool, DETERMINISTIC)
+    await cache.get_or_call("greet", {}, tool, DETERMINISTIC)
+    cache.invalidate("add")
+    await cache.get_or_call("add", {}, tool, DETERMINISTIC)
+    await cache.get_or_call("greet", {}, tool, DETERMINISTIC)
+
+    assert tool.calls == 3
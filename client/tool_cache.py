@@ -0,0 +1,165 @@
+"""MCP 工具结果缓存
+
+挂到客户端上（tool_cache=ToolCache(...)）后，call_mcp_tool 对可缓存的工具先查缓存：
+- 缓存键为工具名 + 规范化的 JSON 参数（排序键、紧凑分隔符）
+- 工具是否可缓存由配置（tool_ttls）或 MCP 服务器声明的工具注解决定：
+  readOnlyHint=true 且 openWorldHint=false（只读且不依赖外部状态）的工具视为确定性工具
+- 缓存按 TTL 过期，条目数超过上限时按 LRU 淘汰
+- 并发的相同调用只向 MCP 服务器发出一次（single-flight），其余调用等待同一结果
+- 调用失败或返回 isError 的结果不缓存
+"""
+import asyncio
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+
+def make_tool_key(tool_name: str, params: Optional[Dict[str, Any]]) -> str:
+    """计算工具调用的缓存键"""
+    payload = json.dumps(params or {}, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+    return f"tool:{tool_name}:{hashlib.sha256(payload.encode('utf-8')).hexdigest()}"
+
+
+def is_deterministic_tool(annotations: Optional[Dict[str, Any]]) -> bool:
+    """根据 MCP 工具注解判断工具结果是否可缓存"""
+    if not annotations:
+        return False
+    # openWorldHint 缺省为 true（可能访问外部系统），必须显式声明为 false
+    return bool(annotations.get("readOnlyHint")) and annotations.get("openWorldHint") is False
+
+
+class ToolCache:
+    """MCP 工具结果缓存（LRU + TTL + single-flight）"""
+
+    def __init__(
+        self,
+        max_entries: int = 1000,
+        default_ttl: float = 300.0,
+        tool_ttls: Optional[Dict[str, float]] = None,
+        use_annotations: bool = True
+    ):
+        """
+        Args:
+            max_entries: 缓存条目上限
+            default_ttl: 通过注解判定为可缓存的工具使用的 TTL（秒）
+            tool_ttls: 按工具名配置的 TTL（秒），优先于注解；TTL 为 0 表示该工具不缓存
+            use_annotations: 是否根据 MCP 工具注解判断可缓存性
+        """
+        self.max_entries = max(1, max_entries)
+        self.default_ttl = default_ttl
+        self.tool_ttls = dict(tool_ttls or {})
+        self.use_annotations = use_annotations
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._stats = {"hits": 0, "misses": 0, "coalesced": 0, "stores": 0, "evictions": 0, "errors": 0}
+        self._tool_stats: Dict[str, Dict[str, int]] = {}
+
+    def ttl_for(self, tool_name: str, annotations: Optional[Dict[str, Any]] = None) -> float:
+        """工具结果的缓存时间，0 表示不缓存"""
+        if tool_name in self.tool_ttls:
+            return max(0.0, self.tool_ttls[tool_name])
+        if self.use_annotations and is_deterministic_tool(annotations):
+            return self.default_ttl
+        return 0.0
+
+    async def get_or_call(
+        self,
+        tool_name: str,
+        params: Optional[Dict[str, Any]],
+        call: Callable[[], Awaitable[Any]],
+        annotations: Optional[Dict[str, Any]] = None
+    ) -> Any:
+        """返回缓存的工具结果，未命中时执行 call 并缓存结果
+
+        Args:
+            tool_name: 工具名称
+            params: 工具参数
+            call: 实际调用 MCP 工具的协程函数
+            annotations: MCP 服务器声明的工具注解
+
+        Returns:
+            工具调用结果
+        """
+        ttl = self.ttl_for(tool_name, annotations)
+        if ttl <= 0:
+            return await call()
+
+        key = make_tool_key(tool_name, params)
+        entry = self._entries.get(key)
+        if entry is not None:
+            result, expires_at = entry
+            if expires_at >= time.monotonic():
+                self._entries.move_to_end(key)
+                self._record(tool_name, "hits")
+                return result
+            del self._entries[key]
+
+        # 相同调用正在进行中：等待其结果
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self._record(tool_name, "coalesced")
+            try:
+                return await asyncio.shield(inflight)
+            except asyncio.CancelledError:
+                if not inflight.cancelled():
+                    raise
+                # 发起调用的请求被取消：自行调用
+                return await call()
+
+        self._record(tool_name, "misses")
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result = await call()
+        except BaseException as e:
+            self._stats["errors"] += 1
+            if isinstance(e, asyncio.CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(e)
+                # 没有等待者时避免 "exception was never retrieved" 警告
+                future.exception()
+            raise
+        else:
+            future.set_result(result)
+            if not getattr(result, "isError", False):
+                self._store(key, result, ttl)
+            return result
+        finally:
+            self._inflight.pop(key, None)
+
+    def _store(self, key: str, result: Any, ttl: float):
+        self._entries[key] = (result, time.monotonic() + ttl)
+        self._entries.move_to_end(key)
+        self._stats["stores"] += 1
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    def _record(self, tool_name: str, field: str):
+        self._stats[field] += 1
+        tool_stats = self._tool_stats.setdefault(tool_name, {"hits": 0, "misses": 0, "coalesced": 0})
+        tool_stats[field] += 1
+
+    def invalidate(self, tool_name: Optional[str] = None):
+        """清除某个工具（为空时全部工具）的缓存结果"""
+        if tool_name is None:
+            self._entries.clear()
+            return
+        prefix = f"tool:{tool_name}:"
+        for key in [k for k in self._entries if k.startswith(prefix)]:
+            del self._entries[key]
+
+    def stats(self) -> Dict[str, Any]:
+        """命中统计（coalesced 计为命中）"""
+        hits = self._stats["hits"] + self._stats["coalesced"]
+        lookups = hits + self._stats["misses"]
+        return {
+            **self._stats,
+            "entries": len(self._entries),
+            "inflight": len(self._inflight),
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            "tools": {name: dict(counts) for name, counts in self._tool_stats.items()}
+        }